@@ -8,9 +8,21 @@ import gc
 import re
 import hashlib
 import json
+import csv
+import shutil
+import itertools
+import threading
+import multiprocessing
+import cProfile
+import tracemalloc
+from collections import deque, Counter
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional, Any
 from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
 from google.oauth2 import service_account
 import os
 import sys
@@ -19,11 +31,1015 @@ from dotenv import load_dotenv
 # Carrega variáveis de ambiente
 load_dotenv()
 
+# Mesmos marcadores de nulo que o pd.read_csv usa por padrão (paridade entre leitores)
+VALORES_NULOS_CSV = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+                     '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+# ==============================================================================
+# CONTROLE DE MEMÓRIA - TAMANHO ADAPTATIVO DOS CHUNKS
+# ==============================================================================
+
+def interpretar_tamanho(valor: str) -> int:
+    """Converte tamanhos como '4G', '512M' ou '2048' (MB) em bytes"""
+    match = re.fullmatch(r'\s*(\d+(?:[.,]\d+)?)\s*([KMGT]?)i?B?\s*', valor.upper())
+    if not match:
+        raise ValueError(f"Tamanho inválido: '{valor}'")
+    
+    numero = float(match.group(1).replace(',', '.'))
+    multiplicadores = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4, '': 1024**2}
+    return int(numero * multiplicadores[match.group(2)])
+
+def obter_rss_atual() -> Optional[int]:
+    """Retorna a memória residente (RSS) do processo em bytes, se disponível"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+class ControladorChunkMemoria:
+    """Ajusta o tamanho dos chunks para manter o pico de RSS dentro do orçamento"""
+    
+    FATOR_SEGURANCA = 0.8       # Fração do orçamento usada pelos chunks
+    CHUNK_SONDA = 100000        # Primeiro chunk usado para medir bytes por linha
+    CHUNK_MINIMO = 10000
+    CHUNK_MAXIMO = 5000000
+    
+    def __init__(self, memoria_maxima: Optional[int], chunk_padrao: int,
+                 memoria_base: Optional[int] = None, workers: int = 1):
+        self.memoria_maxima = memoria_maxima
+        self.ativo = memoria_maxima is not None
+        self.workers = max(1, workers)  # Arquivos processados ao mesmo tempo dividem o orçamento
+        self.tamanho_atual = min(chunk_padrao, self.CHUNK_SONDA) if self.ativo else chunk_padrao
+        if memoria_base is None and self.ativo:
+            memoria_base = obter_rss_atual()
+        self.memoria_base = memoria_base or 0
+        self.bytes_por_linha = None
+        self.pico_rss = self.memoria_base
+    
+    def proximo_tamanho(self) -> int:
+        """Número de linhas do próximo chunk"""
+        return self.tamanho_atual
+    
+    def precisa_medir(self) -> bool:
+        """Indica se o próximo chunk é o de calibração (medição de bytes por linha)"""
+        return self.ativo and self.bytes_por_linha is None
+    
+    def registrar_chunk(self, linhas: int, bytes_estimados: Optional[int] = None,
+                        rss_pico: Optional[int] = None):
+        """Recalcula o tamanho do chunk a partir da memória observada no chunk anterior"""
+        if rss_pico is not None:
+            self.pico_rss = max(self.pico_rss, rss_pico)
+        
+        if not self.ativo or linhas == 0:
+            return
+        
+        if self.bytes_por_linha is None:
+            # Primeiro chunk: calibra bytes por linha (bruto + filtrado + traduzido)
+            bytes_chunk = bytes_estimados or 0
+            if rss_pico is not None and self.memoria_base:
+                bytes_chunk = max(bytes_chunk, (rss_pico - self.memoria_base) / self.workers)
+            if bytes_chunk <= 0:
+                return
+            self.bytes_por_linha = bytes_chunk / linhas
+        elif rss_pico is not None and rss_pico > self.memoria_maxima:
+            # Estourou o orçamento: a estimativa estava otimista, corrige proporcionalmente
+            self.bytes_por_linha *= rss_pico / (self.memoria_maxima * self.FATOR_SEGURANCA)
+        
+        disponivel = (self.memoria_maxima * self.FATOR_SEGURANCA - self.memoria_base) / self.workers
+        if disponivel <= 0:
+            novo_tamanho = self.CHUNK_MINIMO
+        else:
+            # Cresce no máximo 2x por chunk para não saltar direto para um OOM
+            novo_tamanho = min(int(disponivel / self.bytes_por_linha), self.tamanho_atual * 2)
+        
+        self.tamanho_atual = max(self.CHUNK_MINIMO, min(self.CHUNK_MAXIMO, novo_tamanho))
+
+# ==============================================================================
+# AGREGADOS EM STREAMING - TABELAS RESUMO CALCULADAS NO PASSE DE CHUNKS
+# ==============================================================================
+
+class AcumuladorAgregados:
+    """Grava agregados parciais por chunk (contagem, soma e soma dos quadrados) ao lado do CSV tratado"""
+    
+    COLUNAS_METRICAS = ['vinculos', 'remuneracao_n', 'remuneracao_soma', 'remuneracao_soma_quadrados']
+    
+    def __init__(self, caminho_csv: str, niveis: Dict[str, List[str]], coluna_valor: str):
+        self.caminho_csv = caminho_csv
+        self.niveis = niveis
+        self.coluna_valor = coluna_valor
+        self.arquivos = {}
+    
+    def caminho(self, nivel: str) -> str:
+        """Arquivo de agregados parciais de um nível"""
+        base = self.caminho_csv[:-len('_tratado.csv')] if self.caminho_csv.endswith('_tratado.csv') \
+            else os.path.splitext(self.caminho_csv)[0]
+        return f"{base}_agregado_{nivel}.csv"
+    
+    def validar(self, bytes_confirmados: Dict[str, int]) -> bool:
+        """Verifica se os arquivos contêm tudo o que o checkpoint confirmou"""
+        return all(os.path.exists(self.caminho(nivel)) and
+                   os.path.getsize(self.caminho(nivel)) >= bytes_confirmados.get(nivel, 0)
+                   for nivel in self.niveis)
+    
+    def abrir(self, bytes_confirmados: Optional[Dict[str, int]] = None):
+        """Abre os arquivos de agregados, descartando o que não foi confirmado"""
+        for nivel in self.niveis:
+            caminho = self.caminho(nivel)
+            if bytes_confirmados is None:
+                self.arquivos[nivel] = open(caminho, 'w', encoding='utf-8', newline='')
+            else:
+                with open(caminho, 'r+b') as f:
+                    f.truncate(bytes_confirmados.get(nivel, 0))
+                self.arquivos[nivel] = open(caminho, 'a', encoding='utf-8', newline='')
+    
+    @classmethod
+    def agregar(cls, df: pd.DataFrame, chaves: List[str], coluna_valor: str) -> pd.DataFrame:
+        """Agrupa um DataFrame nas métricas acumuláveis (somáveis entre chunks e arquivos)"""
+        valores = pd.to_numeric(df[coluna_valor], errors='coerce')
+        base = pd.DataFrame({
+            'vinculos': 1,
+            'remuneracao_n': valores.notna().astype('int64'),
+            'remuneracao_soma': valores.fillna(0.0),
+            'remuneracao_soma_quadrados': valores.fillna(0.0) ** 2
+        }, index=df.index)
+        for chave in chaves:
+            base[chave] = df[chave] if chave in df.columns else None
+        return base.groupby(chaves, dropna=False, sort=False)[cls.COLUNAS_METRICAS].sum().reset_index()
+    
+    def calcular_parciais(self, df_tratado: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """Agrega um chunk já tratado (colunas sanitizadas) em cada nível, sem gravar"""
+        return {nivel: self.agregar(df_tratado, chaves, self.coluna_valor) for nivel, chaves in self.niveis.items()}
+    
+    def gravar_parciais(self, parciais: Dict[str, pd.DataFrame]):
+        """Grava agregados parciais já calculados (ex.: por um processo de tratamento)"""
+        for nivel, parcial in parciais.items():
+            arquivo = self.arquivos[nivel]
+            parcial.to_csv(arquivo, header=arquivo.tell() == 0, index=False, sep=';')
+    
+    def acumular(self, df_tratado: pd.DataFrame):
+        """Grava os agregados parciais de um chunk já tratado (colunas sanitizadas)"""
+        self.gravar_parciais(self.calcular_parciais(df_tratado))
+    
+    def sincronizar(self) -> Dict[str, int]:
+        """Garante os agregados em disco e retorna o tamanho confirmado de cada arquivo"""
+        tamanhos = {}
+        for nivel, arquivo in self.arquivos.items():
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+            tamanhos[nivel] = os.fstat(arquivo.fileno()).st_size
+        return tamanhos
+    
+    def fechar(self):
+        """Fecha os arquivos abertos"""
+        for arquivo in self.arquivos.values():
+            arquivo.close()
+        self.arquivos = {}
+    
+    @classmethod
+    def combinar(cls, caminhos: List[str], chaves: List[str]) -> pd.DataFrame:
+        """Soma agregados parciais de vários chunks/arquivos em um único resultado"""
+        partes = [pd.read_csv(c, sep=';', dtype={chave: str for chave in chaves},
+                              keep_default_na=False, na_values=[''])
+                  for c in caminhos if os.path.exists(c) and os.path.getsize(c) > 0]
+        if not partes:
+            return pd.DataFrame(columns=chaves + cls.COLUNAS_METRICAS)
+        return (pd.concat(partes, ignore_index=True)
+                .groupby(chaves, dropna=False, sort=True)[cls.COLUNAS_METRICAS].sum().reset_index())
+    
+    def compactar(self):
+        """Reduz os parciais de cada chunk a uma linha por grupo ao final do arquivo"""
+        for nivel, chaves in self.niveis.items():
+            caminho = self.caminho(nivel)
+            self.combinar([caminho], chaves).to_csv(caminho, index=False, sep=';')
+
+# ==============================================================================
+# ÍNDICE DE ESTABELECIMENTOS - ENRIQUECIMENTO DOS VÍNCULOS COM O RAIS_ESTAB_PUB
+# ==============================================================================
+
+class IndiceEstabelecimentos:
+    """Índice compacto do RAIS_ESTAB_PUB consultado por busca vetorizada nos chunks de vínculos"""
+    
+    # Chave real, presente apenas nos arquivos identificados
+    CHAVE_REAL = 'CNPJ / CEI'
+    
+    # Nos arquivos públicos os vínculos só compartilham atributos: coluna do vínculo -> coluna do estabelecimento
+    CHAVES_COMPARTILHADAS = {
+        'Mun Trab': 'Município',
+        'CNAE 2.0 Subclasse': 'CNAE 2.0 Subclasse',
+        'Tamanho Estabelecimento': 'Tamanho Estabelecimento',
+        'Natureza Jurídica': 'Natureza Jurídica',
+    }
+    
+    # Colunas adicionadas aos vínculos
+    COLUNAS = ['Estab Quantidade', 'Estab Vínculos Ativos', 'Estab Simples (%)', 'Estab IBGE Subsetor']
+    
+    def __init__(self, tabela: pd.DataFrame):
+        self.tabela = tabela
+        self.chaves = list(tabela.index.names)
+    
+    @classmethod
+    def construir(cls, caminho_txt: str, caminho_indice: str, chunksize: int) -> 'IndiceEstabelecimentos':
+        """Lê o arquivo de estabelecimentos em chunks e grava o índice agrupado pela chave"""
+        with open(caminho_txt, 'r', encoding='latin-1', newline='') as f:
+            cabecalho = next(csv.reader([f.readline().rstrip('\r\n')], delimiter=';'))
+        
+        mapa_chaves = {cls.CHAVE_REAL: cls.CHAVE_REAL} if cls.CHAVE_REAL in cabecalho else cls.CHAVES_COMPARTILHADAS
+        faltando = [coluna for coluna in mapa_chaves.values() if coluna not in cabecalho]
+        if faltando:
+            raise Exception(f"Colunas de chave ausentes no RAIS_ESTAB_PUB: {', '.join(faltando)}")
+        
+        chaves = list(mapa_chaves)
+        colunas = list(mapa_chaves.values()) + [c for c in ('Qtd Vínculos Ativos', 'Ind Simples', 'IBGE Subsetor')
+                                                if c in cabecalho]
+        parciais = []
+        
+        with pd.read_csv(caminho_txt, sep=';', encoding='latin-1', dtype=str, usecols=colunas,
+                         chunksize=chunksize) as leitor:
+            for chunk in leitor:
+                chunk = chunk.rename(columns={estab: vinculo for vinculo, estab in mapa_chaves.items()})
+                base = pd.DataFrame({chave: chunk[chave].str.strip() for chave in chaves})
+                base['Estab Quantidade'] = 1
+                base['Estab Vínculos Ativos'] = (pd.to_numeric(chunk['Qtd Vínculos Ativos'], errors='coerce')
+                                                 if 'Qtd Vínculos Ativos' in chunk else 0)
+                base['simples'] = (chunk['Ind Simples'].str.strip() == '1').astype('int64') \
+                    if 'Ind Simples' in chunk else 0
+                base['Estab IBGE Subsetor'] = chunk['IBGE Subsetor'] if 'IBGE Subsetor' in chunk else None
+                
+                parciais.append(base.groupby(chaves, sort=False).agg({
+                    'Estab Quantidade': 'sum', 'Estab Vínculos Ativos': 'sum',
+                    'simples': 'sum', 'Estab IBGE Subsetor': 'first'}))
+        
+        tabela = pd.concat(parciais).groupby(level=chaves, sort=True).agg({
+            'Estab Quantidade': 'sum', 'Estab Vínculos Ativos': 'sum',
+            'simples': 'sum', 'Estab IBGE Subsetor': 'first'})
+        tabela['Estab Simples (%)'] = (100 * tabela['simples'] / tabela['Estab Quantidade']).round(2)
+        tabela = tabela[cls.COLUNAS]
+        
+        tabela.to_csv(caminho_indice, sep=';')
+        return cls(tabela)
+    
+    @classmethod
+    def carregar(cls, caminho_indice: str) -> 'IndiceEstabelecimentos':
+        tabela = pd.read_csv(caminho_indice, sep=';', dtype=str, keep_default_na=False, na_values=[''])
+        chaves = [coluna for coluna in tabela.columns if coluna not in cls.COLUNAS]
+        return cls(tabela.set_index(chaves))
+    
+    def enriquecer(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Adiciona os atributos do estabelecimento a cada vínculo (nulo quando não há correspondência)"""
+        if any(chave not in df.columns for chave in self.chaves):
+            return df.assign(**{coluna: None for coluna in self.COLUNAS})
+        
+        if len(self.chaves) == 1:
+            alvo = pd.Index(df[self.chaves[0]].str.strip())
+        else:
+            alvo = pd.MultiIndex.from_arrays([df[chave].str.strip() for chave in self.chaves])
+        valores = self.tabela.reindex(alvo)
+        return df.assign(**{coluna: valores[coluna].to_numpy() for coluna in self.COLUNAS})
+
+# ==============================================================================
+# QUALIDADE DOS DADOS - ESTATÍSTICAS ACUMULADAS NO PASSE DE CHUNKS
+# ==============================================================================
+
+class EstatisticasQualidade:
+    """Contadores por arquivo: linhas lidas/mantidas, nulos na origem e códigos sem tradução ('N/I')"""
+    
+    def __init__(self, dados: Optional[Dict[str, Any]] = None):
+        dados = dados or {}
+        self.linhas_lidas = dados.get('linhas_lidas', 0)
+        self.linhas_mantidas = dados.get('linhas_mantidas', 0)
+        self.nulos = dict(dados.get('nulos', {}))
+        self.nao_traduzidos = dict(dados.get('nao_traduzidos', {}))
+    
+    @staticmethod
+    def _somar_contagens(destino: Dict[str, int], origem: Dict[str, int]):
+        for coluna, quantidade in origem.items():
+            destino[coluna] = destino.get(coluna, 0) + quantidade
+    
+    def somar(self, linhas_lidas: int, linhas_mantidas: int, medidas: Dict[str, Dict[str, int]]):
+        """Acumula as medidas de um chunk"""
+        self.linhas_lidas += linhas_lidas
+        self.linhas_mantidas += linhas_mantidas
+        self._somar_contagens(self.nulos, medidas.get('nulos', {}))
+        self._somar_contagens(self.nao_traduzidos, medidas.get('nao_traduzidos', {}))
+    
+    def combinar(self, outra: 'EstatisticasQualidade'):
+        """Soma as estatísticas de outro arquivo (totais do ano)"""
+        self.somar(outra.linhas_lidas, outra.linhas_mantidas,
+                   {'nulos': outra.nulos, 'nao_traduzidos': outra.nao_traduzidos})
+    
+    def taxas(self, contagens: Dict[str, int]) -> List[Tuple[str, float]]:
+        """Taxas por coluna sobre as linhas mantidas, da maior para a menor"""
+        if not self.linhas_mantidas:
+            return []
+        return sorted(((coluna, quantidade / self.linhas_mantidas) for coluna, quantidade in contagens.items()),
+                      key=lambda item: item[1], reverse=True)
+    
+    def para_dict(self) -> Dict[str, Any]:
+        return {'linhas_lidas': self.linhas_lidas, 'linhas_mantidas': self.linhas_mantidas,
+                'nulos': self.nulos, 'nao_traduzidos': self.nao_traduzidos}
+
+# ==============================================================================
+# MONITOR DE EXECUÇÃO - VAZÃO E PREVISÃO DE TÉRMINO AO VIVO
+# ==============================================================================
+
+class MonitorExecucao:
+    """Publica etapa atual, vazão por etapa e previsão de término em um arquivo de status"""
+    
+    INTERVALO_GRAVACAO = 2.0  # segundos mínimos entre gravações periódicas
+    
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self.inicio = time.time()
+        self.pesos = {}           # arquivo pendente -> peso (tamanho compactado ou 1)
+        self.peso_total = 0
+        self.peso_concluido = 0
+        self.ativos = {}          # arquivo -> etapa em andamento
+        self.etapas = {}          # etapa -> totais de bytes, linhas e segundos
+        self._ultima_gravacao = 0.0
+        self._lock = threading.Lock()
+        self._lock_gravacao = threading.Lock()
+    
+    def definir_arquivos(self, pesos: Dict[str, float]):
+        """Registra os arquivos da execução; o peso guia a previsão de término"""
+        with self._lock:
+            self.inicio = time.time()
+            self.pesos = dict(pesos)
+            self.peso_total = sum(pesos.values())
+            self.peso_concluido = 0
+        self._gravar(forcar=True)
+    
+    def adicionar_arquivos(self, pesos: Dict[str, float]):
+        """Acrescenta à previsão os arquivos de um ano preparado depois do início"""
+        with self._lock:
+            self.pesos.update(pesos)
+            self.peso_total += sum(pesos.values())
+        self._gravar(forcar=True)
+    
+    def descartar_arquivo(self, chave: str):
+        """Remove da previsão um arquivo concluído em execução anterior"""
+        with self._lock:
+            self.peso_total -= self.pesos.pop(chave, 0)
+    
+    def concluir_arquivo(self, chave: str):
+        with self._lock:
+            self.peso_concluido += self.pesos.pop(chave, 0)
+            self.ativos.pop(chave, None)
+        self._gravar(forcar=True)
+    
+    def iniciar_etapa(self, chave: str, etapa: str):
+        with self._lock:
+            self.ativos[chave] = {'etapa': etapa, 'inicio': time.time(), 'bytes': 0, 'linhas': 0, 'chunk': None}
+        self._gravar(forcar=True)
+    
+    def avancar(self, chave: str, bytes_processados: int = 0, linhas: int = 0, chunk: Optional[int] = None):
+        with self._lock:
+            ativo = self.ativos.get(chave)
+            if ativo is None:
+                return
+            ativo['bytes'] += bytes_processados
+            ativo['linhas'] += linhas
+            if chunk is not None:
+                ativo['chunk'] = chunk
+        self._gravar()
+    
+    def concluir_etapa(self, chave: str):
+        with self._lock:
+            ativo = self.ativos.pop(chave, None)
+            if ativo is None:
+                return
+            total = self.etapas.setdefault(ativo['etapa'], {'bytes': 0, 'linhas': 0, 'segundos': 0.0})
+            total['bytes'] += ativo['bytes']
+            total['linhas'] += ativo['linhas']
+            total['segundos'] += time.time() - ativo['inicio']
+        self._gravar(forcar=True)
+    
+    @contextmanager
+    def etapa(self, chave: str, etapa: str):
+        self.iniciar_etapa(chave, etapa)
+        try:
+            yield
+        finally:
+            self.concluir_etapa(chave)
+    
+    @staticmethod
+    def _vazao(bytes_processados: int, linhas: int, segundos: float) -> Dict[str, float]:
+        segundos = max(segundos, 1e-6)
+        return {'mb_s': round(bytes_processados / 1024**2 / segundos, 2), 'linhas_s': round(linhas / segundos, 1)}
+    
+    def instantaneo(self) -> Dict[str, Any]:
+        """Métricas atuais; a previsão extrapola o tempo decorrido pelo peso já concluído"""
+        agora = time.time()
+        with self._lock:
+            decorrido = agora - self.inicio
+            previsao = None
+            if self.peso_concluido and self.peso_total:
+                restante = decorrido * (self.peso_total - self.peso_concluido) / self.peso_concluido
+                previsao = datetime.fromtimestamp(agora + restante).isoformat(timespec='seconds')
+            
+            return {
+                'pid': os.getpid(),
+                'inicio': datetime.fromtimestamp(self.inicio).isoformat(timespec='seconds'),
+                'atualizado': datetime.fromtimestamp(agora).isoformat(timespec='seconds'),
+                'progresso': round(self.peso_concluido / self.peso_total, 4) if self.peso_total else None,
+                'arquivos_pendentes': len(self.pesos),
+                'previsao_termino': previsao,
+                'ativos': {chave: {'etapa': a['etapa'], 'chunk': a['chunk'], 'bytes': a['bytes'],
+                                   'linhas': a['linhas'], 'segundos': round(agora - a['inicio'], 1),
+                                   **self._vazao(a['bytes'], a['linhas'], agora - a['inicio'])}
+                           for chave, a in self.ativos.items()},
+                'etapas': {nome: {'bytes': t['bytes'], 'linhas': t['linhas'], 'segundos': round(t['segundos'], 1),
+                                  **self._vazao(t['bytes'], t['linhas'], t['segundos'])}
+                           for nome, t in self.etapas.items()}
+            }
+    
+    def _gravar(self, forcar: bool = False):
+        """Grava o status de forma atômica, no máximo a cada INTERVALO_GRAVACAO (exceto transições)"""
+        agora = time.time()
+        with self._lock:
+            if not forcar and agora - self._ultima_gravacao < self.INTERVALO_GRAVACAO:
+                return
+            self._ultima_gravacao = agora
+        
+        with self._lock_gravacao:
+            try:
+                temporario = self.caminho + '.tmp'
+                with open(temporario, 'w', encoding='utf-8') as f:
+                    json.dump(self.instantaneo(), f, indent=2, ensure_ascii=False)
+                os.replace(temporario, self.caminho)
+            except OSError:
+                pass
+
+# ==============================================================================
+# PERFILAMENTO - TEMPO E ALOCAÇÕES POR ETAPA DO PIPELINE (--profile)
+# ==============================================================================
+
+class AmostradorPilhas:
+    """Amostra periodicamente as pilhas das threads que estão dentro de uma etapa (baixo overhead)"""
+    
+    def __init__(self, intervalo: float = 0.005):
+        self.intervalo = intervalo
+        self.pilhas = {}          # etapa -> Counter(pilha colapsada -> amostras)
+        self._etapas = {}         # thread -> etapa em andamento
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._amostrar, daemon=True, name='perfil-amostrador')
+        self._thread.start()
+    
+    def entrar(self, etapa: str):
+        self._etapas[threading.get_ident()] = etapa
+    
+    def sair(self, etapa: str):
+        self._etapas.pop(threading.get_ident(), None)
+    
+    @staticmethod
+    def _colapsar(quadro) -> str:
+        nomes = []
+        while quadro is not None:
+            codigo = quadro.f_code
+            nomes.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+            quadro = quadro.f_back
+        return ';'.join(reversed(nomes))
+    
+    def _amostrar(self):
+        while not self._parar.wait(self.intervalo):
+            quadros = sys._current_frames()
+            for thread, etapa in list(self._etapas.items()):
+                if thread in quadros:
+                    self.pilhas.setdefault(etapa, Counter())[self._colapsar(quadros[thread])] += 1
+            del quadros
+    
+    def gravar(self, diretorio: str):
+        """Um arquivo .collapsed por etapa (formato do flamegraph.pl / speedscope)"""
+        self._parar.set()
+        self._thread.join()
+        for etapa, contagens in self.pilhas.items():
+            with open(os.path.join(diretorio, f"{etapa}.collapsed"), 'w', encoding='utf-8') as f:
+                for pilha, amostras in contagens.most_common():
+                    f.write(f"{pilha} {amostras}\n")
+
+class PerfiladorCProfile:
+    """cProfile determinístico por etapa; uma etapa por vez (o interpretador aceita um só profiler ativo)"""
+    
+    def __init__(self):
+        self.perfis = {}          # etapa -> cProfile.Profile
+        self._lock = threading.Lock()
+        self._dono = None
+    
+    def entrar(self, etapa: str):
+        if self._lock.acquire(blocking=False):
+            self._dono = threading.get_ident()
+            self.perfis.setdefault(etapa, cProfile.Profile()).enable()
+    
+    def sair(self, etapa: str):
+        if self._dono == threading.get_ident():
+            self.perfis[etapa].disable()
+            self._dono = None
+            self._lock.release()
+    
+    def gravar(self, diretorio: str):
+        for etapa, perfil in self.perfis.items():
+            perfil.dump_stats(os.path.join(diretorio, f"{etapa}.prof"))
+
+class PerfiladorEtapas:
+    """Mede o tempo de cada etapa, repassa entradas/saídas aos amostradores e relata alocações por chunk"""
+    
+    MODOS = ('amostragem', 'cprofile')
+    
+    # Quadros guardados por alocação: o suficiente para sair do pandas e chegar à linha do pipeline
+    PROFUNDIDADE_ALOCACOES = 15
+    
+    def __init__(self, diretorio: str, modo: str = 'amostragem', top_alocacoes: int = 10,
+                 intervalo_alocacoes: int = 25):
+        self.diretorio = diretorio
+        self.top_alocacoes = top_alocacoes
+        self.intervalo_alocacoes = max(1, intervalo_alocacoes)
+        self.tempos = Counter()
+        self.chamadas = Counter()
+        self._lock = threading.Lock()
+        self._chunk = threading.local()
+        os.makedirs(diretorio, exist_ok=True)
+        
+        # Pilhas colapsadas sempre; cProfile é opcional porque distorce os tempos
+        self.amostradores = [AmostradorPilhas()]
+        if modo == 'cprofile':
+            self.amostradores.append(PerfiladorCProfile())
+        
+        self.caminho_alocacoes = os.path.join(diretorio, 'alocacoes_por_chunk.txt')
+        open(self.caminho_alocacoes, 'w', encoding='utf-8').close()
+    
+    @contextmanager
+    def etapa(self, nome: str):
+        # O tracemalloc deixa o chunk amostrado dezenas de vezes mais lento: ele fica fora dos tempos e das pilhas
+        if tracemalloc.is_tracing():
+            yield
+            return
+        
+        for amostrador in self.amostradores:
+            amostrador.entrar(nome)
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracao = time.perf_counter() - inicio
+            for amostrador in reversed(self.amostradores):
+                amostrador.sair(nome)
+            with self._lock:
+                self.tempos[nome] += duracao
+                self.chamadas[nome] += 1
+    
+    def iterar(self, iteravel, nome: str):
+        """Mede o tempo gasto produzindo cada item de um iterador (ex.: leitura dos chunks)"""
+        iterador = iter(iteravel)
+        while True:
+            with self.etapa(nome):
+                try:
+                    item = next(iterador)
+                except StopIteration:
+                    return
+            yield item
+    
+    @contextmanager
+    def chunk(self, arquivo: str, numero: int):
+        """Relata as N origens com mais memória retida no ponto mais alto do chunk (1 a cada intervalo)"""
+        if numero % self.intervalo_alocacoes or tracemalloc.is_tracing():
+            yield
+            return
+        
+        tracemalloc.start(self.PROFUNDIDADE_ALOCACOES)
+        self._chunk.base = tracemalloc.take_snapshot()
+        self._chunk.pico = None
+        try:
+            yield
+        finally:
+            pico = self._chunk.pico or tracemalloc.take_snapshot()
+            _, maximo = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self._chunk.base, base = None, self._chunk.base
+            self._relatar_alocacoes(f"{arquivo} chunk {numero}", pico.compare_to(base, 'traceback'), maximo)
+    
+    def _relatar_alocacoes(self, rotulo: str, diferencas, maximo: int):
+        # Agrupa por (linha do pipeline neste arquivo, linha que de fato alocou)
+        origens = Counter()
+        blocos = Counter()
+        for diferenca in diferencas:
+            folha = diferenca.traceback[-1]
+            pipeline = next((q for q in reversed(diferenca.traceback) if q.filename == os.path.abspath(__file__)),
+                            folha)
+            chave = (f"{os.path.basename(pipeline.filename)}:{pipeline.lineno}",
+                     f"{folha.filename}:{folha.lineno}")
+            origens[chave] += diferenca.size_diff
+            blocos[chave] += diferenca.count_diff
+        
+        linhas = [f"{rotulo}: pico {maximo / (1024 * 1024):,.1f} MB (tracemalloc)"]
+        for (pipeline, folha), tamanho in origens.most_common(self.top_alocacoes):
+            linhas.append(f"  {tamanho / (1024 * 1024):>9,.1f} MB  {blocos[(pipeline, folha)]:>10,} blocos  "
+                          f"{pipeline}  <-  {folha}")
+        with self._lock, open(self.caminho_alocacoes, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(linhas) + '\n\n')
+    
+    def marcar_pico_chunk(self):
+        """Fotografa as alocações enquanto todos os objetos do chunk ainda estão vivos"""
+        if getattr(self._chunk, 'base', None) is not None:
+            self._chunk.pico = tracemalloc.take_snapshot()
+    
+    def finalizar(self):
+        """Grava as saídas dos amostradores e o resumo de tempo por etapa"""
+        for amostrador in self.amostradores:
+            amostrador.gravar(self.diretorio)
+        
+        total = sum(self.tempos.values()) or 1
+        resumo = {etapa: {'segundos': round(segundos, 3), 'chamadas': self.chamadas[etapa],
+                          'percentual': round(100 * segundos / total, 1)}
+                  for etapa, segundos in self.tempos.most_common()}
+        with open(os.path.join(self.diretorio, 'resumo_etapas.json'), 'w', encoding='utf-8') as f:
+            json.dump(resumo, f, indent=2)
+        
+        print("\nPERFIL: Tempo por etapa")
+        for etapa, dados in resumo.items():
+            print(f"  • {etapa:<14} {dados['segundos']:>10,.1f}s  {dados['percentual']:>5.1f}%  "
+                  f"({dados['chamadas']:,} chamadas)")
+        print(f"PERFIL: Pilhas colapsadas e alocações (1 a cada {self.intervalo_alocacoes} chunks) "
+              f"em {self.diretorio}")
+
+# ==============================================================================
+# CACHE DE DOWNLOADS - ARQUIVOS ENDEREÇADOS PELO CONTEÚDO (SHA-256)
+# ==============================================================================
+
+class CacheDownloads:
+    """Guarda os .7z baixados por hash do conteúdo, com índice por tamanho/data remotos e despejo LRU"""
+    
+    def __init__(self, diretorio: str, tamanho_maximo: int):
+        self.diretorio = diretorio
+        self.diretorio_objetos = os.path.join(diretorio, 'objetos')
+        self.caminho_indice = os.path.join(diretorio, 'indice.json')
+        self.tamanho_maximo = tamanho_maximo
+        self._lock = threading.RLock()
+        self._verificados = set()  # Objetos com SHA-256 conferido nesta execução
+        os.makedirs(self.diretorio_objetos, exist_ok=True)
+        self.indice = self._carregar_indice()
+    
+    def _carregar_indice(self) -> Dict:
+        """Carrega o índice do cache (remotos -> hash, objetos -> último acesso)"""
+        try:
+            with open(self.caminho_indice, 'r', encoding='utf-8') as f:
+                indice = json.load(f)
+            return {'remotos': indice.get('remotos', {}), 'objetos': indice.get('objetos', {})}
+        except (OSError, ValueError):
+            return {'remotos': {}, 'objetos': {}}
+    
+    def _salvar_indice(self):
+        """Grava o índice de forma atômica"""
+        temporario = self.caminho_indice + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(self.indice, f, indent=2, ensure_ascii=False)
+        os.replace(temporario, self.caminho_indice)
+    
+    def caminho_objeto(self, sha256: str) -> str:
+        return os.path.join(self.diretorio_objetos, f"{sha256}.7z")
+    
+    @staticmethod
+    def calcular_sha256(caminho: str) -> str:
+        """Calcula o SHA-256 de um arquivo em blocos de 1 MB"""
+        hash_arquivo = hashlib.sha256()
+        with open(caminho, 'rb') as f:
+            for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                hash_arquivo.update(bloco)
+        return hash_arquivo.hexdigest()
+    
+    def buscar(self, chave_remota: str, tamanho_remoto: Optional[int], mtime_remoto: Optional[str]) -> Optional[str]:
+        """Retorna o objeto em cache se o arquivo remoto não mudou (mesmo tamanho e data) e o conteúdo confere"""
+        if tamanho_remoto is None or mtime_remoto is None:
+            return None
+        
+        with self._lock:
+            entrada = self.indice['remotos'].get(chave_remota)
+            if not entrada or entrada['tamanho'] != tamanho_remoto or entrada['mtime'] != mtime_remoto:
+                return None
+            
+            sha256 = entrada['sha256']
+            caminho = self.caminho_objeto(sha256)
+            if not os.path.exists(caminho) or os.path.getsize(caminho) != tamanho_remoto:
+                self.invalidar(chave_remota)
+                return None
+            verificar = sha256 not in self._verificados
+        
+        if verificar:
+            # Confere o hash uma vez por execução (fora do lock): objeto corrompido não chega à extração
+            try:
+                integro = self.calcular_sha256(caminho) == sha256
+            except OSError:
+                return None  # Despejado por outra thread durante a leitura
+            if not integro:
+                print(f"CACHE: Objeto {sha256[:12]} corrompido (SHA-256 divergente), baixando novamente")
+                self.invalidar(chave_remota)
+                return None
+        
+        with self._lock:
+            self._verificados.add(sha256)
+            self.indice['objetos'].setdefault(sha256, {'tamanho': tamanho_remoto})['ultimo_acesso'] = time.time()
+            self._salvar_indice()
+            return caminho
+    
+    def armazenar(self, caminho_arquivo: str, chave_remota: str, sha256: str,
+                  tamanho_remoto: Optional[int], mtime_remoto: Optional[str]):
+        """Adiciona um download verificado ao cache e aplica o limite de tamanho"""
+        tamanho = os.path.getsize(caminho_arquivo)
+        if tamanho > self.tamanho_maximo:
+            print(f"CACHE: {os.path.basename(caminho_arquivo)} maior que o limite do cache, não armazenado")
+            return
+        
+        with self._lock:
+            destino = self.caminho_objeto(sha256)
+            if not os.path.exists(destino):
+                self.materializar(caminho_arquivo, destino)
+            
+            self._verificados.add(sha256)
+            self.indice['objetos'][sha256] = {'tamanho': tamanho, 'ultimo_acesso': time.time()}
+            self.indice['remotos'][chave_remota] = {'sha256': sha256, 'tamanho': tamanho_remoto,
+                                                   'mtime': mtime_remoto}
+            self._despejar(preservar=sha256)
+            self._salvar_indice()
+    
+    def invalidar(self, chave_remota: str):
+        """Remove a entrada de um arquivo remoto (ex.: objeto corrompido na extração)"""
+        with self._lock:
+            entrada = self.indice['remotos'].pop(chave_remota, None)
+            if entrada:
+                sha256 = entrada['sha256']
+                if not any(e['sha256'] == sha256 for e in self.indice['remotos'].values()):
+                    self.indice['objetos'].pop(sha256, None)
+                    if os.path.exists(self.caminho_objeto(sha256)):
+                        os.remove(self.caminho_objeto(sha256))
+                self._salvar_indice()
+    
+    def _despejar(self, preservar: Optional[str] = None):
+        """Remove os objetos menos usados recentemente até caber no limite"""
+        objetos = self.indice['objetos']
+        total = sum(o['tamanho'] for o in objetos.values())
+        for sha256 in sorted(objetos, key=lambda s: objetos[s].get('ultimo_acesso', 0)):
+            if total <= self.tamanho_maximo:
+                break
+            if sha256 == preservar:
+                continue
+            
+            total -= objetos.pop(sha256)['tamanho']
+            if os.path.exists(self.caminho_objeto(sha256)):
+                os.remove(self.caminho_objeto(sha256))
+            self.indice['remotos'] = {chave: e for chave, e in self.indice['remotos'].items()
+                                      if e['sha256'] != sha256}
+            print(f"CACHE: Objeto {sha256[:12]} despejado (LRU)")
+    
+    @staticmethod
+    def materializar(origem: str, destino: str):
+        """Cria o arquivo de destino por hard link (mesmo disco) ou cópia"""
+        if os.path.exists(destino):
+            os.remove(destino)
+        try:
+            os.link(origem, destino)
+        except OSError:
+            shutil.copyfile(origem, destino)
+
+# ==============================================================================
+# ORÇAMENTO DE DISCO - AGENDAMENTO DE DOWNLOAD E EXTRAÇÃO
+# ==============================================================================
+
+class OrcamentoDisco:
+    """Reserva espaço no diretório temporário antes de baixar/extrair e libera ao fim de cada etapa"""
+    
+    # Razão TXT/7z usada até a primeira extração do lote ser observada
+    RAZAO_EXPANSAO_PADRAO = 8.0
+    
+    def __init__(self, limite: int, diretorio: str, razao_expansao: Optional[float] = None):
+        livre = shutil.disk_usage(diretorio).free
+        if limite > livre:
+            print(f"AVISO DISCO: Orçamento de {limite/1024**3:.1f} GB maior que o espaço livre "
+                  f"({livre/1024**3:.1f} GB), usando o espaço livre")
+            limite = livre
+        
+        self.limite = limite
+        self.reservado = 0
+        self.razao_expansao = razao_expansao or self.RAZAO_EXPANSAO_PADRAO
+        self._razao_observada = None
+        self._condicao = threading.Condition()
+    
+    def estimar_extraido(self, tamanho_compactado: int) -> int:
+        return int(tamanho_compactado * self.razao_expansao)
+    
+    def registrar_expansao(self, tamanho_compactado: int, tamanho_extraido: int):
+        """Ajusta a estimativa com a maior razão de expansão já observada"""
+        if tamanho_compactado <= 0:
+            return
+        with self._condicao:
+            razao = tamanho_extraido / tamanho_compactado
+            self._razao_observada = max(self._razao_observada or 0, razao)
+            self.razao_expansao = self._razao_observada
+    
+    def reservar(self, tamanho: int, descricao: str) -> int:
+        """Bloqueia até o tamanho caber no orçamento; um item maior que o limite roda sozinho"""
+        with self._condicao:
+            if self.reservado > 0 and self.reservado + tamanho > self.limite:
+                print(f"DISCO: {descricao} aguardando {tamanho/1024**2:,.0f} MB "
+                      f"({self.reservado/1024**2:,.0f}/{self.limite/1024**2:,.0f} MB reservados)")
+                self._condicao.wait_for(lambda: self.reservado == 0 or self.reservado + tamanho <= self.limite)
+            if tamanho > self.limite:
+                print(f"AVISO DISCO: {descricao} ({tamanho/1024**2:,.0f} MB) excede o orçamento, executando isolado")
+            self.reservado += tamanho
+            return tamanho
+    
+    def ajustar(self, reserva_atual: int, novo_tamanho: int) -> int:
+        """Troca a reserva pelo tamanho real da etapa seguinte (não bloqueia para evitar deadlock)"""
+        with self._condicao:
+            self.reservado += novo_tamanho - reserva_atual
+            self._condicao.notify_all()
+            return novo_tamanho
+    
+    def liberar(self, tamanho: int):
+        with self._condicao:
+            self.reservado -= tamanho
+            self._condicao.notify_all()
+
+# ==============================================================================
+# POOL DE SESSÕES FTP - CONEXÕES AUTENTICADAS REAPROVEITADAS
+# ==============================================================================
+
+class PoolSessoesFTP:
+    """Mantém sessões FTP logadas para listagens e downloads, com keepalive (NOOP) e reconexão"""
+    
+    INTERVALO_KEEPALIVE = 60   # segundos entre NOOPs nas sessões ociosas
+    VERIFICAR_APOS = 15        # segundos ociosa antes de testar a sessão ao emprestar
+    
+    def __init__(self, host: str, tamanho: int = 1, timeout: int = 60):
+        self.host = host
+        self.timeout = timeout
+        self._vagas = threading.BoundedSemaphore(max(1, tamanho))
+        self._lock = threading.Lock()
+        self._ociosas = []           # [(ftp, instante do último uso)]
+        self._diretorios = {}        # ftp -> diretório corrente (evita CWD repetido)
+        self._parar = threading.Event()
+        self._keepalive = None
+    
+    def _conectar(self) -> ftplib.FTP:
+        ftp = ftplib.FTP(self.host, timeout=self.timeout)
+        ftp.login()
+        ftp.encoding = 'latin-1'
+        return ftp
+    
+    @staticmethod
+    def _saudavel(ftp: ftplib.FTP) -> bool:
+        try:
+            ftp.voidcmd('NOOP')
+            return True
+        except ftplib.all_errors:
+            return False
+    
+    @staticmethod
+    def encerrar_transferencia(ftp: ftplib.FTP) -> bool:
+        """Aborta um RETR interrompido pelo cliente e ressincroniza o canal de controle"""
+        try:
+            ftp.abort()
+            # Conforme o servidor, 426 e 226 chegam em respostas separadas: descarta as pendentes até o NOOP
+            ftp.putcmd('NOOP')
+            for _ in range(3):
+                if ftp.getmultiline().startswith('200'):
+                    return True
+            return False
+        except ftplib.all_errors:
+            return False
+    
+    def _descartar(self, ftp: ftplib.FTP):
+        self._diretorios.pop(ftp, None)
+        try:
+            ftp.close()
+        except ftplib.all_errors:
+            pass
+    
+    def _emprestar(self) -> ftplib.FTP:
+        """Reaproveita uma sessão ociosa saudável ou abre uma nova"""
+        while True:
+            with self._lock:
+                if not self._ociosas:
+                    break
+                ftp, ultimo_uso = self._ociosas.pop()
+            if time.time() - ultimo_uso < self.VERIFICAR_APOS or self._saudavel(ftp):
+                return ftp
+            self._descartar(ftp)
+        
+        ftp = self._conectar()
+        self._iniciar_keepalive()
+        return ftp
+    
+    @contextmanager
+    def sessao(self, diretorio: Optional[str] = None):
+        """Empresta uma sessão já no diretório pedido; sessões com erro de conexão são descartadas"""
+        with self._vagas:
+            ftp = self._emprestar()
+            try:
+                if diretorio and self._diretorios.get(ftp) != diretorio:
+                    self._diretorios.pop(ftp, None)
+                    ftp.cwd(diretorio)
+                    self._diretorios[ftp] = diretorio
+                yield ftp
+            except ftplib.error_perm:
+                # Erro de permissão/arquivo inexistente: a conexão continua válida
+                with self._lock:
+                    self._ociosas.append((ftp, time.time()))
+                raise
+            except BaseException:
+                self._descartar(ftp)
+                raise
+            else:
+                with self._lock:
+                    self._ociosas.append((ftp, time.time()))
+    
+    def _iniciar_keepalive(self):
+        with self._lock:
+            if self._keepalive is None:
+                self._keepalive = threading.Thread(target=self._manter_sessoes, daemon=True,
+                                                   name='ftp-keepalive')
+                self._keepalive.start()
+    
+    def _manter_sessoes(self):
+        """Envia NOOP às sessões ociosas para o servidor não derrubá-las durante o processamento"""
+        while not self._parar.wait(self.INTERVALO_KEEPALIVE):
+            with self._lock:
+                ociosas, self._ociosas = self._ociosas, []
+            vivas = []
+            for ftp, ultimo_uso in ociosas:
+                if self._saudavel(ftp):
+                    vivas.append((ftp, time.time()))
+                else:
+                    self._descartar(ftp)
+            with self._lock:
+                self._ociosas.extend(vivas)
+    
+    def fechar(self):
+        """Encerra o keepalive e as sessões ociosas"""
+        self._parar.set()
+        with self._lock:
+            ociosas, self._ociosas = self._ociosas, []
+        for ftp, _ in ociosas:
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                self._descartar(ftp)
+
+class _FimSegmento(Exception):
+    """Interrompe a transferência de uma faixa ao atingir o fim dela"""
+
+# ==============================================================================
+# TRATAMENTO MULTI-PROCESSO - CHUNKS TRATADOS FORA DO PROCESSO PRINCIPAL
+# ==============================================================================
+
+# Loader de cada processo do pool, montado pelo inicializador (nada é herdado do processo principal)
+_LOADER_PROCESSO = None
+
+def _iniciar_processo_chunks(config: Dict[str, Any], dicionarios: Dict):
+    """Inicializador do pool: recria no processo só o estado usado no tratamento de chunks"""
+    global _LOADER_PROCESSO
+    _LOADER_PROCESSO = ImprovedRAISLoader.para_tratamento(config, dicionarios)
+
+def _preparar_chunk_em_processo(df_base: pd.DataFrame, ano: str, caminho_csv: str, cabecalho: bool, medir: bool):
+    """Executa o tratamento de um chunk em um processo do pool"""
+    return _LOADER_PROCESSO._preparar_chunk_saida(df_base, ano, caminho_csv, cabecalho, medir)
+
 # ==============================================================================
 # CLASSE PRINCIPAL - RAIS LOADER MELHORADO
 # ==============================================================================
 
 class ImprovedRAISLoader:
+    # Colunas lidas dos arquivos RAIS_VINC
+    COLUNAS_RAIS = [
+        'CNAE 2.0 Subclasse', 'Mun Trab', 'Natureza Jurídica', 'Tamanho Estabelecimento',
+        'CBO Ocupação 2002', 'Faixa Hora Contrat', 'Faixa Tempo Emprego', 'Tipo Vínculo',
+        'Escolaridade após 2005', 'Idade', 'Nacionalidade', 'Raça Cor', 'Sexo Trabalhador',
+        'Tipo Defic', 'Vl Remun Média Nom', 'Vínculo Ativo 31/12'
+    ]
+    
+    # Colunas criadas por _aplicar_traducoes
+    COLUNAS_DERIVADAS = ['UF', 'Mun Trab (Traduzido)', 'CNAE 2.0 Subclasse (Traduzido)',
+                         'CBO Ocupação 2002 (Traduzido)']
+    
+    # Colunas convertidas para tipos numéricos (tipo BigQuery); as demais são STRING
+    COLUNAS_NUMERICAS = {'Idade': 'INTEGER', 'Vl Remun Média Nom': 'NUMERIC',
+                         'Estab Quantidade': 'INTEGER', 'Estab Vínculos Ativos': 'INTEGER',
+                         'Estab Simples (%)': 'NUMERIC'}
+    
+    # Tabelas resumo acumuladas durante o passe de chunks: nível -> colunas de agrupamento
+    AGREGACOES = {
+        'uf_cnae_cbo_sexo_escolaridade': ['UF', 'CNAE 2.0 Subclasse', 'CBO Ocupação 2002',
+                                          'Sexo Trabalhador', 'Escolaridade após 2005'],
+    }
+    
+    # Downloads segmentados: faixa mínima e intervalo de gravação do estado parcial
+    TAMANHO_MINIMO_SEGMENTO = 64 * 1024 * 1024
+    INTERVALO_ESTADO_DOWNLOAD = 16 * 1024 * 1024
+    
     def __init__(self, config: Dict[str, Any]):
         """Inicializa o loader RAIS com estilo melhorado"""
         
@@ -35,13 +1051,36 @@ class ImprovedRAISLoader:
         self.backoff_multiplier = 2
         
         # Arquivos de controle
-        self.progress_file = "rais_progress.json"
+        self.progress_file = config.get('ARQUIVO_PROGRESSO', "rais_progress.json")
         self.progress = self._load_progress()
+        self.monitor = MonitorExecucao(config.get('ARQUIVO_STATUS', "rais_status.json"))
+        self._lock_progresso = threading.RLock()
         self.dicionarios = {}
         self.client_bq = None
+        self.rss_base = None
+        self._pool_chunks = None
+        self._lock_pool_chunks = threading.Lock()
+        self.indices_estab = {}
+        self.perfilador = config.get('PERFILADOR')
+        
+        # Sessões FTP compartilhadas por listagens e downloads
+        self.pool_ftp = PoolSessoesFTP(config['FTP_HOST'],
+                                       config.get('FTP_SESSOES') or config.get('ARQUIVOS_PARALELOS', 1))
+        
+        # Cache opcional de downloads (RAIS_CACHE_DIR)
+        self.cache = None
+        if config.get('DIRETORIO_CACHE'):
+            self.cache = CacheDownloads(config['DIRETORIO_CACHE'], config['CACHE_TAMANHO_MAXIMO'])
         
         # Criar diretórios
         self._create_directories()
+        
+        # Orçamento opcional de disco para o diretório temporário (RAIS_DISK_BUDGET)
+        self.orcamento_disco = None
+        self.tamanhos_remotos = {}
+        if config.get('ORCAMENTO_DISCO_BYTES'):
+            self.orcamento_disco = OrcamentoDisco(config['ORCAMENTO_DISCO_BYTES'], config['DIRETORIO_TEMPORARIO'],
+                                                  config.get('RAZAO_EXPANSAO_7Z'))
 
     def _create_directories(self):
         """Cria diretórios necessários"""
@@ -66,13 +1105,16 @@ class ImprovedRAISLoader:
         }
 
     def _save_progress(self):
-        """Salva progresso atual"""
-        self.progress['last_update'] = datetime.now().isoformat()
-        try:
-            with open(self.progress_file, 'w') as f:
-                json.dump(self.progress, f, indent=2)
-        except Exception as e:
-            print(f"ERRO PROGRESS: Falha ao salvar progresso: {e}")
+        """Salva progresso atual de forma atômica (um kill no meio não trunca o checkpoint)"""
+        with self._lock_progresso:
+            self.progress['last_update'] = datetime.now().isoformat()
+            try:
+                temporario = self.progress_file + '.tmp'
+                with open(temporario, 'w') as f:
+                    json.dump(self.progress, f, indent=2)
+                os.replace(temporario, self.progress_file)
+            except Exception as e:
+                print(f"ERRO PROGRESS: Falha ao salvar progresso: {e}")
 
     def _print_separator(self, char="=", length=70):
         """Imprime separador visual"""
@@ -138,10 +1180,7 @@ class ImprovedRAISLoader:
         print("FTP: Consultando anos disponíveis...")
         
         def get_years():
-            with ftplib.FTP(self.config['FTP_HOST'], timeout=60) as ftp:
-                ftp.login()
-                ftp.cwd(self.config['FTP_BASE_PATH'])
-                
+            with self.pool_ftp.sessao(self.config['FTP_BASE_PATH']) as ftp:
                 # --- LÓGICA CORRIGIDA AQUI ---
                 # Usa regex para encontrar todos os itens que começam com 4 dígitos (o ano)
                 anos_encontrados = [item for item in ftp.nlst() if re.match(r'^\d{4}', item)]
@@ -162,11 +1201,13 @@ class ImprovedRAISLoader:
         print(f"FTP: Consultando arquivos do ano {ano}...")
         
         def get_files():
-            with ftplib.FTP(self.config['FTP_HOST'], timeout=60) as ftp:
-                ftp.login()
-                ftp.cwd(f"{self.config['FTP_BASE_PATH']}{ano}/")
+            with self.pool_ftp.sessao(f"{self.config['FTP_BASE_PATH']}{ano}/") as ftp:
                 arquivos = [f for f in ftp.nlst() 
                           if f.endswith('.7z') and f not in self.config['ARQUIVOS_A_EXCLUIR']]
+                
+                # Tamanhos compactados alimentam o orçamento de disco e a previsão de término
+                for arquivo in arquivos:
+                    self.tamanhos_remotos[(ano, arquivo)] = self._obter_metadados_remotos(ftp, arquivo)[0]
                 return arquivos
         
         try:
@@ -188,49 +1229,216 @@ class ImprovedRAISLoader:
         """Atualiza status de um arquivo"""
         file_key = f"{ano}:{nome_arquivo}"
         
-        if file_key not in self.progress['files_status']:
-            self.progress['files_status'][file_key] = {}
+        with self._lock_progresso:
+            if file_key not in self.progress['files_status']:
+                self.progress['files_status'][file_key] = {}
+            
+            self.progress['files_status'][file_key].update({
+                'stage': stage,
+                'success': success,
+                'timestamp': datetime.now().isoformat(),
+                'info': info or {}
+            })
+            
+            self._save_progress()
+
+    @staticmethod
+    def _obter_metadados_remotos(ftp: ftplib.FTP, nome_arquivo: str) -> Tuple[Optional[int], Optional[str]]:
+        """Consulta tamanho (SIZE) e data de modificação (MDTM) do arquivo no FTP"""
+        tamanho, mtime = None, None
+        try:
+            ftp.voidcmd('TYPE I')
+            tamanho = ftp.size(nome_arquivo)
+        except ftplib.error_perm:
+            pass
+        try:
+            mtime = ftp.voidcmd('MDTM ' + nome_arquivo).split()[-1]
+        except ftplib.error_perm:
+            pass
+        return tamanho, mtime
+
+    def _planejar_segmentos(self, tamanho_remoto: Optional[int]) -> List[List[Optional[int]]]:
+        """Divide o arquivo em faixas [início, fim, bytes já baixados]"""
+        if not tamanho_remoto:
+            return [[0, None, 0]]
         
-        self.progress['files_status'][file_key].update({
-            'stage': stage,
-            'success': success,
-            'timestamp': datetime.now().isoformat(),
-            'info': info or {}
-        })
+        partes = max(1, min(self.config.get('FTP_SEGMENTOS', 1), tamanho_remoto // self.TAMANHO_MINIMO_SEGMENTO))
+        passo = -(-tamanho_remoto // partes)
+        return [[inicio, min(inicio + passo, tamanho_remoto), 0] for inicio in range(0, tamanho_remoto, passo)]
+
+    @staticmethod
+    def _carregar_estado_download(caminho_local: str, tamanho_remoto: Optional[int],
+                                  mtime_remoto: Optional[str]) -> Optional[List[List[Optional[int]]]]:
+        """Faixas de um download interrompido, se o arquivo remoto não mudou desde então"""
+        if tamanho_remoto is None or not os.path.exists(caminho_local):
+            return None
+        try:
+            with open(caminho_local + '.parcial.json', 'r', encoding='utf-8') as f:
+                estado = json.load(f)
+        except (OSError, ValueError):
+            return None
         
-        self._save_progress()
+        if estado.get('tamanho') != tamanho_remoto or estado.get('mtime') != mtime_remoto:
+            return None
+        segmentos = estado['segmentos']
+        if len(segmentos) == 1:
+            # Download contínuo: o tamanho do arquivo local é o progresso real
+            segmentos[0][2] = min(os.path.getsize(caminho_local), tamanho_remoto)
+        return segmentos
+
+    def _baixar_faixas(self, ano: str, nome_arquivo: str, caminho_local: str,
+                       tamanho_remoto: Optional[int], mtime_remoto: Optional[str]) -> str:
+        """Baixa o arquivo retomando com REST e, se configurado, em faixas paralelas; retorna o SHA-256"""
+        caminho_estado = caminho_local + '.parcial.json'
+        diretorio_remoto = f"{self.config['FTP_BASE_PATH']}{ano}/"
+        lock_estado = threading.Lock()
+        
+        segmentos = self._carregar_estado_download(caminho_local, tamanho_remoto, mtime_remoto)
+        if segmentos:
+            baixados = sum(segmento[2] for segmento in segmentos)
+            print(f"DOWNLOAD: Retomando {nome_arquivo} ({baixados/1024**2:.1f} de {tamanho_remoto/1024**2:.1f} MB)")
+        else:
+            # O destino pode ser hard link de um objeto do cache: remove antes para não truncar o objeto
+            if os.path.exists(caminho_local):
+                os.remove(caminho_local)
+            segmentos = self._planejar_segmentos(tamanho_remoto)
+            with open(caminho_local, 'wb') as f:
+                if len(segmentos) > 1:
+                    f.truncate(tamanho_remoto)
+        
+        def salvar_estado():
+            with lock_estado:
+                temporario = caminho_estado + '.tmp'
+                with open(temporario, 'w', encoding='utf-8') as f:
+                    json.dump({'tamanho': tamanho_remoto, 'mtime': mtime_remoto, 'segmentos': segmentos}, f)
+                os.replace(temporario, caminho_estado)
+        
+        salvar_estado()
+        
+        # Download contínuo: hash calculado durante a transferência (prefixo retomado é relido)
+        hash_continuo = None
+        if len(segmentos) == 1:
+            hash_continuo = hashlib.sha256()
+            with open(caminho_local, 'rb') as f:
+                for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                    hash_continuo.update(bloco)
+        
+        def baixar_segmento(segmento: List[Optional[int]]):
+            inicio, fim, _ = segmento
+            if fim is not None and segmento[2] >= fim - inicio:
+                return
+            
+            # Só faixas intermediárias precisam cortar a transferência antes do fim do arquivo
+            interromper = fim is not None and fim < tamanho_remoto
+            ultimo_salvo = segmento[2]
+            
+            with open(caminho_local, 'r+b') as f:
+                f.seek(inicio + segmento[2])
+                
+                def gravar(bloco: bytes):
+                    nonlocal ultimo_salvo
+                    if fim is not None:
+                        bloco = bloco[:fim - inicio - segmento[2]]
+                    f.write(bloco)
+                    if hash_continuo:
+                        hash_continuo.update(bloco)
+                    segmento[2] += len(bloco)
+                    
+                    self.monitor.avancar(f"{ano}:{nome_arquivo}", bytes_processados=len(bloco))
+                    
+                    if segmento[2] - ultimo_salvo >= self.INTERVALO_ESTADO_DOWNLOAD:
+                        f.flush()
+                        salvar_estado()
+                        ultimo_salvo = segmento[2]
+                    if interromper and segmento[2] >= fim - inicio:
+                        raise _FimSegmento()
+                
+                try:
+                    with self.pool_ftp.sessao(diretorio_remoto) as ftp:
+                        try:
+                            ftp.retrbinary('RETR ' + nome_arquivo, gravar, blocksize=1024 * 1024,
+                                           rest=(inicio + segmento[2]) or None)
+                        except _FimSegmento:
+                            # Faixa completa: com ABOR a sessão volta ao pool; só é descartada se ele falhar
+                            if not PoolSessoesFTP.encerrar_transferencia(ftp):
+                                raise
+                except _FimSegmento:
+                    pass
+                finally:
+                    f.flush()
+                    salvar_estado()
+        
+        if len(segmentos) == 1:
+            baixar_segmento(segmentos[0])
+        else:
+            print(f"DOWNLOAD: {nome_arquivo} em {len(segmentos)} faixas paralelas")
+            with ThreadPoolExecutor(max_workers=len(segmentos)) as executor:
+                futuros = [executor.submit(baixar_segmento, segmento) for segmento in segmentos]
+                erros = [futuro.exception() for futuro in futuros if futuro.exception()]
+            if erros:
+                raise erros[0]
+        
+        baixados = sum(segmento[2] for segmento in segmentos)
+        if tamanho_remoto is not None and baixados != tamanho_remoto:
+            raise Exception(f"FTP: download incompleto ({baixados} de {tamanho_remoto} bytes)")
+        
+        os.remove(caminho_estado)
+        return hash_continuo.hexdigest() if hash_continuo else CacheDownloads.calcular_sha256(caminho_local)
 
     def baixar_arquivo(self, ano: str, nome_arquivo: str, caminho_local: str) -> bool:
-        """Baixa arquivo do FTP"""
+        """Baixa arquivo do FTP (ou do cache local), verificando tamanho e SHA-256"""
         
-        # Verifica se já foi baixado
+        # Verifica se já foi baixado (e se o arquivo local continua íntegro)
         current_status = self.verificar_status_arquivo(ano, nome_arquivo)
         if current_status == 'DOWNLOADED' and os.path.exists(caminho_local):
-            print(f"SKIP: {nome_arquivo} já foi baixado anteriormente")
-            return True
+            info = self.progress.get('files_status', {}).get(f"{ano}:{nome_arquivo}", {}).get('info', {})
+            tamanho_esperado = info.get('file_size_bytes')
+            if tamanho_esperado is None or os.path.getsize(caminho_local) == tamanho_esperado:
+                print(f"SKIP: {nome_arquivo} já foi baixado anteriormente")
+                return True
+            print(f"DOWNLOAD: {nome_arquivo} local com tamanho divergente, baixando novamente")
         
         print(f"DOWNLOAD: Iniciando {nome_arquivo}...")
+        chave_remota = f"{ano}/{nome_arquivo}"
         
-        def download_operation():
-            with ftplib.FTP(self.config['FTP_HOST'], timeout=60) as ftp:
-                ftp.login()
-                ftp.encoding = 'latin-1'
-                caminho_remoto = f"{self.config['FTP_BASE_PATH']}{ano}/"
-                ftp.cwd(caminho_remoto)
+        def download_operation() -> Dict[str, Any]:
+            with self.pool_ftp.sessao(f"{self.config['FTP_BASE_PATH']}{ano}/") as ftp:
+                tamanho_remoto, mtime_remoto = self._obter_metadados_remotos(ftp, nome_arquivo)
                 
-                with open(caminho_local, 'wb') as f:
-                    ftp.retrbinary('RETR ' + nome_arquivo, f.write)
+                if self.cache:
+                    objeto = self.cache.buscar(chave_remota, tamanho_remoto, mtime_remoto)
+                    if objeto:
+                        # Descarta um download parcial anterior: suas faixas não valem para o hard link
+                        if os.path.exists(caminho_local + '.parcial.json'):
+                            os.remove(caminho_local + '.parcial.json')
+                        self.cache.materializar(objeto, caminho_local)
+                        return {'sha256': os.path.basename(objeto)[:-3], 'from_cache': True,
+                                'remote_size': tamanho_remoto, 'remote_mtime': mtime_remoto}
+            
+            # Fora da sessão de consulta: as faixas emprestam suas próprias sessões do pool
+            sha256 = self._baixar_faixas(ano, nome_arquivo, caminho_local, tamanho_remoto, mtime_remoto)
+            return {'sha256': sha256, 'from_cache': False,
+                    'remote_size': tamanho_remoto, 'remote_mtime': mtime_remoto}
         
         try:
-            self._execute_with_retry(f"download {nome_arquivo}", download_operation)
+            with self.monitor.etapa(f"{ano}:{nome_arquivo}", 'download'):
+                resultado = self._execute_with_retry(f"download {nome_arquivo}", download_operation)
             
             # Verifica se o arquivo foi baixado corretamente
             if os.path.exists(caminho_local) and os.path.getsize(caminho_local) > 0:
-                file_size = os.path.getsize(caminho_local) / (1024*1024)  # MB
-                print(f"DOWNLOAD: ✅ {nome_arquivo} concluído ({file_size:.1f} MB)")
+                file_size_bytes = os.path.getsize(caminho_local)
+                file_size = file_size_bytes / (1024*1024)  # MB
+                origem = "cache" if resultado['from_cache'] else "FTP"
+                print(f"DOWNLOAD: ✅ {nome_arquivo} concluído ({file_size:.1f} MB, {origem}, "
+                      f"sha256 {resultado['sha256'][:12]})")
+                
+                if self.cache and not resultado['from_cache']:
+                    self.cache.armazenar(caminho_local, chave_remota, resultado['sha256'],
+                                         resultado['remote_size'], resultado['remote_mtime'])
                 
                 self.atualizar_status_arquivo(ano, nome_arquivo, 'DOWNLOADED', True, 
-                                            {'file_size_mb': file_size})
+                                            {'file_size_mb': file_size, 'file_size_bytes': file_size_bytes,
+                                             **resultado})
                 return True
             else:
                 raise Exception("Arquivo baixado está vazio ou corrompido")
@@ -241,6 +1449,15 @@ class ImprovedRAISLoader:
                                         {'error': str(e)})
             return False
 
+    @staticmethod
+    def _obter_tamanho_extraido(caminho_7z: str) -> Optional[int]:
+        """Lê do cabeçalho do 7z o tamanho total descompactado"""
+        try:
+            with py7zr.SevenZipFile(caminho_7z, mode='r') as z:
+                return sum(info.uncompressed for info in z.list() if not info.is_directory)
+        except Exception:
+            return None
+
     def extrair_arquivo(self, caminho_7z: str, destino: str, ano: str, nome_arquivo: str) -> Optional[str]:
         """Extrai arquivo 7z"""
         
@@ -254,14 +1471,16 @@ class ImprovedRAISLoader:
         print(f"EXTRACAO: Processando {nome_arquivo}...")
         
         try:
-            with py7zr.SevenZipFile(caminho_7z, mode='r') as z:
-                z.extractall(path=destino)
-            
             nome_txt = nome_arquivo.replace('.7z', '.txt')
             caminho_txt = os.path.join(destino, nome_txt)
             
-            if not os.path.exists(caminho_txt):
-                raise Exception(f"Arquivo extraído não encontrado: {caminho_txt}")
+            with self.monitor.etapa(f"{ano}:{nome_arquivo}", 'extracao'), self._etapa_perfil('extracao'):
+                with py7zr.SevenZipFile(caminho_7z, mode='r') as z:
+                    z.extractall(path=destino)
+                
+                if not os.path.exists(caminho_txt):
+                    raise Exception(f"Arquivo extraído não encontrado: {caminho_txt}")
+                self.monitor.avancar(f"{ano}:{nome_arquivo}", bytes_processados=os.path.getsize(caminho_txt))
             
             file_size = os.path.getsize(caminho_txt) / (1024*1024)  # MB
             print(f"EXTRACAO: ✅ {nome_arquivo} concluído ({file_size:.1f} MB)")
@@ -272,6 +1491,9 @@ class ImprovedRAISLoader:
             
         except Exception as e:
             print(f"ERRO EXTRACAO: {nome_arquivo} - {e}")
+            if self.cache:
+                # Arquivo corrompido não pode voltar a ser servido pelo cache
+                self.cache.invalidar(f"{ano}/{nome_arquivo}")
             self.atualizar_status_arquivo(ano, nome_arquivo, 'EXTRACTION_FAILED', False,
                                         {'error': str(e)})
             return None
@@ -320,9 +1542,299 @@ class ImprovedRAISLoader:
             print(f"ERRO DICIONARIOS: Falha crítica - {e}")
             return False
 
+    def _caminho_indice_estab(self, ano: str) -> str:
+        return os.path.join(self.config['DIRETORIO_TRATADO'], f"RAIS_ESTAB_PUB_{ano}_indice.csv")
+
+    def _obter_indice_estab(self, ano: str) -> Optional[IndiceEstabelecimentos]:
+        """Índice de estabelecimentos do ano (carregado sob demanda, inclusive nos processos do pool)"""
+        if not self.config.get('ENRIQUECER_ESTABELECIMENTOS'):
+            return None
+        if ano not in self.indices_estab and os.path.exists(self._caminho_indice_estab(ano)):
+            self.indices_estab[ano] = IndiceEstabelecimentos.carregar(self._caminho_indice_estab(ano))
+        return self.indices_estab.get(ano)
+
+    def preparar_indice_estabelecimentos(self, ano: str) -> bool:
+        """Baixa o RAIS_ESTAB_PUB do ano uma vez e o reduz a um índice local"""
+        nome_arquivo = 'RAIS_ESTAB_PUB.7z'
+        caminho_indice = self._caminho_indice_estab(ano)
+        if os.path.exists(caminho_indice):
+            print(f"SKIP: Índice de estabelecimentos de {ano} já existe")
+            return True
+        
+        print(f"ESTABELECIMENTOS: Gerando índice de {ano}...")
+        caminho_7z = os.path.join(self.config['DIRETORIO_TEMPORARIO'], ano, nome_arquivo)
+        os.makedirs(os.path.dirname(caminho_7z), exist_ok=True)
+        
+        if not self.baixar_arquivo(ano, nome_arquivo, caminho_7z):
+            return False
+        caminho_txt = self.extrair_arquivo(caminho_7z, os.path.dirname(caminho_7z), ano, nome_arquivo)
+        self.limpar_arquivos_temporarios([caminho_7z])
+        if not caminho_txt:
+            return False
+        
+        try:
+            indice = IndiceEstabelecimentos.construir(caminho_txt, caminho_indice,
+                                                      self.config['CHUNK_SIZE_PROCESSAMENTO'])
+            self.indices_estab[ano] = indice
+            print(f"ESTABELECIMENTOS: ✅ {len(indice.tabela):,} chaves ({', '.join(indice.chaves)})")
+            self.atualizar_status_arquivo(ano, nome_arquivo, 'INDEXED', True, {'keys': len(indice.tabela)})
+            return True
+        except Exception as e:
+            print(f"ERRO ESTABELECIMENTOS: {e}")
+            self.atualizar_status_arquivo(ano, nome_arquivo, 'INDEX_FAILED', False, {'error': str(e)})
+            return False
+        finally:
+            self.limpar_arquivos_temporarios([caminho_txt])
+
+    def _obter_ultimo_chunk(self, ano: str, nome_arquivo: str) -> Optional[Dict]:
+        """Retorna o último chunk confirmado de um arquivo em processamento (com o total acumulado)"""
+        with self._lock_progresso:
+            status = self.progress['files_status'].get(f"{ano}:{nome_arquivo}", {})
+            if status.get('chunks'):
+                # Formato anterior: lista com um registro por chunk
+                return {**status['chunks'][-1], 'total_records': sum(c['records'] for c in status['chunks'])}
+            return status.get('last_chunk')
+
+    def _registrar_chunk(self, ano: str, nome_arquivo: str, registro_chunk: Dict):
+        """Substitui o checkpoint intra-arquivo pelo chunk recém-gravado no CSV de saída"""
+        file_key = f"{ano}:{nome_arquivo}"
+        # Mutação e gravação juntas: outro arquivo pode estar serializando o progresso
+        with self._lock_progresso:
+            status = self.progress['files_status'].setdefault(file_key, {})
+            status.pop('chunks', None)
+            status['last_chunk'] = registro_chunk
+            self._save_progress()
+
+    def _limpar_chunks(self, ano: str, nome_arquivo: str):
+        """Descarta o checkpoint de chunks de um arquivo"""
+        file_key = f"{ano}:{nome_arquivo}"
+        with self._lock_progresso:
+            status = self.progress['files_status'].get(file_key, {})
+            status.pop('chunks', None)
+            status.pop('last_chunk', None)
+
+    def _ler_chunks_pandas(self, caminho_txt: str, colunas_iniciais: List[str], linhas_a_pular: int,
+                           controlador: 'ControladorChunkMemoria'):
+        """Lê o TXT com pandas e gera (vínculos ativos, linhas lidas, bytes brutos medidos)"""
+        with open(caminho_txt, 'r', encoding='latin-1', newline='') as arquivo_txt:
+            cabecalho = next(csv.reader([arquivo_txt.readline().rstrip('\r\n')], delimiter=';'))
+            
+            # Avança sobre as linhas de entrada já confirmadas sem convertê-las em DataFrame
+            if linhas_a_pular:
+                deque(itertools.islice(arquivo_txt, linhas_a_pular), maxlen=0)
+            
+            with pd.read_csv(
+                arquivo_txt, sep=';', header=None, names=cabecalho, dtype=str,
+                chunksize=self.config['CHUNK_SIZE_PROCESSAMENTO'],
+                usecols=lambda col: col in colunas_iniciais, low_memory=False
+            ) as chunk_reader:
+                while True:
+                    try:
+                        df_chunk = chunk_reader.get_chunk(controlador.proximo_tamanho())
+                    except StopIteration:
+                        return
+                    
+                    # Mede bytes por linha apenas no chunk de calibração (deep é caro)
+                    bytes_brutos = df_chunk.memory_usage(deep=True).sum() if controlador.precisa_medir() else 0
+                    
+                    # Filtra apenas vínculos ativos
+                    df_base = df_chunk[df_chunk['Vínculo Ativo 31/12'] == "1"].drop('Vínculo Ativo 31/12', axis=1)
+                    linhas_chunk = len(df_chunk)
+                    del df_chunk
+                    
+                    yield df_base, linhas_chunk, bytes_brutos
+
+    def _ler_chunks_arrow(self, caminho_txt: str, colunas_iniciais: List[str], linhas_a_pular: int,
+                          controlador: 'ControladorChunkMemoria'):
+        """Lê o TXT com o leitor CSV em streaming do Arrow (multi-thread, latin-1 transcodificado)"""
+        try:
+            import pyarrow as pa
+            import pyarrow.csv as pa_csv
+            import pyarrow.compute as pc
+        except ImportError:
+            raise Exception("Leitor 'arrow' requer o pacote pyarrow (pip install pyarrow)")
+        
+        read_options = pa_csv.ReadOptions(
+            encoding='latin-1', use_threads=True,
+            block_size=self.config.get('ARROW_BLOCK_SIZE', 16 * 1024 * 1024),
+            skip_rows_after_names=linhas_a_pular
+        )
+        convert_options = pa_csv.ConvertOptions(
+            include_columns=colunas_iniciais, include_missing_columns=True,
+            column_types={coluna: pa.string() for coluna in colunas_iniciais},
+            null_values=VALORES_NULOS_CSV, strings_can_be_null=True
+        )
+        leitor = pa_csv.open_csv(caminho_txt, read_options=read_options,
+                                 parse_options=pa_csv.ParseOptions(delimiter=';'),
+                                 convert_options=convert_options)
+        
+        def montar_chunk(tabela):
+            # Predicado aplicado ainda no Arrow: só vínculos ativos viram objetos pandas
+            ativos = tabela.filter(pc.equal(tabela['Vínculo Ativo 31/12'], '1'))
+            df_base = ativos.drop_columns(['Vínculo Ativo 31/12']).to_pandas(split_blocks=True, self_destruct=True)
+            bytes_brutos = tabela.nbytes if controlador.precisa_medir() else 0
+            return df_base, tabela.num_rows, bytes_brutos
+        
+        # Agrupa os record batches e corta exatamente o tamanho de chunk pedido pelo controlador;
+        # um bloco do Arrow (ARROW_BLOCK_SIZE) pode render vários chunks quando o orçamento encolhe
+        batches, linhas_acumuladas = [], 0
+        for batch in leitor:
+            batches.append(batch)
+            linhas_acumuladas += batch.num_rows
+            while linhas_acumuladas >= controlador.proximo_tamanho():
+                tamanho = controlador.proximo_tamanho()
+                tabela = pa.Table.from_batches(batches)
+                restante = tabela.slice(tamanho)
+                yield montar_chunk(tabela.slice(0, tamanho))
+                batches, linhas_acumuladas = restante.to_batches(), restante.num_rows
+        
+        if linhas_acumuladas:
+            yield montar_chunk(pa.Table.from_batches(batches))
+
+    def _criar_acumulador_agregados(self, caminho_csv: str) -> AcumuladorAgregados:
+        """Cria o acumulador das tabelas resumo para um CSV tratado"""
+        niveis = {nivel: [self._sanitizar_nome_coluna(c) for c in chaves]
+                  for nivel, chaves in self.AGREGACOES.items()}
+        return AcumuladorAgregados(caminho_csv, niveis, self._sanitizar_nome_coluna('Vl Remun Média Nom'))
+
+    def _tratar_chunk(self, df_base: pd.DataFrame, ano: Optional[str] = None) -> pd.DataFrame:
+        """Enriquece, traduz, ordena, tipa e sanitiza um chunk de vínculos ativos"""
+        # Atributos do estabelecimento (pelos códigos, antes das traduções)
+        indice = self._obter_indice_estab(ano) if ano else None
+        if indice:
+            with self._etapa_perfil('enriquecimento'):
+                df_base = indice.enriquecer(df_base)
+        
+        # Aplica traduções
+        with self._etapa_perfil('traducoes'):
+            df_tratado = self._aplicar_traducoes(df_base)
+        
+        with self._etapa_perfil('tipos'):
+            # Ordem fixa de colunas (casa com o schema explícito) e tipos numéricos
+            df_tratado = df_tratado.reindex(columns=self._colunas_saida())
+            df_tratado = self._converter_colunas_numericas(df_tratado)
+            
+            # Sanitiza colunas
+            return self._sanitizar_nomes_colunas(df_tratado)
+
+    def _preparar_chunk_saida(self, df_base: pd.DataFrame, ano: str, caminho_csv: str, cabecalho: bool,
+                              medir: bool) -> Tuple[str, int, Dict[str, pd.DataFrame], int, Dict[str, Dict[str, int]],
+                                                    Optional[int]]:
+        """Trata um chunk e o serializa em CSV junto com seus agregados parciais, medidas de qualidade
+        e o RSS do processo no pico do tratamento"""
+        df_tratado = self._tratar_chunk(df_base, ano)
+        with self._etapa_perfil('agregados'):
+            parciais = self._criar_acumulador_agregados(caminho_csv).calcular_parciais(df_tratado)
+        with self._etapa_perfil('qualidade'):
+            medidas = self._medir_qualidade_chunk(df_base, df_tratado)
+        with self._etapa_perfil('to_csv'):
+            texto = df_tratado.to_csv(header=cabecalho, index=False, sep=';')
+        # Pico do chunk: bruto, tratado e texto CSV vivos ao mesmo tempo (medido no processo que tratou)
+        rss_tratamento = obter_rss_atual()
+        if self.perfilador:
+            self.perfilador.marcar_pico_chunk()
+        
+        bytes_estimados = 0
+        if medir:
+            # _aplicar_traducoes mantém uma cópia extra durante a tradução
+            bytes_estimados = int(df_base.memory_usage(deep=True).sum() +
+                                  2 * df_tratado.memory_usage(deep=True).sum() + len(texto))
+        return texto, len(df_tratado), parciais, bytes_estimados, medidas, rss_tratamento
+
+    def _colunas_traduzidas(self) -> Dict[str, List[str]]:
+        """Coluna de origem -> colunas de saída preenchidas pelos dicionários (ver _aplicar_traducoes)"""
+        destinos = {}
+        for coluna in self.dicionarios:
+            if coluna == 'Mun Trab':
+                destinos[coluna] = ['UF', 'Mun Trab (Traduzido)']
+            elif coluna in ['CNAE 2.0 Subclasse', 'CBO Ocupação 2002']:
+                destinos[coluna] = [f'{coluna} (Traduzido)']
+            else:
+                destinos[coluna] = [coluna]
+        return destinos
+
+    def _medir_qualidade_chunk(self, df_base: pd.DataFrame, df_tratado: pd.DataFrame) -> Dict[str, Dict[str, int]]:
+        """Conta nulos na origem e códigos presentes que não têm tradução (viraram 'N/I')"""
+        nulos = {coluna: int(quantidade) for coluna, quantidade in df_base.isna().sum().items() if quantidade}
+        
+        nao_traduzidos = {}
+        for origem, destinos in self._colunas_traduzidas().items():
+            if origem not in df_base.columns:
+                continue
+            presentes = df_base[origem].notna().to_numpy()
+            for destino in destinos:
+                sem_traducao = (df_tratado[self._sanitizar_nome_coluna(destino)] == 'N/I').to_numpy() & presentes
+                if sem_traducao.any():
+                    nao_traduzidos[destino] = int(sem_traducao.sum())
+        
+        # Vínculos sem estabelecimento correspondente no índice
+        coluna_estab = self._sanitizar_nome_coluna('Estab Quantidade')
+        if coluna_estab in df_tratado.columns:
+            sem_estabelecimento = int(df_tratado[coluna_estab].isna().sum())
+            if sem_estabelecimento:
+                nao_traduzidos['Estab Quantidade'] = sem_estabelecimento
+        return {'nulos': nulos, 'nao_traduzidos': nao_traduzidos}
+
+    def _registrar_qualidade(self, ano: str, nome_arquivo: str, **valores):
+        """Grava estatísticas de qualidade do arquivo (preservadas entre as etapas)"""
+        file_key = f"{ano}:{nome_arquivo}"
+        with self._lock_progresso:
+            status = self.progress['files_status'].setdefault(file_key, {})
+            status.setdefault('quality', {}).update(valores)
+            self._save_progress()
+
+    def _etapa_perfil(self, etapa: str):
+        """Contexto de perfilamento da etapa (nulo sem --profile)"""
+        return self.perfilador.etapa(etapa) if self.perfilador else nullcontext()
+
+    @classmethod
+    def para_tratamento(cls, config: Dict[str, Any], dicionarios: Dict) -> 'ImprovedRAISLoader':
+        """Loader reduzido ao tratamento de chunks: sem monitor, sessões FTP, cliente BigQuery ou progresso"""
+        loader = cls.__new__(cls)
+        loader.config = config
+        loader.dicionarios = dicionarios
+        loader.indices_estab = {}
+        loader.perfilador = None
+        return loader
+
+    def iniciar_pool_chunks(self):
+        """Cria o pool de processos de tratamento (após carregar os dicionários)"""
+        processos = self.config.get('PROCESSOS_CHUNK', 1)
+        if processos <= 1 or self._pool_chunks is not None:
+            return
+        if self.perfilador:
+            print("PERFIL: Chunks tratados no processo principal para serem perfilados (--chunk-processes ignorado)")
+            return
+        
+        # Nunca fork: o processo principal já tem threads (monitor, keepalive FTP) e um fork
+        # herdaria locks presos por elas; os processos recebem config e dicionários pelo inicializador
+        metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        config_processo = {chave: valor for chave, valor in self.config.items() if chave != 'PERFILADOR'}
+        # ProcessPoolExecutor: um processo morto (ex.: OOM killer) quebra o pool com BrokenProcessPool
+        # em vez de deixar o escritor esperando para sempre por um chunk perdido
+        self._pool_chunks = ProcessPoolExecutor(processos, mp_context=multiprocessing.get_context(metodo),
+                                                initializer=_iniciar_processo_chunks,
+                                                initargs=(config_processo, self.dicionarios))
+        print(f"PROCESSOS: ✅ {processos} processos de tratamento de chunks")
+
+    def encerrar_pool_chunks(self):
+        if self._pool_chunks is not None:
+            self._pool_chunks.shutdown(wait=True, cancel_futures=True)
+            self._pool_chunks = None
+
+    def _reiniciar_pool_chunks(self, pool_quebrado: ProcessPoolExecutor):
+        """Recria o pool quebrado pela morte de um processo; os arquivos afetados retomam pelo checkpoint"""
+        with self._lock_pool_chunks:
+            if self._pool_chunks is not pool_quebrado:
+                return  # Outro arquivo já recriou o pool
+            print("AVISO PROCESSOS: Processo de tratamento encerrado inesperadamente, recriando o pool")
+            pool_quebrado.shutdown(wait=False, cancel_futures=True)
+            self._pool_chunks = None
+            self.iniciar_pool_chunks()
+
     def processar_arquivo_rais(self, caminho_txt: str, caminho_csv_saida: str, 
                               ano: str, nome_arquivo_original: str) -> bool:
-        """Processa arquivo RAIS em chunks"""
+        """Processa arquivo RAIS em chunks, retomando do último chunk confirmado"""
         
         current_status = self.verificar_status_arquivo(ano, nome_arquivo_original)
         if current_status == 'PROCESSED' and os.path.exists(caminho_csv_saida):
@@ -331,76 +1843,198 @@ class ImprovedRAISLoader:
         
         print(f"PROCESSAMENTO: Iniciando {nome_arquivo_original}...")
         
+        agregados = self._criar_acumulador_agregados(caminho_csv_saida)
+        
         try:
-            colunas_iniciais = [
-                'CNAE 2.0 Subclasse', 'Mun Trab', 'Natureza Jurídica', 'Tamanho Estabelecimento',
-                'CBO Ocupação 2002', 'Faixa Hora Contrat', 'Faixa Tempo Emprego', 'Tipo Vínculo',
-                'Escolaridade após 2005', 'Idade', 'Nacionalidade', 'Raça Cor', 'Sexo Trabalhador',
-                'Tipo Defic', 'Vl Remun Média Nom', 'Vínculo Ativo 31/12'
-            ]
+            # Chave real do índice de estabelecimentos (se houver) também é lida
+            indice = self._obter_indice_estab(ano)
+            colunas_iniciais = self.COLUNAS_RAIS + [c for c in (indice.chaves if indice else [])
+                                                    if c not in self.COLUNAS_RAIS]
             
-            primeira_escrita = True
-            total_processados = 0
-            chunk_count = 0
+            # Checkpoint intra-arquivo: só é válido se o CSV (e seus agregados) contém tudo o que foi confirmado
+            ultimo_chunk = self._obter_ultimo_chunk(ano, nome_arquivo_original)
+            if ultimo_chunk and (not os.path.exists(caminho_csv_saida) or
+                                 os.path.getsize(caminho_csv_saida) < ultimo_chunk['output_bytes'] or
+                                 not agregados.validar(ultimo_chunk.get('agg_bytes', {}))):
+                print(f"AVISO CHECKPOINT: CSV de saída inconsistente, reiniciando {nome_arquivo_original}")
+                self._limpar_chunks(ano, nome_arquivo_original)
+                ultimo_chunk = None
             
-            print(f"CHUNKS: Processando arquivo em chunks de {self.config['CHUNK_SIZE_PROCESSAMENTO']:,}")
+            if ultimo_chunk:
+                linhas_lidas = ultimo_chunk['input_row_offset'] + ultimo_chunk['input_rows']
+                bytes_saida = ultimo_chunk['output_bytes']
+                chunk_count = ultimo_chunk['chunk'] + 1
+                total_processados = ultimo_chunk['total_records']
+                qualidade = EstatisticasQualidade(ultimo_chunk.get('quality'))
+                primeira_escrita = bytes_saida == 0
+                
+                # Descarta bytes escritos após o último chunk confirmado
+                with open(caminho_csv_saida, 'r+b') as f:
+                    f.truncate(bytes_saida)
+                agregados.abrir(ultimo_chunk.get('agg_bytes', {}))
+                
+                print(f"RETOMADA: {nome_arquivo_original} a partir do chunk {chunk_count} "
+                      f"({linhas_lidas:,} linhas já lidas, {total_processados:,} registros gravados)")
+            else:
+                linhas_lidas = 0
+                bytes_saida = 0
+                chunk_count = 0
+                total_processados = 0
+                qualidade = EstatisticasQualidade()
+                primeira_escrita = True
+                agregados.abrir()
             
-            with pd.read_csv(
-                caminho_txt, sep=';', encoding='latin-1', dtype=str,
-                chunksize=self.config['CHUNK_SIZE_PROCESSAMENTO'], 
-                usecols=lambda col: col in colunas_iniciais, low_memory=False
-            ) as chunk_reader:
+            # Com o pool de processos, até N chunks ficam em tratamento à frente do escritor
+            pool = self._pool_chunks
+            profundidade = self.config.get('PROCESSOS_CHUNK', 1) if pool else 0
+            
+            controlador = ControladorChunkMemoria(self.config.get('MEMORIA_MAXIMA_BYTES'),
+                                                  self.config['CHUNK_SIZE_PROCESSAMENTO'],
+                                                  memoria_base=self.rss_base,
+                                                  workers=self.config.get('ARQUIVOS_PARALELOS', 1) * (profundidade + 1))
+            if controlador.ativo:
+                print(f"CHUNKS: Tamanho adaptativo (orçamento {controlador.memoria_maxima / 1024**3:.1f} GB, "
+                      f"sonda de {controlador.proximo_tamanho():,} linhas)")
+            else:
+                print(f"CHUNKS: Processando arquivo em chunks de {self.config['CHUNK_SIZE_PROCESSAMENTO']:,}")
+            
+            modo_escrita = 'w' if primeira_escrita else 'a'
+            
+            leitor = self._ler_chunks_arrow if self.config.get('LEITOR_RAIS') == 'arrow' else self._ler_chunks_pandas
+            print(f"LEITOR: {self.config.get('LEITOR_RAIS', 'pandas')}")
+            self.monitor.iniciar_etapa(f"{ano}:{nome_arquivo_original}", 'processamento')
+            
+            with open(caminho_csv_saida, modo_escrita, encoding='utf-8-sig', newline='') as arquivo_saida:
                 
-                for chunk_num, df_chunk in enumerate(chunk_reader):
+                def confirmar_chunk(resultado, linhas_chunk: int, bytes_estimados: int):
+                    """Grava um chunk tratado e confirma o checkpoint, sempre na ordem de leitura"""
+                    nonlocal chunk_count, bytes_saida, total_processados, linhas_lidas
+                    chunk_num = chunk_count
                     chunk_count += 1
+                    registros_chunk = 0
+                    medidas = {}
+                    rss_tratamento = None
                     
-                    # Filtra apenas vínculos ativos
-                    df_base = df_chunk[df_chunk['Vínculo Ativo 31/12'] == "1"].copy()
-                    if len(df_base) == 0:
-                        continue
-                    
-                    df_base = df_base.drop('Vínculo Ativo 31/12', axis=1)
-                    
-                    # Aplica traduções
-                    df_tratado_chunk = self._aplicar_traducoes(df_base)
+                    if resultado is not None:
+                        texto, registros_chunk, parciais, bytes_tratamento, medidas, rss_tratamento = (
+                            resultado if isinstance(resultado, tuple) else resultado.result())
+                        bytes_estimados += bytes_tratamento
                     
-                    # Sanitiza colunas
-                    df_tratado_chunk = self._sanitizar_nomes_colunas(df_tratado_chunk)
+                    # Pico do chunk: no processo principal o texto ainda está em memória; com o pool,
+                    # cada processo trata um chunk do mesmo tamanho ao mesmo tempo e informa o próprio pico
+                    rss_pico = obter_rss_atual()
+                    if rss_pico is not None and rss_tratamento is not None:
+                        rss_pico = (rss_pico + profundidade * rss_tratamento if pool
+                                    else max(rss_pico, rss_tratamento))
                     
-                    # Salva chunk
-                    modo_escrita = 'w' if primeira_escrita else 'a'
-                    header = primeira_escrita
+                    if resultado is not None:
+                        # Salva chunk e seus agregados parciais
+                        with self._etapa_perfil('escrita'):
+                            arquivo_saida.write(texto)
+                            arquivo_saida.flush()
+                            os.fsync(arquivo_saida.fileno())
+                            agregados.gravar_parciais(parciais)
+                        total_processados += registros_chunk
+                        del texto, parciais
                     
-                    df_tratado_chunk.to_csv(
-                        caminho_csv_saida, mode=modo_escrita, header=header,
-                        index=False, sep=';', encoding='utf-8-sig'
-                    )
+                    qualidade.somar(linhas_chunk, registros_chunk, medidas)
                     
-                    total_processados += len(df_tratado_chunk)
-                    primeira_escrita = False
+                    # Confirma o chunk somente após os dados estarem em disco
+                    bytes_inicio = bytes_saida
+                    bytes_saida = os.fstat(arquivo_saida.fileno()).st_size
+                    with self._etapa_perfil('checkpoint'):
+                        self._registrar_chunk(ano, nome_arquivo_original, {
+                            'chunk': chunk_num,
+                            'input_row_offset': linhas_lidas,
+                            'input_rows': linhas_chunk,
+                            'output_offset': bytes_inicio,
+                            'output_bytes': bytes_saida,
+                            'records': registros_chunk,
+                            'total_records': total_processados,
+                            'agg_bytes': agregados.sincronizar(),
+                            'quality': qualidade.para_dict()
+                        })
+                    linhas_lidas += linhas_chunk
+                    self.monitor.avancar(f"{ano}:{nome_arquivo_original}", bytes_processados=bytes_saida - bytes_inicio,
+                                         linhas=linhas_chunk, chunk=chunk_num)
                     
                     # Limpeza de memória
-                    del df_chunk, df_base, df_tratado_chunk
-                    gc.collect()
+                    with self._etapa_perfil('gc'):
+                        gc.collect()
+                    
+                    tamanho_anterior = controlador.proximo_tamanho()
+                    controlador.registrar_chunk(linhas_chunk, bytes_estimados, rss_pico)
+                    if controlador.proximo_tamanho() != tamanho_anterior:
+                        print(f"CHUNKS: Tamanho ajustado para {controlador.proximo_tamanho():,} linhas")
                     
                     # Log periódico
                     if chunk_num % 50 == 0:
                         print(f"PROGRESSO: {chunk_num + 1} chunks, {total_processados:,} registros processados")
+                
+                em_andamento = deque()
+                chunks_lidos = leitor(caminho_txt, colunas_iniciais, linhas_lidas, controlador)
+                if self.perfilador:
+                    chunks_lidos = self.perfilador.iterar(chunks_lidos, 'leitura')
+                for df_base, linhas_chunk, bytes_estimados in chunks_lidos:
+                    # O cabeçalho vai no primeiro chunk não vazio, decidido já na leitura
+                    cabecalho = primeira_escrita and len(df_base) > 0
+                    primeira_escrita = primeira_escrita and not cabecalho
+                    medir_memoria = controlador.precisa_medir()
+                    
+                    if len(df_base) == 0:
+                        resultado = None
+                    elif pool:
+                        resultado = pool.submit(_preparar_chunk_em_processo,
+                                                df_base, ano, caminho_csv_saida, cabecalho, medir_memoria)
+                    elif self.perfilador:
+                        with self.perfilador.chunk(nome_arquivo_original, chunk_count + len(em_andamento)):
+                            resultado = self._preparar_chunk_saida(df_base, ano, caminho_csv_saida, cabecalho,
+                                                                   medir_memoria)
+                    else:
+                        resultado = self._preparar_chunk_saida(df_base, ano, caminho_csv_saida, cabecalho,
+                                                               medir_memoria)
+                    em_andamento.append((resultado, linhas_chunk, bytes_estimados))
+                    del df_base
+                    
+                    while len(em_andamento) > profundidade:
+                        confirmar_chunk(*em_andamento.popleft())
+                
+                while em_andamento:
+                    confirmar_chunk(*em_andamento.popleft())
+            
+            agregados.fechar()
+            agregados.compactar()
+            self.monitor.concluir_etapa(f"{ano}:{nome_arquivo_original}")
             
             file_size = os.path.getsize(caminho_csv_saida) / (1024*1024)  # MB
             print(f"PROCESSAMENTO: ✅ {nome_arquivo_original} concluído")
             print(f"RESULTADO: {total_processados:,} registros, {chunk_count} chunks, {file_size:.1f} MB")
+            if controlador.pico_rss:
+                print(f"MEMORIA: Pico de RSS observado {controlador.pico_rss / (1024*1024):,.0f} MB")
             
+            taxa_ativos = qualidade.linhas_mantidas / qualidade.linhas_lidas if qualidade.linhas_lidas else 0
+            print(f"QUALIDADE: {qualidade.linhas_lidas:,} linhas lidas, {taxa_ativos:.1%} vínculos ativos mantidos")
+            
+            self._limpar_chunks(ano, nome_arquivo_original)
+            with self._lock_progresso:
+                # Substitui estatísticas de um processamento anterior (inclusive a contagem carregada)
+                self.progress['files_status'][f"{ano}:{nome_arquivo_original}"]['quality'] = qualidade.para_dict()
             self.atualizar_status_arquivo(ano, nome_arquivo_original, 'PROCESSED', True, {
                 'total_records': total_processados,
+                'rows_read': qualidade.linhas_lidas,
                 'chunks_processed': chunk_count,
-                'output_file_size_mb': file_size
+                'output_file_size_mb': file_size,
+                'peak_rss_mb': controlador.pico_rss / (1024*1024)
             })
             
             return True
             
         except Exception as e:
+            agregados.fechar()
+            self.monitor.concluir_etapa(f"{ano}:{nome_arquivo_original}")
             print(f"ERRO PROCESSAMENTO: {nome_arquivo_original} - {e}")
+            if isinstance(e, BrokenProcessPool):
+                self._reiniciar_pool_chunks(pool)
             self.atualizar_status_arquivo(ano, nome_arquivo_original, 'PROCESSING_FAILED', False,
                                         {'error': str(e)})
             return False
@@ -427,22 +2061,55 @@ class ImprovedRAISLoader:
         df_tratado.fillna('N/I', inplace=True)
         return df_tratado
 
+    def _converter_colunas_numericas(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Converte colunas numéricas de texto (vírgula decimal) para inteiro/decimal"""
+        for coluna, tipo_bq in self.COLUNAS_NUMERICAS.items():
+            if coluna not in df.columns:
+                continue
+            
+            valores = df[coluna].astype(str).str.strip()
+            if tipo_bq == 'NUMERIC':
+                valores = valores.str.replace(',', '.', regex=False)
+            
+            # Valores inválidos (inclusive 'N/I') viram nulos
+            numeros = pd.to_numeric(valores, errors='coerce')
+            df[coluna] = numeros.round().astype('Int64') if tipo_bq == 'INTEGER' else numeros
+        return df
+
+    def _colunas_saida(self) -> List[str]:
+        """Ordem das colunas no CSV tratado (nomes originais)"""
+        colunas = [c for c in self.COLUNAS_RAIS if c != 'Vínculo Ativo 31/12'] + self.COLUNAS_DERIVADAS
+        if self.config.get('ENRIQUECER_ESTABELECIMENTOS'):
+            colunas += IndiceEstabelecimentos.COLUNAS
+        return colunas
+
+    def gerar_schema_bigquery(self) -> List[bigquery.SchemaField]:
+        """Gera o schema explícito da tabela a partir das colunas configuradas"""
+        return [
+            bigquery.SchemaField(self._sanitizar_nome_coluna(coluna),
+                                 self.COLUNAS_NUMERICAS.get(coluna, 'STRING'), mode='NULLABLE')
+            for coluna in self._colunas_saida()
+        ]
+
+    @staticmethod
+    def _sanitizar_nome_coluna(col: str) -> str:
+        """Sanitiza um nome de coluna para BigQuery"""
+        novo_col = col.replace('á', 'a').replace('é', 'e').replace('í', 'i').replace('ó', 'o').replace('ú', 'u')
+        novo_col = novo_col.replace('â', 'a').replace('ê', 'e').replace('ô', 'o')
+        novo_col = novo_col.replace('ã', 'a').replace('õ', 'o').replace('ç', 'c')
+        novo_col = re.sub(r'[^0-9a-zA-Z_]', '_', novo_col)
+        return '_'.join(filter(None, novo_col.split('_')))
+
     def _sanitizar_nomes_colunas(self, df: pd.DataFrame) -> pd.DataFrame:
         """Sanitiza nomes das colunas para BigQuery"""
-        novos_nomes = {}
-        for col in df.columns:
-            novo_col = col.replace('á', 'a').replace('é', 'e').replace('í', 'i').replace('ó', 'o').replace('ú', 'u')
-            novo_col = novo_col.replace('â', 'a').replace('ê', 'e').replace('ô', 'o')
-            novo_col = novo_col.replace('ã', 'a').replace('õ', 'o').replace('ç', 'c')
-            novo_col = re.sub(r'[^0-9a-zA-Z_]', '_', novo_col)
-            novo_col = '_'.join(filter(None, novo_col.split('_')))
-            novos_nomes[col] = novo_col
+        novos_nomes = {col: self._sanitizar_nome_coluna(col) for col in df.columns}
         df.rename(columns=novos_nomes, inplace=True)
         return df
 
     def carregar_csv_para_bigquery(self, caminho_csv: str, table_ref: str, 
-                                  write_disposition: str, ano: str, nome_arquivo_original: str) -> bool:
-        """Carrega CSV para BigQuery"""
+                                  write_disposition: str, ano: str, nome_arquivo_original: str,
+                                  schema: Optional[List[bigquery.SchemaField]] = None) -> bool:
+        """Carrega CSV para BigQuery (com autodetect ou com schema explícito)"""
         
         current_status = self.verificar_status_arquivo(ano, nome_arquivo_original)
         if current_status == 'UPLOADED':
@@ -455,9 +2122,13 @@ class ImprovedRAISLoader:
             job_config = bigquery.LoadJobConfig(
                 source_format=bigquery.SourceFormat.CSV,
                 write_disposition=write_disposition,
-                autodetect=True,
                 field_delimiter=';'
             )
+            if schema:
+                job_config.schema = schema
+                job_config.skip_leading_rows = 1
+            else:
+                job_config.autodetect = True
             
             with open(caminho_csv, "rb") as source_file:
                 job = self.client_bq.load_table_from_file(source_file, table_ref, job_config=job_config)
@@ -465,15 +2136,20 @@ class ImprovedRAISLoader:
             return job.result()  # Aguarda conclusão
 
         try:
-            job_result = self._execute_with_retry(f"upload BigQuery {nome_arquivo_original}", upload_operation)
+            with self.monitor.etapa(f"{ano}:{nome_arquivo_original}", 'upload'):
+                job_result = self._execute_with_retry(f"upload BigQuery {nome_arquivo_original}", upload_operation)
+                self.monitor.avancar(f"{ano}:{nome_arquivo_original}", bytes_processados=os.path.getsize(caminho_csv),
+                                     linhas=job_result.output_rows or 0)
             
             table = self.client_bq.get_table(table_ref)
             total_rows = table.num_rows
             
             print(f"BIGQUERY: ✅ {nome_arquivo_original} carregado ({total_rows:,} linhas na tabela)")
             
+            self._registrar_qualidade(ano, nome_arquivo_original, linhas_carregadas=job_result.output_rows)
             self.atualizar_status_arquivo(ano, nome_arquivo_original, 'UPLOADED', True, {
                 'table_total_rows': total_rows,
+                'loaded_rows': job_result.output_rows,
                 'write_disposition': write_disposition
             })
             
@@ -485,6 +2161,149 @@ class ImprovedRAISLoader:
                                         {'error': str(e)})
             return False
 
+    def _tabela_staging_arquivo(self, staging_ref: str, nome_arquivo: str) -> str:
+        """Tabela de staging exclusiva de um arquivo: recarregá-lo sempre a sobrescreve"""
+        return f"{staging_ref}_{self._sanitizar_nome_coluna(nome_arquivo.replace('.7z', ''))}"
+
+    def preparar_tabela_staging(self, ano: str, table_ref: str) -> str:
+        """Prepara as tabelas de staging do ano (uma por arquivo), preservando cargas já feitas nelas"""
+        staging_ref = f"{table_ref}_staging"
+        
+        with self._lock_progresso:
+            arquivos_em_staging = [k.split(':', 1)[1] for k, v in self.progress['files_status'].items()
+                                   if k.startswith(f"{ano}:") and v.get('stage') == 'UPLOADED']
+        
+        arquivos_perdidos = []
+        for nome_arquivo in arquivos_em_staging:
+            try:
+                self.client_bq.get_table(self._tabela_staging_arquivo(staging_ref, nome_arquivo))
+            except NotFound:
+                arquivos_perdidos.append(nome_arquivo)
+        
+        if arquivos_perdidos:
+            # Staging perdida: os arquivos precisam ser reprocessados
+            print(f"AVISO STAGING: {len(arquivos_perdidos)} tabelas de staging não encontradas, "
+                  f"arquivos serão recarregados")
+            for nome_arquivo in arquivos_perdidos:
+                self.atualizar_status_arquivo(ano, nome_arquivo, 'NOT_STARTED', True,
+                                            {'reason': 'staging table not found'})
+        
+        arquivos_retomados = len(arquivos_em_staging) - len(arquivos_perdidos)
+        if arquivos_retomados:
+            print(f"STAGING: Retomando {staging_ref}_* ({arquivos_retomados} arquivos já carregados)")
+        
+        # Sobras de cargas interrompidas não precisam de limpeza: a nova carga trunca a tabela do arquivo
+        print(f"STAGING: {staging_ref}_<arquivo>")
+        return staging_ref
+
+    def carregar_arquivos_staging(self, arquivos_processados: List[Tuple[str, str]],
+                                  staging_ref: str, ano: str) -> int:
+        """Carrega os CSVs tratados em paralelo, cada um na sua tabela de staging"""
+        if not arquivos_processados:
+            return 0
+        
+        uploads_com_sucesso = 0
+        
+        # WRITE_TRUNCATE por arquivo: uma carga repetida após queda (antes do UPLOADED) não duplica linhas
+        schema = self.gerar_schema_bigquery()
+        
+        max_workers = self.config.get('BQ_CARGAS_PARALELAS', 4)
+        print(f"UPLOAD STAGING: {len(arquivos_processados)} arquivos em paralelo ({max_workers} cargas simultâneas)")
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futuros = {
+                executor.submit(self.carregar_csv_para_bigquery, caminho_csv,
+                                self._tabela_staging_arquivo(staging_ref, nome_arquivo_original), "WRITE_TRUNCATE",
+                                ano, nome_arquivo_original, schema): nome_arquivo_original
+                for caminho_csv, nome_arquivo_original in arquivos_processados
+            }
+            for futuro in as_completed(futuros):
+                if futuro.result():
+                    uploads_com_sucesso += 1
+                else:
+                    print(f"ERRO UPLOAD: Falha no arquivo {futuros[futuro]}")
+        
+        return uploads_com_sucesso
+
+    def carregar_agregados_ano(self, ano: str, arquivos_ano: List[str], table_ref: str) -> bool:
+        """Combina os agregados de todos os arquivos do ano e carrega as tabelas resumo"""
+        if not self.AGREGACOES:
+            return True
+        
+        caminhos_csv = [os.path.join(self.config['DIRETORIO_TRATADO'], nome.replace('.7z', f'_{ano}_tratado.csv'))
+                        for nome in arquivos_ano]
+        acumuladores = [self._criar_acumulador_agregados(c) for c in caminhos_csv]
+        sucesso = True
+        
+        for nivel, chaves in acumuladores[0].niveis.items():
+            caminhos = [a.caminho(nivel) for a in acumuladores]
+            faltantes = [os.path.basename(c) for c in caminhos if not os.path.exists(c)]
+            if faltantes:
+                print(f"AVISO AGREGADOS: {nivel} sem parciais de {len(faltantes)} arquivos, tabela resumo não atualizada")
+                sucesso = False
+                continue
+            
+            df_agregado = AcumuladorAgregados.combinar(caminhos, chaves)
+            caminho_combinado = os.path.join(self.config['DIRETORIO_TRATADO'], f"agregado_{ano}_{nivel}.csv")
+            df_agregado.to_csv(caminho_combinado, index=False, sep=';')
+            
+            tabela_resumo = f"{table_ref}_agregado_{nivel}"
+            schema = ([bigquery.SchemaField(chave, 'STRING') for chave in chaves] +
+                      [bigquery.SchemaField('vinculos', 'INTEGER'),
+                       bigquery.SchemaField('remuneracao_n', 'INTEGER'),
+                       bigquery.SchemaField('remuneracao_soma', 'FLOAT'),
+                       bigquery.SchemaField('remuneracao_soma_quadrados', 'FLOAT')])
+            
+            def upload_operation():
+                job_config = bigquery.LoadJobConfig(
+                    source_format=bigquery.SourceFormat.CSV, write_disposition="WRITE_TRUNCATE",
+                    field_delimiter=';', skip_leading_rows=1, schema=schema
+                )
+                with open(caminho_combinado, "rb") as source_file:
+                    job = self.client_bq.load_table_from_file(source_file, tabela_resumo, job_config=job_config)
+                return job.result()
+            
+            try:
+                self._execute_with_retry(f"agregado {nivel}", upload_operation)
+                print(f"AGREGADOS: ✅ {tabela_resumo} ({len(df_agregado):,} grupos, "
+                      f"{int(df_agregado['vinculos'].sum()):,} vínculos)")
+                self.limpar_arquivos_temporarios(caminhos + [caminho_combinado])
+            except Exception as e:
+                print(f"ERRO AGREGADOS: {nivel} - {e}")
+                sucesso = False
+        
+        return sucesso
+
+    def publicar_tabela_staging(self, staging_ref: str, table_ref: str, ano: str, arquivos_ano: List[str]) -> bool:
+        """Substitui a tabela final pelas stagings dos arquivos em uma única operação (cópia atômica)"""
+        tabelas_staging = [self._tabela_staging_arquivo(staging_ref, nome) for nome in sorted(arquivos_ano)]
+        print(f"PUBLICACAO: {staging_ref}_* ({len(tabelas_staging)} tabelas) -> {table_ref}")
+        
+        def copy_operation():
+            job_config = bigquery.CopyJobConfig(write_disposition="WRITE_TRUNCATE")
+            job = self.client_bq.copy_table(tabelas_staging, table_ref, job_config=job_config)
+            return job.result()
+        
+        try:
+            self._execute_with_retry(f"publicação {table_ref}", copy_operation)
+            total_rows = self.client_bq.get_table(table_ref).num_rows
+            for tabela_staging in tabelas_staging:
+                self.client_bq.delete_table(tabela_staging, not_found_ok=True)
+            
+            with self._lock_progresso:
+                for file_key, file_status in self.progress['files_status'].items():
+                    if file_key.startswith(f"{ano}:") and file_status.get('stage') == 'UPLOADED':
+                        file_status['stage'] = 'PUBLISHED'
+                self._save_progress()
+            
+            print(f"PUBLICACAO: ✅ {table_ref} publicada ({total_rows:,} linhas)")
+            return True
+            
+        except Exception as e:
+            print(f"ERRO PUBLICACAO: {e}")
+            print(f"INFO: Dados preservados em {staging_ref}_*; execute novamente para publicar")
+            return False
+
     def limpar_arquivos_temporarios(self, arquivos_para_limpar: List[str]):
         """Remove arquivos temporários"""
         if not arquivos_para_limpar:
@@ -523,167 +2342,676 @@ class ImprovedRAISLoader:
             'last_update': self.progress['last_update']
         }
 
-    def executar_processo_completo(self, ano: str) -> bool:
-        """Executa processo completo para um ano com logs melhorados"""
+    def inicializar_sistemas(self) -> bool:
+        """Cria o cliente BigQuery e carrega os dicionários (uma vez por execução)"""
+        if self.client_bq is None and not self.criar_cliente_bigquery():
+            return False
+        if not self.carregar_dicionarios():
+            return False
         
-        self._print_header(f"PROCESSAMENTO RAIS - ANO {ano}")
+        # Memória fixa do processo (dicionários, bibliotecas) antes de qualquer chunk
+        self.rss_base = obter_rss_atual()
+        self.iniciar_pool_chunks()
+        return True
+
+    def preparar_ano(self, ano: str) -> Optional[Dict[str, Any]]:
+        """Consulta os arquivos do ano e prepara as tabelas de destino e staging"""
+        # ETAPA 2: Obtenção dos arquivos
+        self._print_step("ETAPA 2/6", f"Consulta de arquivos disponíveis ({ano})")
         
-        # Inicializa estado
-        self.progress['current_year'] = ano
-        start_time = datetime.now()
+        arquivos_ano = self.obter_arquivos_ano(ano)
+        if not arquivos_ano:
+            print("ERRO CONSULTA: Nenhum arquivo encontrado")
+            return None
         
-        print(f"SESSAO: {self.progress['session_id']}")
-        print(f"INICIO: {start_time.strftime('%H:%M:%S')}")
+        # Enriquecimento opcional: o índice precisa existir antes do primeiro chunk de vínculos
+        if self.config.get('ENRIQUECER_ESTABELECIMENTOS') and not self.preparar_indice_estabelecimentos(ano):
+            print(f"ERRO ESTABELECIMENTOS: Ano {ano} adiado (sem índice para enriquecer os vínculos)")
+            return None
+        
+        # ETAPA 3: Configuração da tabela
+        self._print_step("ETAPA 3/6", f"Configuração da tabela BigQuery ({ano})")
+        
+        table_id = f"{ano}-12"
+        table_ref = f"{self.config['PROJECT_ID_BQ']}.{self.config['DATASET_ID_BQ']}.{table_id}"
+        print(f"TABELA DESTINO: {table_ref}")
+        
+        # Cargas vão para a staging; a tabela final só muda na publicação
+        staging_ref = self.preparar_tabela_staging(ano, table_ref)
+        
+        return {'arquivos': arquivos_ano, 'table_ref': table_ref, 'staging_ref': staging_ref}
+
+    def _limpar_apos_falha(self, ano: str, nome_arquivo_7z: str, arquivos_para_limpar: List[str],
+                           caminho_txt: str):
+        """Remove os temporários de um arquivo que falhou, preservando o TXT se há checkpoint de chunks"""
+        if caminho_txt in arquivos_para_limpar and self._obter_ultimo_chunk(ano, nome_arquivo_7z):
+            print(f"LIMPEZA: Mantendo {os.path.basename(caminho_txt)} para retomar pelo checkpoint")
+            arquivos_para_limpar = [a for a in arquivos_para_limpar if a != caminho_txt]
+        self.limpar_arquivos_temporarios(arquivos_para_limpar)
+
+    def processar_arquivo_completo(self, ano: str, nome_arquivo_7z: str) -> Tuple[str, Optional[str]]:
+        """Baixa, extrai e processa um arquivo; retorna (resultado, caminho do CSV tratado)"""
+        
+        print(f"\n--- ARQUIVO: {nome_arquivo_7z} ({ano}) ---")
+        
+        if self.verificar_status_arquivo(ano, nome_arquivo_7z) == 'UPLOADED':
+            print(f"SKIP: {nome_arquivo_7z} ({ano}) já está carregado na staging")
+            self.monitor.descartar_arquivo(f"{ano}:{nome_arquivo_7z}")
+            return 'STAGED', None
+        
+        # Caminhos (o ano entra no nome para não colidir entre anos no modo lote)
+        caminho_7z_local = os.path.join(self.config['DIRETORIO_TEMPORARIO'], ano, nome_arquivo_7z)
+        nome_csv_tratado = nome_arquivo_7z.replace('.7z', f'_{ano}_tratado.csv')
+        caminho_csv_tratado = os.path.join(self.config['DIRETORIO_TRATADO'], nome_csv_tratado)
+        os.makedirs(os.path.dirname(caminho_7z_local), exist_ok=True)
+        
+        arquivos_para_limpar = []
+        orcamento = self.orcamento_disco
+        reserva = 0
+        caminho_txt_existente = caminho_7z_local.replace('.7z', '.txt')
         
         try:
-            # ETAPA 1: Inicialização
-            self._print_step("ETAPA 1/6", "Inicialização dos sistemas")
+            if self._obter_ultimo_chunk(ano, nome_arquivo_7z) and os.path.exists(caminho_txt_existente):
+                # Processamento interrompido no meio: reaproveita o TXT já extraído
+                print(f"SKIP: {nome_arquivo_7z} possui checkpoint de chunks, pulando download/extração")
+                caminho_txt = caminho_txt_existente
+                if orcamento:
+                    reserva = orcamento.reservar(os.path.getsize(caminho_txt), nome_arquivo_7z)
+            else:
+                # Reserva o pico do arquivo (7z + TXT) antes de baixar, para nunca travar na extração
+                if orcamento:
+                    compactado = self.tamanhos_remotos.get((ano, nome_arquivo_7z)) or 0
+                    reserva = orcamento.reservar(compactado + orcamento.estimar_extraido(compactado),
+                                                 nome_arquivo_7z)
+                
+                # Download
+                if not self.baixar_arquivo(ano, nome_arquivo_7z, caminho_7z_local):
+                    return 'ERROR', None
+                arquivos_para_limpar.append(caminho_7z_local)
+                
+                # O cabeçalho do 7z informa o tamanho extraído exato
+                if orcamento:
+                    compactado = os.path.getsize(caminho_7z_local)
+                    extraido = self._obter_tamanho_extraido(caminho_7z_local) or orcamento.estimar_extraido(compactado)
+                    reserva = orcamento.ajustar(reserva, compactado + extraido)
+
+                # Extração
+                caminho_txt = self.extrair_arquivo(caminho_7z_local, os.path.dirname(caminho_7z_local),
+                                                 ano, nome_arquivo_7z)
+                if not caminho_txt:
+                    self.limpar_arquivos_temporarios(arquivos_para_limpar)
+                    return 'ERROR', None
+                
+                # O 7z não é mais necessário (a retomada usa o TXT); libera o espaço já
+                self.limpar_arquivos_temporarios(arquivos_para_limpar)
+                arquivos_para_limpar.remove(caminho_7z_local)
+                if orcamento:
+                    orcamento.registrar_expansao(compactado, os.path.getsize(caminho_txt))
+                    reserva = orcamento.ajustar(reserva, os.path.getsize(caminho_txt))
+            arquivos_para_limpar.append(caminho_txt)
             
-            if not self.criar_cliente_bigquery():
-                return False
+            # Processamento
+            if not self.processar_arquivo_rais(caminho_txt, caminho_csv_tratado, ano, nome_arquivo_7z):
+                self._limpar_apos_falha(ano, nome_arquivo_7z, arquivos_para_limpar, caminho_txt)
+                return 'ERROR', None
             
-            if not self.carregar_dicionarios():
-                return False
+            # Limpeza de arquivos temporários intermediários
+            self.limpar_arquivos_temporarios(arquivos_para_limpar)
             
-            # ETAPA 2: Obtenção dos arquivos
-            self._print_step("ETAPA 2/6", "Consulta de arquivos disponíveis")
+            print(f"ARQUIVO: ✅ {nome_arquivo_7z} ({ano}) processado com sucesso")
+            return 'PROCESSED', caminho_csv_tratado
             
-            arquivos_ano = self.obter_arquivos_ano(ano)
-            if not arquivos_ano:
-                print("ERRO CONSULTA: Nenhum arquivo encontrado")
-                return False
+        except Exception as e:
+            print(f"ERRO ARQUIVO: {nome_arquivo_7z} - {e}")
+            self._limpar_apos_falha(ano, nome_arquivo_7z, arquivos_para_limpar, caminho_txt_existente)
+            return 'ERROR', None
+        finally:
+            if orcamento and reserva:
+                orcamento.liberar(reserva)
+            self.monitor.concluir_arquivo(f"{ano}:{nome_arquivo_7z}")
+
+    def finalizar_ano(self, ano: str, preparo: Dict[str, Any],
+                      resultados: Dict[str, Tuple[str, Optional[str]]], start_time: datetime) -> bool:
+        """Carrega os arquivos do ano na staging, publica e gera o relatório"""
+        arquivos_ano = preparo['arquivos']
+        table_ref = preparo['table_ref']
+        staging_ref = preparo['staging_ref']
+        self.progress['current_year'] = ano
+        
+        arquivos_processados = [(csv, nome) for nome, (resultado, csv) in sorted(resultados.items())
+                                if resultado == 'PROCESSED']
+        arquivos_ja_carregados = sum(1 for resultado, _ in resultados.values() if resultado == 'STAGED')
+        arquivos_com_erro = sum(1 for resultado, _ in resultados.values() if resultado == 'ERROR')
+        
+        # ETAPA 5: Upload para BigQuery (staging em paralelo + publicação atômica)
+        self._print_step("ETAPA 5/6", f"Upload de {len(arquivos_processados)} arquivos para BigQuery ({ano})")
+        
+        if not arquivos_processados and not arquivos_ja_carregados:
+            print("ERRO UPLOAD: Nenhum arquivo foi processado com sucesso")
+            return False
+        
+        uploads_com_sucesso = arquivos_ja_carregados + self.carregar_arquivos_staging(
+            arquivos_processados, staging_ref, ano)
+        
+        # Só publica o ano completo: leitores nunca veem uma tabela parcial
+        publicado = False
+        if uploads_com_sucesso == len(arquivos_ano):
+            publicado = self.publicar_tabela_staging(staging_ref, table_ref, ano, arquivos_ano)
+            if publicado:
+                self.carregar_agregados_ano(ano, arquivos_ano, table_ref)
+                # Ano publicado: o índice de estabelecimentos não é mais necessário
+                self.indices_estab.pop(ano, None)
+                self.limpar_arquivos_temporarios([self._caminho_indice_estab(ano)])
+        else:
+            print(f"PUBLICACAO: Adiada - {uploads_com_sucesso}/{len(arquivos_ano)} arquivos na staging")
+            print(f"INFO: {table_ref} permanece inalterada; execute novamente para completar o ano")
+        
+        # ETAPA 6: Limpeza final e relatório
+        self._print_step("ETAPA 6/6", f"Limpeza final e geração de relatório ({ano})")
+        
+        # Remove CSVs tratados já carregados na staging
+        csvs_para_limpar = [csv for csv, nome in arquivos_processados
+                            if self.verificar_status_arquivo(ano, nome) in ('UPLOADED', 'PUBLISHED')]
+        self.limpar_arquivos_temporarios(csvs_para_limpar)
+        
+        # Relatório final
+        end_time = datetime.now()
+        duration = end_time - start_time
+        
+        self._print_header("PROCESSO CONCLUÍDO")
+        print(f"SESSAO: {self.progress['session_id']}")
+        print(f"ANO PROCESSADO: {ano}")
+        print(f"INICIO: {start_time.strftime('%H:%M:%S')}")
+        print(f"TERMINO: {end_time.strftime('%H:%M:%S')}")
+        print(f"DURACAO: {str(duration).split('.')[0]}")
+        print()
+        print("RESUMO FINAL:")
+        print(f"  • Total de arquivos: {len(arquivos_ano)}")
+        print(f"  • Processados com sucesso: {len(arquivos_processados) + arquivos_ja_carregados}")
+        print(f"  • Carregados no BigQuery: {uploads_com_sucesso}")
+        print(f"  • Com erro: {arquivos_com_erro}")
+        print(f"  • Taxa de sucesso: {(uploads_com_sucesso/len(arquivos_ano)*100):.1f}%")
+        print(f"  • Tabela publicada: {'SIM' if publicado else 'NAO (dados mantidos na staging)'}")
+        
+        # Validação final da tabela
+        linhas_tabela = None
+        if publicado:
+            try:
+                table = self.client_bq.get_table(table_ref)
+                linhas_tabela = table.num_rows
+                print(f"  • Registros finais na tabela: {table.num_rows:,}")
+            except Exception as e:
+                print(f"  • Erro ao consultar tabela final: {e}")
+        
+        self.imprimir_qualidade_ano(ano, arquivos_ano, linhas_tabela)
+        
+        with self._lock_progresso:
+            falhas_ano = [(k, v) for k, v in self.progress['files_status'].items()
+                          if k.startswith(f"{ano}:") and 'FAILED' in v.get('stage', '')]
+        if falhas_ano:
+            print("\nARQUIVOS COM ERRO:")
+            for file_key, file_status in falhas_ano:
+                arquivo = file_key.split(':', 1)[1]
+                erro = file_status.get('info', {}).get('error', 'Erro não especificado')
+                print(f"  • {arquivo}: {file_status['stage']} - {erro[:80]}...")
+        
+        status_icon = "✅" if publicado else "❌"
+        print(f"\n{status_icon} RESULTADO FINAL ({ano}): {'SUCESSO' if publicado else 'FALHA'}")
+        
+        return publicado
+
+    def imprimir_qualidade_ano(self, ano: str, arquivos_ano: List[str], linhas_tabela: Optional[int]):
+        """Resumo de qualidade por arquivo e reconciliação das contagens com o BigQuery"""
+        total = EstatisticasQualidade()
+        linhas_carregadas = 0
+        divergentes = []
+        
+        print("\nQUALIDADE DOS DADOS:")
+        for nome_arquivo in sorted(arquivos_ano):
+            dados = self.progress['files_status'].get(f"{ano}:{nome_arquivo}", {}).get('quality')
+            if not dados:
+                continue
             
-            # ETAPA 3: Configuração da tabela
-            self._print_step("ETAPA 3/6", "Configuração da tabela BigQuery")
+            qualidade = EstatisticasQualidade(dados)
+            total.combinar(qualidade)
+            carregadas = dados.get('linhas_carregadas')
+            if carregadas is not None:
+                linhas_carregadas += carregadas
+                if carregadas != qualidade.linhas_mantidas:
+                    divergentes.append(nome_arquivo)
             
-            table_id = f"{ano}-12"
-            table_ref = f"{self.config['PROJECT_ID_BQ']}.{self.config['DATASET_ID_BQ']}.{table_id}"
-            print(f"TABELA DESTINO: {table_ref}")
+            taxa_ativos = qualidade.linhas_mantidas / qualidade.linhas_lidas if qualidade.linhas_lidas else 0
+            texto_carga = f"{carregadas:,}" if carregadas is not None else "-"
+            print(f"  • {nome_arquivo}: {qualidade.linhas_lidas:,} lidas, {qualidade.linhas_mantidas:,} ativas "
+                  f"({taxa_ativos:.1%}), {texto_carga} carregadas")
+        
+        if not total.linhas_lidas:
+            print("  • Sem estatísticas registradas para este ano")
+            return
+        
+        # Taxas altas de 'N/I' indicam dicionário desatualizado para o ano
+        for coluna, taxa in total.taxas(total.nao_traduzidos)[:5]:
+            print(f"  • Sem tradução (N/I) em {coluna}: {taxa:.2%}")
+        for coluna, taxa in total.taxas(total.nulos)[:5]:
+            print(f"  • Nulos na origem em {coluna}: {taxa:.2%}")
+        
+        print("\nRECONCILIACAO:")
+        print(f"  • Registros tratados: {total.linhas_mantidas:,}")
+        print(f"  • Registros carregados (jobs): {linhas_carregadas:,}")
+        if linhas_tabela is not None:
+            situacao = "✅" if linhas_tabela == total.linhas_mantidas else "⚠️  DIVERGENTE"
+            print(f"  • Registros na tabela: {linhas_tabela:,} {situacao}")
+        for nome_arquivo in divergentes:
+            print(f"  • ⚠️  {nome_arquivo}: linhas carregadas diferem das tratadas")
+
+    def executar_lote(self, anos: List[str]) -> Dict[str, bool]:
+        """Processa vários anos compartilhando cliente, dicionários e pool de workers"""
+        
+        self._print_header(f"PROCESSAMENTO RAIS - ANOS {', '.join(anos)}")
+        
+        start_time = datetime.now()
+        self.progress['batch_years'] = anos
+        print(f"SESSAO: {self.progress['session_id']}")
+        print(f"INICIO: {start_time.strftime('%H:%M:%S')}")
+        
+        resultados_anos = {ano: False for ano in anos}
+        
+        try:
+            # ETAPA 1: Inicialização (compartilhada entre os anos)
+            self._print_step("ETAPA 1/6", "Inicialização dos sistemas")
             
-            # ETAPA 4: Processamento dos arquivos
-            self._print_step("ETAPA 4/6", f"Processamento de {len(arquivos_ano)} arquivos")
+            if not self.inicializar_sistemas():
+                return resultados_anos
             
-            arquivos_processados = []
-            arquivos_com_erro = 0
+            # ETAPA 4: Todos os arquivos de todos os anos passam pelo mesmo pool
+            max_workers = self.config.get('ARQUIVOS_PARALELOS', 1)
+            self._print_step("ETAPA 4/6", f"Processamento de {len(anos)} anos ({max_workers} arquivos em paralelo)")
+            self.monitor.definir_arquivos({})
             
-            for i, nome_arquivo_7z in enumerate(arquivos_ano):
-                print(f"\n--- ARQUIVO {i+1}/{len(arquivos_ano)}: {nome_arquivo_7z} ---")
-                
-                # Caminhos
-                caminho_7z_local = os.path.join(self.config['DIRETORIO_TEMPORARIO'], nome_arquivo_7z)
-                nome_csv_tratado = nome_arquivo_7z.replace('.7z', '_tratado.csv')
-                caminho_csv_tratado = os.path.join(self.config['DIRETORIO_TRATADO'], nome_csv_tratado)
-                
-                arquivos_para_limpar = []
-                
-                try:
-                    # Download
-                    if not self.baixar_arquivo(ano, nome_arquivo_7z, caminho_7z_local):
-                        arquivos_com_erro += 1
-                        continue
-                    arquivos_para_limpar.append(caminho_7z_local)
-                    
-                    # Extração
-                    caminho_txt = self.extrair_arquivo(caminho_7z_local, self.config['DIRETORIO_TEMPORARIO'], 
-                                                     ano, nome_arquivo_7z)
-                    if not caminho_txt:
-                        arquivos_com_erro += 1
-                        self.limpar_arquivos_temporarios(arquivos_para_limpar)
+            if max_workers <= 1:
+                # Execução sequencial: cada ano é preparado logo antes dos seus arquivos
+                for ano in anos:
+                    preparo = self.preparar_ano(ano)
+                    if not preparo:
                         continue
-                    arquivos_para_limpar.append(caminho_txt)
-                    
-                    # Processamento
-                    if not self.processar_arquivo_rais(caminho_txt, caminho_csv_tratado, ano, nome_arquivo_7z):
-                        arquivos_com_erro += 1
-                        self.limpar_arquivos_temporarios(arquivos_para_limpar)
-                        continue
-                    
-                    arquivos_processados.append((caminho_csv_tratado, nome_arquivo_7z))
-                    
-                    # Limpeza de arquivos temporários intermediários
-                    self.limpar_arquivos_temporarios(arquivos_para_limpar)
-                    
-                    print(f"ARQUIVO: ✅ {nome_arquivo_7z} processado com sucesso")
-                    
-                except Exception as e:
-                    print(f"ERRO ARQUIVO: {nome_arquivo_7z} - {e}")
-                    arquivos_com_erro += 1
-                    self.limpar_arquivos_temporarios(arquivos_para_limpar)
+                    self._registrar_arquivos_monitor(ano, preparo)
+                    resultados = {nome: self.processar_arquivo_completo(ano, nome)
+                                  for nome in preparo['arquivos']}
+                    resultados_anos[ano] = self.finalizar_ano(ano, preparo, resultados, start_time)
+                return resultados_anos
             
-            # ETAPA 5: Upload para BigQuery
-            self._print_step("ETAPA 5/6", f"Upload de {len(arquivos_processados)} arquivos para BigQuery")
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            preparos = {}
+            futuros_por_ano = {}  # anos na fila e ainda não publicados, na ordem
             
-            if not arquivos_processados:
-                print("ERRO UPLOAD: Nenhum arquivo foi processado com sucesso")
-                return False
+            def pendentes() -> List:
+                return [f for futuros in futuros_por_ano.values() for f in futuros.values() if not f.done()]
             
-            uploads_com_sucesso = 0
+            def publicar_concluidos():
+                """Publica, na ordem da fila, os anos cujos arquivos já terminaram"""
+                for ano_fila in list(futuros_por_ano):
+                    futuros = futuros_por_ano[ano_fila]
+                    if not all(f.done() for f in futuros.values()):
+                        break
+                    del futuros_por_ano[ano_fila]
+                    resultados = {nome: futuro.result() for nome, futuro in futuros.items()}
+                    resultados_anos[ano_fila] = self.finalizar_ano(ano_fila, preparos.pop(ano_fila), resultados,
+                                                                   start_time)
             
-            for i, (caminho_csv, nome_arquivo_original) in enumerate(sorted(arquivos_processados)):
-                write_disposition = "WRITE_TRUNCATE" if i == 0 else "WRITE_APPEND"
-                
-                print(f"UPLOAD {i+1}/{len(arquivos_processados)}: {nome_arquivo_original} (Modo: {write_disposition})")
+            try:
+                for ano in anos:
+                    # Preparo sob demanda (listagem, índice de estabelecimentos, staging): o ano só é
+                    # preparado quando todos os arquivos na fila já estão em execução, para os workers
+                    # não ficarem ociosos e os índices não se acumularem em disco
+                    while len(pendentes()) > max_workers:
+                        wait(pendentes(), return_when=FIRST_COMPLETED)
+                        publicar_concluidos()
+                    publicar_concluidos()
+                    
+                    preparo = self.preparar_ano(ano)
+                    if not preparo:
+                        continue
+                    preparos[ano] = preparo
+                    self._registrar_arquivos_monitor(ano, preparo)
+                    futuros_por_ano[ano] = {nome: executor.submit(self.processar_arquivo_completo, ano, nome)
+                                            for nome in preparo['arquivos']}
                 
-                if self.carregar_csv_para_bigquery(caminho_csv, table_ref, write_disposition, 
-                                                  ano, nome_arquivo_original):
-                    uploads_com_sucesso += 1
-                else:
-                    print(f"ERRO UPLOAD: Falha no arquivo {nome_arquivo_original}")
-            
-            # ETAPA 6: Limpeza final e relatório
-            self._print_step("ETAPA 6/6", "Limpeza final e geração de relatório")
-            
-            # Remove CSVs tratados
-            csvs_para_limpar = [csv for csv, _ in arquivos_processados]
-            self.limpar_arquivos_temporarios(csvs_para_limpar)
-            
-            # Relatório final
-            end_time = datetime.now()
-            duration = end_time - start_time
-            
-            relatorio = self.gerar_relatorio_progresso()
-            
-            self._print_header("PROCESSO CONCLUÍDO")
-            print(f"SESSAO: {self.progress['session_id']}")
-            print(f"ANO PROCESSADO: {ano}")
-            print(f"INICIO: {start_time.strftime('%H:%M:%S')}")
-            print(f"TERMINO: {end_time.strftime('%H:%M:%S')}")
-            print(f"DURACAO: {str(duration).split('.')[0]}")
-            print()
-            print("RESUMO FINAL:")
-            print(f"  • Total de arquivos: {len(arquivos_ano)}")
-            print(f"  • Processados com sucesso: {len(arquivos_processados)}")
-            print(f"  • Carregados no BigQuery: {uploads_com_sucesso}")
-            print(f"  • Com erro: {arquivos_com_erro}")
-            print(f"  • Taxa de sucesso: {(uploads_com_sucesso/len(arquivos_ano)*100):.1f}%")
-            
-            # Validação final da tabela
-            if uploads_com_sucesso > 0:
-                try:
-                    table = self.client_bq.get_table(table_ref)
-                    print(f"  • Registros finais na tabela: {table.num_rows:,}")
-                except Exception as e:
-                    print(f"  • Erro ao consultar tabela final: {e}")
-            
-            if relatorio['status_summary'].get('FAILED', 0) > 0:
-                print("\nARQUIVOS COM ERRO:")
-                for file_key, file_status in self.progress['files_status'].items():
-                    if 'FAILED' in file_status.get('stage', ''):
-                        arquivo = file_key.split(':', 1)[1]
-                        erro = file_status.get('info', {}).get('error', 'Erro não especificado')
-                        print(f"  • {arquivo}: {file_status['stage']} - {erro[:80]}...")
+                # Cada ano é publicado assim que seus arquivos terminam, na ordem da fila
+                while futuros_por_ano:
+                    if pendentes():
+                        wait(pendentes(), return_when=FIRST_COMPLETED)
+                    publicar_concluidos()
+            except KeyboardInterrupt:
+                print("\nINTERRUPCAO: Aguardando arquivos em andamento (checkpoint por chunk)...")
+                raise
+            finally:
+                # Em interrupção descarta os arquivos que ainda estão na fila
+                executor.shutdown(wait=True, cancel_futures=True)
             
-            success = uploads_com_sucesso > 0
-            status_icon = "✅" if success else "❌"
-            print(f"\n{status_icon} RESULTADO FINAL: {'SUCESSO' if success else 'FALHA'}")
-            
-            return success
+            return resultados_anos
             
         except Exception as e:
             print(f"ERRO CRITICO: {e}")
             import traceback
             print(traceback.format_exc())
-            return False
+            return resultados_anos
+        finally:
+            self.encerrar_pool_chunks()
+
+    def _registrar_arquivos_monitor(self, ano: str, preparo: Dict[str, Any]):
+        """Inclui os arquivos de um ano preparado na previsão de término"""
+        tamanhos = {f"{ano}:{nome}": self.tamanhos_remotos.get((ano, nome)) for nome in preparo['arquivos']}
+        usar_tamanhos = all(tamanhos.values())
+        self.monitor.adicionar_arquivos({chave: tamanho if usar_tamanhos else 1
+                                         for chave, tamanho in tamanhos.items()})
+        print(f"FILA: {len(tamanhos)} arquivos de {ano}")
+
+    def executar_processo_completo(self, ano: str) -> bool:
+        """Executa processo completo para um ano com logs melhorados"""
+        self.progress['current_year'] = ano
+        return self.executar_lote([ano])[ano]
+
+# ==============================================================================
+# BENCHMARK - ARQUIVO RAIS SINTÉTICO E MEDIÇÃO DE VAZÃO
+# ==============================================================================
+
+# Distribuições aproximadas dos códigos da RAIS: coluna -> [(código, descrição, peso)]
+# Descrição None = código sem tradução no dicionário (exercita o caminho 'N/I')
+DISTRIBUICOES_SINTETICAS = {
+    'CNAE 2.0 Subclasse': [
+        ('8411600', 'Administração pública em geral', 14), ('4711302', 'Supermercados', 6),
+        ('5611201', 'Restaurantes e similares', 5), ('4120400', 'Construção de edifícios', 4),
+        ('8121400', 'Limpeza em prédios e em domicílios', 4), ('8610101', 'Atendimento hospitalar', 3),
+        ('4930202', 'Transporte rodoviário de carga', 3), ('8011101', 'Vigilância e segurança privada', 3),
+        ('4781400', 'Comércio varejista de artigos do vestuário', 3), ('8513900', 'Ensino fundamental', 2),
+        ('6201501', 'Desenvolvimento de programas sob encomenda', 1), ('1011201', 'Frigorífico - abate de bovinos', 1),
+        ('9999999', None, 0.2),
+    ],
+    'Mun Trab': [
+        ('355030', 'São Paulo', 'SP', 20), ('330455', 'Rio de Janeiro', 'RJ', 9), ('530010', 'Brasília', 'DF', 5),
+        ('310620', 'Belo Horizonte', 'MG', 5), ('410690', 'Curitiba', 'PR', 3), ('431490', 'Porto Alegre', 'RS', 3),
+        ('292740', 'Salvador', 'BA', 3), ('230440', 'Fortaleza', 'CE', 3), ('261160', 'Recife', 'PE', 3),
+        ('130260', 'Manaus', 'AM', 2), ('520870', 'Goiânia', 'GO', 2), ('350950', 'Campinas', 'SP', 2),
+        ('150140', 'Belém', 'PA', 2), ('420540', 'Florianópolis', 'SC', 1), ('211130', 'São Luís', 'MA', 1),
+    ],
+    'Natureza Jurídica': [
+        ('2062', 'Sociedade Empresária Limitada', 45), ('1031', 'Órgão Público do Poder Executivo Municipal', 12),
+        ('2135', 'Empresário (Individual)', 9), ('1023', 'Órgão Público do Poder Executivo Estadual', 8),
+        ('2054', 'Sociedade Anônima Fechada', 6), ('2046', 'Sociedade Anônima Aberta', 4),
+        ('3999', 'Associação Privada', 5), ('2305', 'Empresa Individual de Responsabilidade Limitada', 5),
+        ('1015', 'Órgão Público do Poder Executivo Federal', 3), ('2143', 'Cooperativa', 2),
+    ],
+    'Tamanho Estabelecimento': [
+        ('1', 'Zero', 1), ('2', 'Até 4', 6), ('3', 'De 5 a 9', 7), ('4', 'De 10 a 19', 9), ('5', 'De 20 a 49', 12),
+        ('6', 'De 50 a 99', 10), ('7', 'De 100 a 249', 12), ('8', 'De 250 a 499', 10), ('9', 'De 500 a 999', 10),
+        ('10', '1000 ou Mais', 23),
+    ],
+    'CBO Ocupação 2002': [
+        ('411005', 'Auxiliar de escritório', 8), ('521110', 'Vendedor de comércio varejista', 7),
+        ('411010', 'Assistente administrativo', 6), ('514320', 'Faxineiro', 4),
+        ('782510', 'Motorista de caminhão', 3), ('784205', 'Alimentador de linha de produção', 3),
+        ('517330', 'Vigilante', 3), ('322205', 'Técnico de enfermagem', 2), ('231105', 'Professor da educação infantil', 2),
+        ('422305', 'Operador de telemarketing ativo', 2), ('513505', 'Auxiliar nos serviços de alimentação', 2),
+        ('717020', 'Servente de obras', 2), ('212405', 'Analista de desenvolvimento de sistemas', 1),
+        ('999999', None, 0.2),
+    ],
+    'Faixa Hora Contrat': [
+        ('1', 'Até 12 horas', 2), ('2', '13 a 15 horas', 1), ('3', '16 a 20 horas', 5), ('4', '21 a 30 horas', 8),
+        ('5', '31 a 40 horas', 20), ('6', '41 a 44 horas', 64),
+    ],
+    'Faixa Tempo Emprego': [
+        ('1', 'Até 2,9 meses', 12), ('2', '3,0 a 5,9 meses', 10), ('3', '6,0 a 11,9 meses', 14),
+        ('4', '12,0 a 23,9 meses', 16), ('5', '24,0 a 35,9 meses', 10), ('6', '36,0 a 59,9 meses', 12),
+        ('7', '60,0 a 119,9 meses', 14), ('8', '120,0 meses ou mais', 12),
+    ],
+    'Tipo Vínculo': [
+        ('10', 'CLT U/PJ Ind', 78), ('30', 'Estatutário', 10), ('31', 'Estatutário RGPS', 4),
+        ('35', 'Estatutário Não Efetivo', 3), ('60', 'CLT R/PJ Ind', 2), ('55', 'Aprendiz', 2), ('90', 'Contrato', 1),
+    ],
+    'Escolaridade após 2005': [
+        ('1', 'Analfabeto', 1), ('2', 'Até 5ª Incompleto', 2), ('3', '5ª Completo Fundamental', 2),
+        ('4', '6ª a 9ª Fundamental', 5), ('5', 'Fundamental Completo', 8), ('6', 'Médio Incompleto', 6),
+        ('7', 'Médio Completo', 45), ('8', 'Superior Incompleto', 6), ('9', 'Superior Completo', 22),
+        ('10', 'Mestrado', 2), ('11', 'Doutorado', 1),
+    ],
+    'Nacionalidade': [('10', 'Brasileira', 98), ('20', 'Naturalizado Brasileiro', 1), ('31', 'Argentina', 0.5),
+                      ('48', 'Venezuelana', 0.5)],
+    'Raça Cor': [('1', 'Indígena', 0.5), ('2', 'Branca', 42), ('4', 'Preta', 7), ('6', 'Amarela', 1),
+                 ('8', 'Parda', 36), ('9', 'Não identificado', 13.5)],
+    'Sexo Trabalhador': [('1', 'Masculino', 56), ('2', 'Feminino', 44)],
+    'Tipo Defic': [('0', 'Não Deficiente', 98), ('1', 'Física', 1), ('2', 'Auditiva', 0.4), ('3', 'Visual', 0.4),
+                   ('4', 'Intelectual (Mental)', 0.2)],
+}
+
+# Colunas que não são lidas pelo loader, mas existem no arquivo real (mantêm a largura das linhas)
+COLUNAS_EXTRAS_SINTETICAS = ['Bairros SP', 'Bairros Fortaleza', 'Bairros RJ', 'Causa Afastamento 1',
+                             'Mês Desligamento', 'Qtd Hora Contr', 'Vl Remun Dezembro Nom', 'Ind Simples']
+
+def gerar_rais_sintetico(caminho_txt: str, tamanho_bytes: int, semente: int = 42,
+                         linhas_por_bloco: int = 200000) -> int:
+    """Gera um RAIS_VINC sintético (latin-1, ';', nomes reais de colunas) com ao menos tamanho_bytes"""
+    import numpy as np
+    rng = np.random.default_rng(semente)
+    
+    def sortear(coluna: str, n: int):
+        codigos = [item[0] for item in DISTRIBUICOES_SINTETICAS[coluna]]
+        pesos = np.array([item[-1] for item in DISTRIBUICOES_SINTETICAS[coluna]], dtype=float)
+        return rng.choice(codigos, size=n, p=pesos / pesos.sum())
+    
+    def reais(valores):
+        return pd.Series(valores).map('{:.2f}'.format).str.replace('.', ',', regex=False)
+    
+    escritos = 0
+    linhas = 0
+    with open(caminho_txt, 'wb') as f:
+        while escritos < tamanho_bytes:
+            n = linhas_por_bloco
+            remuneracao = rng.lognormal(np.log(2600), 0.75, n)
+            colunas = {coluna: sortear(coluna, n) for coluna in DISTRIBUICOES_SINTETICAS}
+            colunas.update({
+                'Bairros SP': rng.integers(0, 100, n).astype(str),
+                'Bairros Fortaleza': np.full(n, '0000'),
+                'Bairros RJ': np.full(n, '0000'),
+                'Causa Afastamento 1': rng.choice(['99', '10', '40'], size=n, p=[0.9, 0.06, 0.04]),
+                'Mês Desligamento': rng.choice(['00', '03', '07', '11'], size=n, p=[0.7, 0.1, 0.1, 0.1]),
+                'Qtd Hora Contr': rng.choice(['44', '40', '30', '20'], size=n, p=[0.64, 0.2, 0.1, 0.06]),
+                'Idade': np.clip(rng.normal(37, 12, n), 14, 80).astype(int).astype(str),
+                'Vl Remun Média Nom': reais(remuneracao),
+                'Vl Remun Dezembro Nom': reais(remuneracao * rng.uniform(0.9, 1.1, n)),
+                'Ind Simples': rng.choice(['0', '1'], size=n, p=[0.7, 0.3]),
+                'Vínculo Ativo 31/12': rng.choice(['1', '0'], size=n, p=[0.72, 0.28]),
+            })
+            ordem = COLUNAS_EXTRAS_SINTETICAS[:3] + ImprovedRAISLoader.COLUNAS_RAIS + COLUNAS_EXTRAS_SINTETICAS[3:]
+            bloco = pd.DataFrame(colunas)[ordem].to_csv(sep=';', index=False, header=(escritos == 0))
+            
+            dados = bloco.encode('latin-1')
+            f.write(dados)
+            escritos += len(dados)
+            linhas += n
+    return linhas
+
+def gerar_dicionario_sintetico(caminho_xlsx: str):
+    """Gera a planilha de dicionários no formato lido por carregar_dicionarios"""
+    with pd.ExcelWriter(caminho_xlsx) as escritor:
+        for coluna, itens in DISTRIBUICOES_SINTETICAS.items():
+            if coluna == 'Mun Trab':
+                aba = pd.DataFrame([(c, m, uf) for c, m, uf, _ in itens],
+                                   columns=['COD', 'DESC MUNICIPIO', 'DESC UF'])
+            else:
+                aba = pd.DataFrame([(c, d) for c, d, _ in itens if d is not None], columns=['COD', 'DESCRICAO'])
+            aba.to_excel(escritor, sheet_name=coluna, index=False)
+
+class MedidorPicoRSS:
+    """Amostra em segundo plano o RSS do processo (somado ao dos processos filhos, com psutil)"""
+    
+    def __init__(self, intervalo: float = 0.05):
+        self.intervalo = intervalo
+        self.pico = 0
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._amostrar, daemon=True, name='medidor-rss')
+    
+    @staticmethod
+    def _rss_total() -> int:
+        try:
+            import psutil
+        except ImportError:
+            return obter_rss_atual() or 0
+        
+        processo = psutil.Process()
+        total = processo.memory_info().rss
+        for filho in processo.children(recursive=True):
+            try:
+                total += filho.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+    
+    def _amostrar(self):
+        while not self._parar.is_set():
+            self.pico = max(self.pico, self._rss_total())
+            self._parar.wait(self.intervalo)
+    
+    def __enter__(self):
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *_):
+        self._parar.set()
+        self._thread.join()
+        self.pico = max(self.pico, self._rss_total())
+
+def medir_execucao_benchmark(caminho_7z: str, caminho_dicionario: str, diretorio: str,
+                             leitor: str, chunk_size: int, processos: int) -> Dict[str, Any]:
+    """Executa extração, tratamento em chunks e escrita do CSV para uma combinação de opções"""
+    execucao = os.path.join(diretorio, f"execucao_{leitor}_{chunk_size}")
+    shutil.rmtree(execucao, ignore_errors=True)
+    ano, nome_arquivo = 'benchmark', os.path.basename(caminho_7z)
+    
+    config = {
+        'FTP_HOST': 'benchmark.invalid',
+        'CAMINHO_DICIONARIO_EXCEL': caminho_dicionario,
+        'CHUNK_SIZE_PROCESSAMENTO': chunk_size,
+        'LEITOR_RAIS': leitor,
+        'PROCESSOS_CHUNK': processos,
+        'DIRETORIO_TEMPORARIO': os.path.join(execucao, 'temp'),
+        'DIRETORIO_TRATADO': os.path.join(execucao, 'tratado'),
+        'ARQUIVO_PROGRESSO': os.path.join(execucao, 'rais_progress.json'),
+        'ARQUIVO_STATUS': os.path.join(execucao, 'rais_status.json'),
+    }
+    loader = ImprovedRAISLoader(config)
+    if not loader.carregar_dicionarios():
+        raise Exception("Dicionário sintético não pôde ser carregado")
+    
+    caminho_7z_local = os.path.join(config['DIRETORIO_TEMPORARIO'], nome_arquivo)
+    CacheDownloads.materializar(caminho_7z, caminho_7z_local)
+    caminho_csv = os.path.join(config['DIRETORIO_TRATADO'], nome_arquivo.replace('.7z', '_tratado.csv'))
+    
+    try:
+        loader.iniciar_pool_chunks()
+        with MedidorPicoRSS() as medidor:
+            inicio = time.time()
+            caminho_txt = loader.extrair_arquivo(caminho_7z_local, config['DIRETORIO_TEMPORARIO'], ano, nome_arquivo)
+            if not caminho_txt:
+                raise Exception("Falha na extração do arquivo sintético")
+            fim_extracao = time.time()
+            
+            if not loader.processar_arquivo_rais(caminho_txt, caminho_csv, ano, nome_arquivo):
+                raise Exception("Falha no processamento do arquivo sintético")
+            fim = time.time()
+    finally:
+        loader.encerrar_pool_chunks()
+        loader.pool_ftp.fechar()
+    
+    tamanho_txt = os.path.getsize(caminho_txt)
+    tamanho_csv = os.path.getsize(caminho_csv)
+    linhas = loader.progress['files_status'][f"{ano}:{nome_arquivo}"]['quality']['linhas_lidas']
+    segundos_extracao = fim_extracao - inicio
+    segundos_processamento = fim - fim_extracao
+    shutil.rmtree(execucao, ignore_errors=True)
+    
+    return {
+        'leitor': leitor,
+        'chunk_size': chunk_size,
+        'processos': processos,
+        'linhas': linhas,
+        'txt_mb': round(tamanho_txt / (1024 * 1024), 1),
+        'csv_mb': round(tamanho_csv / (1024 * 1024), 1),
+        'extracao_s': round(segundos_extracao, 2),
+        'processamento_s': round(segundos_processamento, 2),
+        'extracao_mb_s': round(tamanho_txt / (1024 * 1024) / max(segundos_extracao, 1e-9), 1),
+        'linhas_s': round(linhas / max(segundos_processamento, 1e-9)),
+        'mb_s': round(tamanho_txt / (1024 * 1024) / max(segundos_processamento, 1e-9), 1),
+        'pico_rss_mb': round(medidor.pico / (1024 * 1024), 1),
+    }
+
+def executar_benchmark(diretorio: str, tamanho_bytes: int, tamanhos_chunk: List[int],
+                       leitores: List[str], processos: int = 1) -> List[Dict[str, Any]]:
+    """Gera (uma vez) o arquivo sintético e mede cada combinação de leitor e tamanho de chunk"""
+    os.makedirs(diretorio, exist_ok=True)
+    nome_arquivo = f"RAIS_VINC_PUB_SINTETICO_{tamanho_bytes // (1024 * 1024)}M.7z"
+    caminho_7z = os.path.join(diretorio, nome_arquivo)
+    caminho_dicionario = os.path.join(diretorio, 'dicionario_sintetico.xlsx')
+    
+    if not os.path.exists(caminho_dicionario):
+        gerar_dicionario_sintetico(caminho_dicionario)
+    
+    if not os.path.exists(caminho_7z):
+        caminho_txt = caminho_7z.replace('.7z', '.txt')
+        print(f"BENCHMARK: Gerando {os.path.basename(caminho_txt)} ({tamanho_bytes / (1024**3):.2f} GB)...")
+        inicio = time.time()
+        linhas = gerar_rais_sintetico(caminho_txt, tamanho_bytes)
+        print(f"BENCHMARK: {linhas:,} linhas geradas em {time.time() - inicio:.1f}s, compactando...")
+        # LZMA2 como nos arquivos do FTP; preset 1 porque o padrão leva horas em arquivos de dezenas de GB
+        with py7zr.SevenZipFile(caminho_7z + '.parcial', mode='w',
+                                filters=[{'id': py7zr.FILTER_LZMA2, 'preset': 1}]) as z:
+            z.write(caminho_txt, arcname=os.path.basename(caminho_txt))
+        os.replace(caminho_7z + '.parcial', caminho_7z)
+        os.remove(caminho_txt)
+    else:
+        print(f"BENCHMARK: Reaproveitando {nome_arquivo}")
+    
+    resultados = []
+    for leitor in leitores:
+        for chunk_size in tamanhos_chunk:
+            print(f"\nBENCHMARK: leitor={leitor} chunk={chunk_size:,} processos={processos}")
+            resultados.append(medir_execucao_benchmark(caminho_7z, caminho_dicionario, diretorio,
+                                                       leitor, chunk_size, processos))
+    
+    with open(os.path.join(diretorio, 'benchmark_resultados.json'), 'w', encoding='utf-8') as f:
+        json.dump({'arquivo': nome_arquivo, 'timestamp': datetime.now().isoformat(),
+                   'resultados': resultados}, f, indent=2)
+    
+    print("\n" + "=" * 70)
+    print("BENCHMARK - RESULTADOS")
+    print("=" * 70)
+    print(f"{'leitor':<8}{'chunk':>10}{'linhas/s':>12}{'MB/s':>8}{'extração MB/s':>15}{'pico RSS MB':>13}")
+    for r in resultados:
+        print(f"{r['leitor']:<8}{r['chunk_size']:>10,}{r['linhas_s']:>12,}{r['mb_s']:>8}"
+              f"{r['extracao_mb_s']:>15}{r['pico_rss_mb']:>13}")
+    return resultados
+
+def executar_benchmark_cli() -> bool:
+    """--benchmark: lê as opções --bench-* e executa o benchmark (sem FTP, BigQuery ou .env)"""
+    try:
+        tamanho = interpretar_tamanho(obter_opcao_cli('--bench-size') or '1G')
+        tamanhos_chunk = [int(c) for c in (obter_opcao_cli('--bench-chunks') or '250000,1000000').split(',')]
+        processos = int(obter_opcao_cli('--chunk-processes') or os.getenv("RAIS_CHUNK_PROCESSES") or 1)
+    except ValueError as e:
+        print(f"ERRO CONFIGURACAO: {e}")
+        return False
+    
+    leitores = [l.strip().lower() for l in (obter_opcao_cli('--bench-readers') or 'pandas,arrow').split(',')]
+    if any(l not in ('pandas', 'arrow') for l in leitores):
+        print("ERRO CONFIGURACAO: --bench-readers aceita 'pandas' e/ou 'arrow'")
+        return False
+    
+    try:
+        executar_benchmark(obter_opcao_cli('--bench-dir') or 'rais_benchmark', tamanho, tamanhos_chunk,
+                           leitores, processos)
+        return True
+    except Exception as e:
+        print(f"ERRO BENCHMARK: {e}")
+        return False
 
 # ==============================================================================
 # FUNÇÃO PRINCIPAL E UTILITÁRIOS
@@ -728,6 +3056,46 @@ def mostrar_progresso():
         print("NENHUM ARQUIVO DE PROGRESSO ENCONTRADO")
     except Exception as e:
         print(f"ERRO AO LER PROGRESSO: {e}")
+    
+    mostrar_execucao_ao_vivo()
+
+def mostrar_execucao_ao_vivo():
+    """Mostra vazão e previsão de término publicadas pela execução em andamento"""
+    try:
+        with open('rais_status.json', 'r', encoding='utf-8') as f:
+            status = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return
+    
+    atualizado = datetime.fromisoformat(status['atualizado'])
+    idade = (datetime.now() - atualizado).total_seconds()
+    print(f"\nEXECUCAO AO VIVO (pid {status.get('pid')}, atualizado {atualizado.strftime('%d/%m %H:%M:%S')}):")
+    if idade > 300:
+        print(f"  • AVISO: sem atualização há {idade/60:.0f} min (execução encerrada ou travada?)")
+    
+    if status.get('progresso') is not None:
+        print(f"  • Progresso: {status['progresso']:.1%} ({status['arquivos_pendentes']} arquivos pendentes)")
+    if status.get('previsao_termino'):
+        termino = datetime.fromisoformat(status['previsao_termino'])
+        print(f"  • Término previsto: {termino.strftime('%d/%m %H:%M')}")
+    
+    if status.get('ativos'):
+        print("\nARQUIVOS EM ANDAMENTO:")
+        for chave, ativo in status['ativos'].items():
+            if ativo['etapa'] == 'processamento':
+                detalhe = (f"chunk {ativo['chunk'] if ativo['chunk'] is not None else '-'}, "
+                           f"{ativo['linhas']:,} linhas ({ativo['linhas_s']:,.0f} linhas/s)")
+            else:
+                detalhe = f"{ativo['bytes']/1024**2:,.1f} MB ({ativo['mb_s']:.1f} MB/s)"
+            print(f"  • {chave}: {ativo['etapa']} há {ativo['segundos']:.0f}s - {detalhe}")
+    
+    if status.get('etapas'):
+        print("\nVAZAO POR ETAPA:")
+        for etapa, total in status['etapas'].items():
+            detalhe = f"{total['bytes']/1024**2:,.1f} MB ({total['mb_s']:.1f} MB/s)"
+            if total['linhas']:
+                detalhe += f", {total['linhas']:,} linhas ({total['linhas_s']:,.0f} linhas/s)"
+            print(f"  • {etapa}: {detalhe} em {total['segundos']:,.0f}s")
 
 def limpar_progresso():
     """Limpa arquivo de progresso para começar do zero"""
@@ -740,15 +3108,54 @@ def limpar_progresso():
     except Exception as e:
         print(f"ERRO: Não foi possível limpar progresso - {e}")
 
+def obter_opcao_cli(opcao: str) -> Optional[str]:
+    """Retorna o valor de uma opção de linha de comando ('--opcao valor' ou '--opcao=valor')"""
+    argumentos = sys.argv[1:]
+    for i, arg in enumerate(argumentos):
+        if arg == opcao and i + 1 < len(argumentos):
+            return argumentos[i + 1]
+        if arg.startswith(f"{opcao}="):
+            return arg.split('=', 1)[1]
+    return None
+
+def selecionar_anos(especificacao: str, anos_disponiveis: List[str]) -> List[str]:
+    """Interpreta '2015-2023' ou '2019,2021-2023' e mapeia para os diretórios do FTP"""
+    anos_pedidos = []
+    for parte in especificacao.split(','):
+        parte = parte.strip()
+        intervalo = re.fullmatch(r'(\d{4})\s*-\s*(\d{4})', parte)
+        if intervalo:
+            inicio, fim = int(intervalo.group(1)), int(intervalo.group(2))
+            anos_pedidos.extend(str(a) for a in range(min(inicio, fim), max(inicio, fim) + 1))
+        elif parte:
+            anos_pedidos.append(parte)
+    
+    anos_escolhidos = []
+    for ano in anos_pedidos:
+        # Aceita o nome exato ou o diretório que começa pelo ano (ex.: '2024 parcial')
+        candidatos = [a for a in anos_disponiveis if a == ano] or \
+                     [a for a in anos_disponiveis if a[:4] == ano]
+        if not candidatos:
+            raise ValueError(f"'{ano}' não disponível. Anos: {', '.join(anos_disponiveis)}")
+        if candidatos[0] not in anos_escolhidos:
+            anos_escolhidos.append(candidatos[0])
+    
+    return anos_escolhidos
+
 def main():
     """Função principal melhorada"""
     
+    # Benchmark com arquivo sintético: não depende de FTP, BigQuery nem das variáveis do .env
+    if len(sys.argv) > 1 and sys.argv[1].lower() == '--benchmark':
+        return executar_benchmark_cli()
+    
     # Configurações (lidas do .env)
     config = {
         'FTP_HOST': "ftp.mtps.gov.br",
         'FTP_BASE_PATH': "/pdet/microdados/RAIS/",
         'ARQUIVOS_A_EXCLUIR': ["RAIS_ESTAB_PUB.7z", "RAIS_VINC_PUB_NI.7z"],
         'CHUNK_SIZE_PROCESSAMENTO': 1000000,
+        'BQ_CARGAS_PARALELAS': 4,
         'LOCATION_BQ': "southamerica-east1",
 
         # Variáveis carregadas de forma segura do ambiente
@@ -766,6 +3173,84 @@ def main():
             print(f"ERRO CRÍTICO: A variável de ambiente para '{key}' não foi definida no arquivo .env")
             return False
     
+    # Orçamento de memória opcional (--max-memory 4G ou RAIS_MAX_MEMORY no .env)
+    memoria_maxima = obter_opcao_cli('--max-memory') or os.getenv("RAIS_MAX_MEMORY")
+    try:
+        config['MEMORIA_MAXIMA_BYTES'] = interpretar_tamanho(memoria_maxima) if memoria_maxima else None
+    except ValueError as e:
+        print(f"ERRO CONFIGURACAO: {e}")
+        return False
+    
+    # Modo lote / não interativo
+    anos_cli = obter_opcao_cli('--years')
+    modo_automatico = '--yes' in sys.argv
+    try:
+        config['ARQUIVOS_PARALELOS'] = int(obter_opcao_cli('--workers') or os.getenv("RAIS_WORKERS") or 1)
+    except ValueError:
+        print("ERRO CONFIGURACAO: --workers deve ser um número inteiro")
+        return False
+    
+    # Processos de tratamento de chunks dentro de cada arquivo (--chunk-processes 4 ou RAIS_CHUNK_PROCESSES)
+    try:
+        config['PROCESSOS_CHUNK'] = int(obter_opcao_cli('--chunk-processes') or os.getenv("RAIS_CHUNK_PROCESSES") or 1)
+    except ValueError:
+        print("ERRO CONFIGURACAO: --chunk-processes deve ser um número inteiro")
+        return False
+    
+    # Enriquecimento com atributos do estabelecimento (--estab ou RAIS_ENRICH_ESTAB=1)
+    config['ENRIQUECER_ESTABELECIMENTOS'] = ('--estab' in sys.argv or
+                                             os.getenv("RAIS_ENRICH_ESTAB", "").lower() in ('1', 'true', 'sim'))
+    
+    # Perfilamento por etapa (--profile [amostragem|cprofile] ou RAIS_PROFILE)
+    config['MODO_PERFIL'] = None
+    if '--profile' in sys.argv or os.getenv("RAIS_PROFILE"):
+        modo_perfil = obter_opcao_cli('--profile')
+        if not modo_perfil or modo_perfil.startswith('--'):
+            modo_perfil = os.getenv("RAIS_PROFILE") or 'amostragem'
+        if modo_perfil.lower() not in PerfiladorEtapas.MODOS:
+            print("ERRO CONFIGURACAO: --profile deve ser 'amostragem' ou 'cprofile'")
+            return False
+        config['MODO_PERFIL'] = modo_perfil.lower()
+    try:
+        config['PERFIL_TOP_ALOCACOES'] = int(obter_opcao_cli('--profile-top') or 10)
+        config['PERFIL_INTERVALO_ALOCACOES'] = int(obter_opcao_cli('--profile-alloc-every') or 25)
+    except ValueError:
+        print("ERRO CONFIGURACAO: --profile-top e --profile-alloc-every devem ser números inteiros")
+        return False
+    
+    # Leitor do TXT: 'pandas' (padrão) ou 'arrow' (multi-thread, requer pyarrow)
+    config['LEITOR_RAIS'] = (obter_opcao_cli('--reader') or os.getenv("RAIS_READER") or 'pandas').lower()
+    if config['LEITOR_RAIS'] not in ('pandas', 'arrow'):
+        print("ERRO CONFIGURACAO: --reader deve ser 'pandas' ou 'arrow'")
+        return False
+    
+    # Orçamento de disco opcional para downloads/extrações (--disk-budget 60G ou RAIS_DISK_BUDGET)
+    orcamento_disco = obter_opcao_cli('--disk-budget') or os.getenv("RAIS_DISK_BUDGET")
+    try:
+        config['ORCAMENTO_DISCO_BYTES'] = interpretar_tamanho(orcamento_disco) if orcamento_disco else None
+        config['RAZAO_EXPANSAO_7Z'] = float(os.getenv("RAIS_EXPANSION_RATIO")) if os.getenv("RAIS_EXPANSION_RATIO") else None
+    except ValueError as e:
+        print(f"ERRO CONFIGURACAO: {e}")
+        return False
+    
+    # Faixas paralelas por download (--ftp-segments 4 ou RAIS_FTP_SEGMENTS) e sessões FTP
+    # simultâneas (padrão: uma por worker e faixa)
+    try:
+        config['FTP_SEGMENTOS'] = max(1, int(obter_opcao_cli('--ftp-segments') or os.getenv("RAIS_FTP_SEGMENTS") or 1))
+        config['FTP_SESSOES'] = int(os.getenv("RAIS_FTP_SESSIONS") or
+                                    config['ARQUIVOS_PARALELOS'] * config['FTP_SEGMENTOS'])
+    except ValueError:
+        print("ERRO CONFIGURACAO: RAIS_FTP_SEGMENTS e RAIS_FTP_SESSIONS devem ser números inteiros")
+        return False
+    
+    # Cache de downloads opcional (--cache-dir ou RAIS_CACHE_DIR; limite RAIS_CACHE_MAX_SIZE, padrão 50G)
+    config['DIRETORIO_CACHE'] = obter_opcao_cli('--cache-dir') or os.getenv("RAIS_CACHE_DIR")
+    try:
+        config['CACHE_TAMANHO_MAXIMO'] = interpretar_tamanho(os.getenv("RAIS_CACHE_MAX_SIZE") or '50G')
+    except ValueError as e:
+        print(f"ERRO CONFIGURACAO: {e}")
+        return False
+    
     # Processa argumentos de linha de comando
     if len(sys.argv) > 1:
         arg = sys.argv[1].lower()
@@ -780,12 +3265,29 @@ def main():
             print("SISTEMA RAIS - OPCÕES DISPONÍVEIS")
             print("="*70)
             print("python script_rais.py           # Execução normal")
-            print("python script_rais.py --status  # Mostra progresso atual") 
+            print("python script_rais.py --status  # Mostra progresso, vazão e previsão de término") 
             print("python script_rais.py --clear   # Limpa progresso salvo")
             print("python script_rais.py --help    # Mostra esta ajuda")
+            print("python script_rais.py --max-memory 4G  # Limita a memória (chunks adaptativos)")
+            print("python script_rais.py --years 2015-2023 --yes  # Lote sem interação (cron)")
+            print("python script_rais.py --workers 3   # Arquivos processados em paralelo")
+            print("python script_rais.py --reader arrow  # Leitor CSV multi-thread do PyArrow")
+            print("python script_rais.py --chunk-processes 4  # Trata os chunks de cada arquivo em 4 processos")
+            print("python script_rais.py --estab  # Enriquece vínculos com o índice do RAIS_ESTAB_PUB")
+            print("python script_rais.py --profile [cprofile]  # Pilhas colapsadas por etapa e alocações por chunk")
+            print("python script_rais.py --benchmark --bench-size 5G --bench-chunks 250000,1000000  # Vazão com arquivo sintético")
+            print("python script_rais.py --cache-dir /dados/cache  # Cache de .7z verificado por SHA-256")
+            print("python script_rais.py --disk-budget 60G  # Limita o disco usado por downloads/extrações")
+            print("python script_rais.py --ftp-segments 4  # Baixa arquivos grandes em faixas paralelas")
             return True
     
     try:
+        # Perfilador criado antes do loader (e compartilhado se o loader for reinicializado)
+        if config['MODO_PERFIL']:
+            config['PERFILADOR'] = PerfiladorEtapas(obter_opcao_cli('--profile-dir') or 'rais_perfil',
+                                                    config['MODO_PERFIL'], config['PERFIL_TOP_ALOCACOES'],
+                                                    config['PERFIL_INTERVALO_ALOCACOES'])
+        
         # Inicializa loader
         loader = ImprovedRAISLoader(config)
         
@@ -796,8 +3298,9 @@ def main():
         # Testa conectividade FTP
         print("CONECTIVIDADE: Testando conexão FTP...")
         try:
-            with ftplib.FTP(config['FTP_HOST'], timeout=30) as ftp:
-                ftp.login()
+            # A sessão aberta no teste fica no pool para as consultas seguintes
+            with loader.pool_ftp.sessao():
+                pass
             print("CONECTIVIDADE: ✅ FTP acessível")
         except Exception as e:
             print(f"ERRO CONECTIVIDADE: FTP inacessível - {e}")
@@ -815,46 +3318,71 @@ def main():
             print(f"ERRO CONSULTA: Falha ao obter anos - {e}")
             return False
         
-        # Verifica se há progresso anterior
-        if loader.progress.get('current_year'):
-            current_year = loader.progress['current_year']
-            print(f"\nPROGRESSO ANTERIOR: Encontrado para o ano {current_year}")
+        if anos_cli:
+            try:
+                anos_escolhidos = selecionar_anos(anos_cli, anos_disponiveis)
+            except ValueError as e:
+                print(f"ERRO ANO: {e}")
+                return False
+        elif modo_automatico:
+            # Sem --years, o modo automático só retoma o que já estava em andamento
+            if not loader.progress.get('current_year'):
+                print("ERRO ANO: Informe --years para executar sem interação")
+                return False
+            anos_escolhidos = loader.progress.get('batch_years') or [loader.progress['current_year']]
+        else:
+            # Verifica se há progresso anterior
+            if loader.progress.get('current_year'):
+                current_year = loader.progress['current_year']
+                print(f"\nPROGRESSO ANTERIOR: Encontrado para o ano {current_year}")
             
-            relatorio = loader.gerar_relatorio_progresso()
-            print(f"STATUS ATUAL: {relatorio['status_summary']}")
+                relatorio = loader.gerar_relatorio_progresso()
+                print(f"STATUS ATUAL: {relatorio['status_summary']}")
             
-            continuar = input(f"CONTINUAR: Retomar processamento do ano {current_year}? (s/n): ").strip().lower()
-            if continuar.startswith('n'):
-                limpar = input("LIMPAR: Apagar progresso e começar do zero? (s/n): ").strip().lower()
-                if limpar.startswith('s'):
-                    limpar_progresso()
-                    loader = ImprovedRAISLoader(config)  # Reinicializa
+                continuar = input(f"CONTINUAR: Retomar processamento do ano {current_year}? (s/n): ").strip().lower()
+                if continuar.startswith('n'):
+                    limpar = input("LIMPAR: Apagar progresso e começar do zero? (s/n): ").strip().lower()
+                    if limpar.startswith('s'):
+                        limpar_progresso()
+                        loader.pool_ftp.fechar()
+                        loader = ImprovedRAISLoader(config)  # Reinicializa
+                    else:
+                        print("CANCELADO: Processo interrompido pelo usuário")
+                        return True
                 else:
-                    print("CANCELADO: Processo interrompido pelo usuário")
-                    return True
-            else:
-                ano_escolhido = current_year
+                    ano_escolhido = current_year
         
-        # Solicita ano se não há progresso anterior ou foi limpo
-        if not loader.progress.get('current_year'):
-            while True:
-                ano_escolhido = input("\nANO: Digite o ano para processar: ").strip()
-                if ano_escolhido in anos_disponiveis:
-                    break
-                elif ano_escolhido.lower() in ['quit', 'exit', 'sair']:
-                    print("CANCELADO: Processo interrompido pelo usuário")
-                    return True
-                else:
-                    print(f"ERRO ANO: '{ano_escolhido}' não disponível. Anos: {', '.join(anos_disponiveis)}")
+            # Solicita ano se não há progresso anterior ou foi limpo
+            if not loader.progress.get('current_year'):
+                while True:
+                    ano_escolhido = input("\nANO: Digite o ano para processar: ").strip()
+                    if ano_escolhido in anos_disponiveis:
+                        break
+                    elif ano_escolhido.lower() in ['quit', 'exit', 'sair']:
+                        print("CANCELADO: Processo interrompido pelo usuário")
+                        return True
+                    else:
+                        print(f"ERRO ANO: '{ano_escolhido}' não disponível. Anos: {', '.join(anos_disponiveis)}")
+        
+            anos_escolhidos = [ano_escolhido]
         
         # Executa processo principal
-        print(f"\nPREPARANDO: Início do processamento para o ano {ano_escolhido}")
+        print(f"\nPREPARANDO: Início do processamento para o(s) ano(s) {', '.join(anos_escolhidos)}")
         print("INFO: Processo pode ser interrompido e retomado a qualquer momento")
         print("INFO: Progresso salvo automaticamente em 'rais_progress.json'")
         
-        input("\nPressione ENTER para continuar ou Ctrl+C para cancelar...")
+        if not modo_automatico:
+            input("\nPressione ENTER para continuar ou Ctrl+C para cancelar...")
         
-        sucesso = loader.executar_processo_completo(ano_escolhido)
+        if len(anos_escolhidos) == 1:
+            sucesso = loader.executar_processo_completo(anos_escolhidos[0])
+        else:
+            resultados = loader.executar_lote(anos_escolhidos)
+            print("\nRESUMO DO LOTE:")
+            for ano, ok in resultados.items():
+                print(f"  • {ano}: {'✅ publicado' if ok else '❌ pendente'}")
+            sucesso = all(resultados.values())
+        loader.pool_ftp.fechar()
         
         if sucesso:
             print("\n🎉 PROCESSO FINALIZADO COM SUCESSO!")
@@ -874,9 +3402,14 @@ def main():
         import traceback
         print(traceback.format_exc())
         return False
+    
+    finally:
+        # O perfil também é gravado em execuções interrompidas (em geral, as lentas)
+        if config.get('PERFILADOR'):
+            config['PERFILADOR'].finalizar()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(0 if main() else 1)
 
 # ==============================================================================
 # DOCUMENTAÇÃO DE USO
@@ -897,6 +3430,17 @@ COMANDOS DISPONÍVEIS:
 - python script_rais.py --status  # Mostra progresso atual
 - python script_rais.py --clear   # Limpa progresso salvo  
 - python script_rais.py --help    # Mostra ajuda
+- python script_rais.py --max-memory 4G  # Chunks adaptativos ao orçamento de memória
+- python script_rais.py --years 2015-2023 --yes  # Lote de anos sem interação (cron)
+- python script_rais.py --workers 3   # Arquivos processados em paralelo
+- python script_rais.py --reader arrow  # Leitura multi-thread com PyArrow
+- python script_rais.py --chunk-processes 4  # Tratamento dos chunks em vários núcleos
+- python script_rais.py --estab  # Vínculos enriquecidos com atributos do estabelecimento
+- python script_rais.py --profile --profile-dir perfil  # Onde o tempo e a memória são gastos
+- python script_rais.py --benchmark --bench-size 5G --bench-readers pandas,arrow  # Benchmark sintético
+- python script_rais.py --cache-dir /dados/cache  # Reaproveita downloads (SHA-256 + LRU)
+- python script_rais.py --disk-budget 60G  # Agenda downloads/extrações pelo espaço em disco
+- python script_rais.py --ftp-segments 4  # Downloads em faixas paralelas (REST)
 
 EXEMPLO DE LOGS:
 ======================================================================
@@ -915,8 +3459,20 @@ EXTRACAO: ✅ RAIS_VINC_PUB_CENTRO_OESTE.7z concluído (1,023.4 MB)
 
 RECURSOS MANTIDOS:
 🔄 Sistema de retry automático
-💾 Checkpoint/progresso para retomar
+💾 Checkpoint/progresso para retomar (inclusive no meio do arquivo, por chunk)
 🔍 Verificação de integridade  
 🧹 Limpeza automática de arquivos
 📊 Relatórios detalhados de validação
+📦 Carga paralela em staging com publicação atômica do ano
+📈 Tabelas resumo (contagem, soma e soma dos quadrados) calculadas no mesmo passe
+🗄️ Cache de downloads endereçado por SHA-256, com despejo LRU
+💽 Downloads e extrações agendados por orçamento de disco
+🔌 Pool de sessões FTP com keepalive e reconexão automática
+⏯️ Downloads retomados do ponto de falha (REST), opcionalmente em faixas paralelas
+🧵 Chunks tratados em vários processos com escrita ordenada
+🩺 Estatísticas de qualidade (N/I, nulos, ativos) e reconciliação com o BigQuery
+⏱️ Vazão por etapa e previsão de término ao vivo (rais_status.json, --status)
+🏭 Índice local do RAIS_ESTAB_PUB para enriquecer os vínculos antes da carga
+🔬 Perfilamento por etapa: pilhas colapsadas (flamegraph), cProfile e top-N alocações por chunk
+📏 Benchmark reprodutível com RAIS_VINC e dicionário sintéticos (linhas/s, MB/s, pico de RSS)
 """
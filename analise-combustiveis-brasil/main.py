@@ -1,135 +1,27 @@
 import os
+import sys
+import gc
+import csv
+import codecs
 import glob
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.styles import Alignment
-from datetime import date, datetime
-import calendar
-from openpyxl.utils import get_column_letter
+import json
+import argparse
+import importlib.util
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from datetime import datetime, timedelta
-import xlrd
-from openpyxl.utils.exceptions import InvalidFileException
-from datetime import date
-from datetime import datetime
-import numpy as np
-import csv
-from google.cloud import bigquery
-from google.oauth2 import service_account
-import pandas_gbq
 
-# Função auxiliar para converter datas para formato DATE do BigQuery
-def preparar_dataframe_para_bigquery(df):
-    """Prepara o DataFrame convertendo as colunas de data para o formato correto"""
-    df_copy = df.copy()
-    
-    # Converter colunas de data do formato string para datetime
-    if 'DATA_INICIAL' in df_copy.columns:
-        df_copy['DATA_INICIAL'] = pd.to_datetime(df_copy['DATA_INICIAL'], format='%d/%m/%Y').dt.date
-    if 'DATA_FINAL' in df_copy.columns:
-        df_copy['DATA_FINAL'] = pd.to_datetime(df_copy['DATA_FINAL'], format='%d/%m/%Y').dt.date
-    
-    return df_copy
-
-# NOVA FUNÇÃO PARA VERIFICAR E SUBSTITUIR DADOS
-def verificar_e_substituir_dados_bigquery(df, table_id, data_final, project_id, credentials):
-    """
-    Verifica se já existem dados para a data especificada e substitui se necessário
-    
-    Args:
-        df: DataFrame com os novos dados
-        table_id: ID da tabela no BigQuery (formato: project.dataset.table)
-        data_final: Data final para verificar (formato: date object)
-        project_id: ID do projeto no BigQuery
-        credentials: Credenciais do BigQuery
-    """
-    print(f"\n--- Verificando existência de dados para DATA_FINAL: {data_final} na tabela {table_id.split('.')[-1]} ---")
-    
-    try:
-        # Query para verificar se já existem dados para esta data
-        query_verificacao = f"""
-        SELECT COUNT(*) as total_registros
-        FROM `{table_id}`
-        WHERE DATA_FINAL = '{data_final}'
-        """
-        
-        # Executar a query de verificação
-        resultado_verificacao = pandas_gbq.read_gbq(query_verificacao, project_id=project_id, credentials=credentials)
-        total_registros_existentes = resultado_verificacao['total_registros'].iloc[0]
-        
-        if total_registros_existentes > 0:
-            print(f"   ⚠️  Encontrados {total_registros_existentes} registros existentes para a data {data_final}")
-            print("   🔄 Removendo dados existentes para substituir...")
-            
-            # Query para deletar os registros existentes
-            query_delete = f"""
-            DELETE FROM `{table_id}`
-            WHERE DATA_FINAL = '{data_final}'
-            """
-            
-            # Executar o delete
-            client = bigquery.Client(credentials=credentials, project=project_id)
-            job_delete = client.query(query_delete)
-            job_delete.result()  # Aguardar a conclusão
-            
-            print(f"   ✅ Dados existentes removidos com sucesso")
-        else:
-            print(f"   ✅ Nenhum registro existente encontrado para a data {data_final}")
-        
-        # Inserir os novos dados
-        print(f"   📤 Inserindo {len(df)} novos registros...")
-        pandas_gbq.to_gbq(df, table_id, project_id=project_id, if_exists='append', credentials=credentials)
-        print(f"   ✅ Dados inseridos com sucesso na tabela '{table_id.split('.')[-1]}'")
-        
-    except Exception as e:
-        print(f"   ❌ Erro ao processar dados na tabela '{table_id.split('.')[-1]}': {e}")
-        raise e
-
-# NOVA FUNÇÃO AUXILIAR PARA EXTRAIR DATA FINAL
-def extrair_data_final(df):
-    """
-    Extrai a data final dos dados preparados para BigQuery
-    """
-    if 'DATA_FINAL' in df.columns and len(df) > 0:
-        # Pega a primeira data final (assumindo que todas são iguais no lote)
-        data_final = df['DATA_FINAL'].iloc[0]
-        return data_final
-    else:
-        raise ValueError("Coluna DATA_FINAL não encontrada ou DataFrame vazio")
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
 
 # Carrega as variáveis de ambiente do arquivo .env
-# Esta linha deve vir no início do seu script
 load_dotenv()
 
-# --- CARREGA CONFIGURAÇÕES SENSÍVEIS DO AMBIENTE ---
-PROJECT_ID = os.getenv("GCP_PROJECT_ID")
-CREDENTIALS_PATH = os.getenv("GCP_CREDENTIALS_PATH")
-DATASET_ID = os.getenv("BIGQUERY_DATASET_ID")
-INPUT_DIR = os.getenv("INPUT_DIR") # Diretório de downloads/entrada
-OUTPUT_DIR = os.getenv("OUTPUT_DIR") # Diretório de documentos/saída
-
-# Validação para garantir que as variáveis foram carregadas
-if not all([PROJECT_ID, CREDENTIALS_PATH, DATASET_ID, INPUT_DIR, OUTPUT_DIR]):
-    raise ValueError("Uma ou mais variáveis de ambiente essenciais não foram definidas no arquivo .env")
-
-# Configurar credenciais a partir do caminho seguro
-credentials = service_account.Credentials.from_service_account_file(CREDENTIALS_PATH)
-client = bigquery.Client(credentials=credentials, project=PROJECT_ID)
-
-# Diretório de downloads
-diretorio_downloads = os.path.join(os.path.expanduser('~'), 'Downloads')
-
-# Diretório de documentos
-diretorio_documentos = os.path.join(os.path.expanduser('~'), 'Documents')
-
-# Padrão de nome do arquivo
-padrao_nome_arquivo = '*.xlsx'
-
-# Caminho completo para o arquivo de saída na pasta de documentos
-arquivo_saida = os.path.join(diretorio_documentos, 'resumo_semanal_modificado.xlsx')
-
-# Listar todos os arquivos que correspondem ao padrão de nome
-arquivos = glob.glob(os.path.join(diretorio_downloads, padrao_nome_arquivo))
+# ============================================================================
+# CONSTANTES
+# ============================================================================
 
 # Mapeamento de produtos para tipo de produto
 mapa_tipo_produto = {
@@ -142,612 +34,1244 @@ mapa_tipo_produto = {
     'GLP': 'GLP'
 }
 
-# Caminho completo para o arquivo de saída na pasta de documentos
-arquivo_saida = os.path.join(diretorio_documentos, 'resumo_semanal_modificado.xlsx')
-
-# Verificar se há arquivos correspondentes
-if arquivos:
-    # Selecionar o último arquivo pela data de modificação
-    arquivo_mais_recente = max(arquivos, key=os.path.getmtime)
-    
-    # Carregar o arquivo Excel
-    workbook = pd.ExcelFile(arquivo_mais_recente)
-    
-    # Criar um escritor Excel
-    with pd.ExcelWriter(arquivo_saida, engine='xlsxwriter') as writer:
-        # Ler o conteúdo da primeira aba para obter a data
-
-        df_primeira_aba = workbook.parse(workbook.sheet_names[0], header=None)
-        cabecalho_index = df_primeira_aba[df_primeira_aba.iloc[:, 0] == 'DATA INICIAL'].index[0]
-        data_atual_base = df_primeira_aba.iloc[cabecalho_index + 1, 0].strftime('%d/%m/%Y')  # Manter a data como está no arquivo original
-        data_anterior_base = (pd.to_datetime(data_atual_base, format='%d/%m/%Y') - pd.DateOffset(days=7)).strftime('%d/%m/%Y')
-        
-        # Imprimir as datas
-        print(f'Data atual: {data_atual_base}')
-        print(f'Data anterior: {data_anterior_base}')
-        
-        # Iterar sobre as abas (tabelas)
-        for nome_aba in workbook.sheet_names:
-            # Ler o conteúdo da aba em um DataFrame
-            df_temporario = workbook.parse(nome_aba, header=None)  # Não usar cabeçalho
-            cabecalho_index = df_temporario[df_temporario.iloc[:, 0] == 'DATA INICIAL'].index[0]
-            df_temporario.columns = df_temporario.iloc[cabecalho_index]  # Usar a linha correta como cabeçalho
-            df_temporario = df_temporario.iloc[cabecalho_index+1:]  # Excluir linhas anteriores ao cabeçalho
-            
-            # Modificar as datas para o formato desejado '%d/%m/%Y'
-            df_temporario['DATA INICIAL'] = pd.to_datetime(df_temporario['DATA INICIAL']).dt.strftime('%d/%m/%Y')
-            df_temporario['DATA FINAL'] = pd.to_datetime(df_temporario['DATA FINAL']).dt.strftime('%d/%m/%Y')
-            
-            # Adicionar a coluna 'TIPO PRODUTO' baseada no valor da coluna 'PRODUTO'
-            df_temporario['TIPO PRODUTO'] = df_temporario['PRODUTO'].map(mapa_tipo_produto)
-            
-            # Salvar o DataFrame como uma aba no arquivo Excel
-            df_temporario.to_excel(writer, sheet_name=nome_aba, index=False, na_rep='')
-    
-    print(f'Arquivo salvo com sucesso em {arquivo_saida}')
-else:
-    print("Nenhum arquivo encontrado com o padrão de nome especificado.")
-
-data_atual = data_atual_base
-data_anterior = data_anterior_base
-
-# Caminho do arquivo resumo_semanal_modificado.xlsx
-diretorio_documentos = os.path.join(os.path.expanduser('~'), 'Documents')
-caminho_resumo_modificado = os.path.join(diretorio_documentos, 'resumo_semanal_modificado.xlsx')
-
-# Carregar os dados das abas
-df_capitais = pd.read_excel(caminho_resumo_modificado, sheet_name='CAPITAIS')
-df_estados = pd.read_excel(caminho_resumo_modificado, sheet_name='ESTADOS')
-df_municipios = pd.read_excel(caminho_resumo_modificado, sheet_name='MUNICIPIOS')
-df_regioes = pd.read_excel(caminho_resumo_modificado, sheet_name='REGIOES')
-df_brasil = pd.read_excel(caminho_resumo_modificado, sheet_name='BRASIL')
-
-# Mapear as colunas dos DataFrames
-df_capitais.columns = [
-    'DATA_INICIAL', 'DATA_FINAL', 'ESTADO', 'MUNICIPIO', 'PRODUTO', 
-    'NUMERO_DE_POSTOS_PESQUISADOS', 'UNIDADE_DE_MEDIDA', 'PRECO_MEDIO_REVENDA',
-    'DESVIO_PADRAO_REVENDA', 'PRECO_MINIMO_REVENDA', 'PRECO_MAXIMO_REVENDA', 
-    'COEF_DE_VARIACAO_REVENDA', 'TIPO_PRODUTO'
-]
+# Produtos exibidos nos resumos, na ordem desejada
+produtos_ordem = ['OLEO DIESEL', 'OLEO DIESEL S10', 'GASOLINA COMUM', 'GASOLINA ADITIVADA', 'ETANOL HIDRATADO', 'GNV']
 
-df_estados.columns = [
-    'DATA_INICIAL', 'DATA_FINAL', 'REGIAO', 'ESTADO', 'PRODUTO', 
-    'NUMERO_DE_POSTOS_PESQUISADOS', 'UNIDADE_DE_MEDIDA', 'PRECO_MEDIO_REVENDA',
-    'DESVIO_PADRAO_REVENDA', 'PRECO_MINIMO_REVENDA', 'PRECO_MAXIMO_REVENDA', 
-    'COEF_DE_VARIACAO_REVENDA', 'TIPO_PRODUTO'
-]
-
-df_municipios.columns = [
-    'DATA_INICIAL', 'DATA_FINAL', 'ESTADO', 'MUNICIPIO', 'PRODUTO', 
-    'NUMERO_DE_POSTOS_PESQUISADOS', 'UNIDADE_DE_MEDIDA', 'PRECO_MEDIO_REVENDA',
-    'DESVIO_PADRAO_REVENDA', 'PRECO_MINIMO_REVENDA', 'PRECO_MAXIMO_REVENDA', 
-    'COEF_DE_VARIACAO_REVENDA', 'TIPO_PRODUTO'
+# Lista de capitais
+capitais = [
+    'ARACAJU', 'BELEM', 'BELO HORIZONTE', 'BOA VISTA', 'BRASILIA', 'CAMPO GRANDE',
+    'CUIABA', 'CURITIBA', 'FLORIANOPOLIS', 'FORTALEZA', 'GOIANIA', 'JOAO PESSOA',
+    'MACAPA', 'MACEIO', 'MANAUS', 'NATAL', 'PALMAS', 'PORTO ALEGRE', 'PORTO VELHO',
+    'RECIFE', 'RIO BRANCO', 'RIO DE JANEIRO', 'SALVADOR', 'SAO LUIS', 'SAO PAULO', 'TERESINA', 'VITORIA'
 ]
 
-df_regioes.columns = [
-    'DATA_INICIAL', 'DATA_FINAL', 'REGIAO', 'PRODUTO', 
+# Colunas de preço comuns a todas as abas
+COLUNAS_PRECO = [
     'NUMERO_DE_POSTOS_PESQUISADOS', 'UNIDADE_DE_MEDIDA', 'PRECO_MEDIO_REVENDA',
-    'DESVIO_PADRAO_REVENDA', 'PRECO_MINIMO_REVENDA', 'PRECO_MAXIMO_REVENDA', 
+    'DESVIO_PADRAO_REVENDA', 'PRECO_MINIMO_REVENDA', 'PRECO_MAXIMO_REVENDA',
     'COEF_DE_VARIACAO_REVENDA', 'TIPO_PRODUTO'
 ]
 
-df_brasil.columns = [
-    'DATA_INICIAL', 'DATA_FINAL', 'BRASIL', 'PRODUTO', 
-    'NUMERO_DE_POSTOS_PESQUISADOS', 'UNIDADE_DE_MEDIDA', 'PRECO_MEDIO_REVENDA',
-    'DESVIO_PADRAO_REVENDA', 'PRECO_MINIMO_REVENDA', 'PRECO_MAXIMO_REVENDA', 
-    'COEF_DE_VARIACAO_REVENDA', 'TIPO_PRODUTO'
-]
+# Aba da planilha -> (tabela no BigQuery, colunas na ordem da aba)
+ABAS = {
+    'CAPITAIS': ('Capitais', ['DATA_INICIAL', 'DATA_FINAL', 'ESTADO', 'MUNICIPIO', 'PRODUTO'] + COLUNAS_PRECO),
+    'ESTADOS': ('Estados', ['DATA_INICIAL', 'DATA_FINAL', 'REGIAO', 'ESTADO', 'PRODUTO'] + COLUNAS_PRECO),
+    'MUNICIPIOS': ('Municipios', ['DATA_INICIAL', 'DATA_FINAL', 'ESTADO', 'MUNICIPIO', 'PRODUTO'] + COLUNAS_PRECO),
+    'REGIOES': ('Regioes', ['DATA_INICIAL', 'DATA_FINAL', 'REGIAO', 'PRODUTO'] + COLUNAS_PRECO),
+    'BRASIL': ('Brasil', ['DATA_INICIAL', 'DATA_FINAL', 'BRASIL', 'PRODUTO'] + COLUNAS_PRECO),
+}
 
-# AQUI COMEÇA A PARTE MODIFICADA - INSERÇÃO NO BIGQUERY COM VERIFICAÇÃO
-print("\n" + "="*80)
-print("INSERINDO DADOS NO BIGQUERY COM VERIFICAÇÃO DE DUPLICATAS")
-print("="*80)
-
-######################### CAPITAIS ##################################################
-try:
-    # Preparar DataFrame para BigQuery
-    df_capitais_preparado = preparar_dataframe_para_bigquery(df_capitais)
-    data_final = extrair_data_final(df_capitais_preparado)
-    
-    # Verificar e inserir dados
-    table_id = f'{PROJECT_ID}.{DATASET_ID}.Capitais'
-    verificar_e_substituir_dados_bigquery(df_capitais_preparado, table_id, data_final, PROJECT_ID, credentials)
-except Exception as e:
-    print(f"Erro ao processar CAPITAIS: {e}")
-
-######################### ESTADOS ##################################################
-try:
-    # Preparar DataFrame para BigQuery
-    df_estados_preparado = preparar_dataframe_para_bigquery(df_estados)
-    data_final = extrair_data_final(df_estados_preparado)
-    
-    # Verificar e inserir dados
-    table_id = f'{PROJECT_ID}.{DATASET_ID}.Estados'
-    verificar_e_substituir_dados_bigquery(df_estados_preparado, table_id, data_final, PROJECT_ID, credentials)
-except Exception as e:
-    print(f"Erro ao processar ESTADOS: {e}")
-
-######################### MUNICIPIOS ##################################################
-try:
-    # Preparar DataFrame para BigQuery
-    df_municipios_preparado = preparar_dataframe_para_bigquery(df_municipios)
-    data_final = extrair_data_final(df_municipios_preparado)
-    
-    # Verificar e inserir dados
-    table_id = f'{PROJECT_ID}.{DATASET_ID}.Municipios'
-    verificar_e_substituir_dados_bigquery(df_municipios_preparado, table_id, data_final, PROJECT_ID, credentials)
-except Exception as e:
-    print(f"Erro ao processar MUNICIPIOS: {e}")
-
-######################### REGIOES ##################################################
-try:
-    # Preparar DataFrame para BigQuery
-    df_regioes_preparado = preparar_dataframe_para_bigquery(df_regioes)
-    data_final = extrair_data_final(df_regioes_preparado)
-    
-    # Verificar e inserir dados
-    table_id = f'{PROJECT_ID}.{DATASET_ID}.Regioes'
-    verificar_e_substituir_dados_bigquery(df_regioes_preparado, table_id, data_final, PROJECT_ID, credentials)
-except Exception as e:
-    print(f"Erro ao processar REGIOES: {e}")
-
-######################### BRASIL ##################################################
-try:
-    # Preparar DataFrame para BigQuery
-    df_brasil_preparado = preparar_dataframe_para_bigquery(df_brasil)
-    data_final = extrair_data_final(df_brasil_preparado)
-    
-    # Verificar e inserir dados
-    table_id = f'{PROJECT_ID}.{DATASET_ID}.Brasil'
-    verificar_e_substituir_dados_bigquery(df_brasil_preparado, table_id, data_final, PROJECT_ID, credentials)
-except Exception as e:
-    print(f"Erro ao processar BRASIL: {e}")
-
-print("\n" + "="*80)
-print("PROCESSO DE INSERÇÃO CONCLUÍDO")
-print("="*80)
-
-# RESTO DO SEU CÓDIGO ORIGINAL CONTINUA AQUI...
-# Query SQL para selecionar os dados da tabela específica
-query_sql = f"SELECT * FROM `{PROJECT_ID}.{DATASET_ID}.Brasil`"
-
-try:
-    # Primeira versão
-    print("Executando a primeira versão...")
-    
-    # Carregar a aba 'BRASIL' como um DataFrame
-    df_brasil = pandas_gbq.read_gbq(query_sql, project_id=PROJECT_ID, credentials=credentials)
-
-    # Converter as colunas 'DATA_INICIAL' e 'DATA FINAL' para datetime e formatá-las de volta para %d/%m/%Y
-    df_brasil['DATA_INICIAL'] = pd.to_datetime(df_brasil['DATA_INICIAL'])
-    df_brasil['DATA_FINAL'] = pd.to_datetime(df_brasil['DATA_FINAL'])
-
-    # Voltar a formatar para string no formato desejado
-    df_brasil['DATA_INICIAL'] = df_brasil['DATA_INICIAL'].dt.strftime('%d/%m/%Y')
-    df_brasil['DATA_FINAL'] = df_brasil['DATA_FINAL'].dt.strftime('%d/%m/%Y')
-
-    # Filtrar os dados pela data atual
-    df_brasil_atual = df_brasil[df_brasil['DATA_INICIAL'] == data_atual]
-
-    # Selecionar apenas as colunas desejadas
-    produtos_combustiveis = ['OLEO DIESEL', 'OLEO DIESEL S10', 'GASOLINA COMUM', 'GASOLINA ADITIVADA', 'ETANOL HIDRATADO', 'GNV']
-
-    # Ordenar os produtos na ordem desejada
-    produtos_ordem = ['OLEO DIESEL', 'OLEO DIESEL S10', 'GASOLINA COMUM', 'GASOLINA ADITIVADA', 'ETANOL HIDRATADO', 'GNV']
-    precos_medios_revenda_brasil = df_brasil_atual[df_brasil_atual['PRODUTO'].isin(produtos_ordem)]
+# Etapas executáveis pela linha de comando, na ordem do pipeline
+ETAPAS = ['particionamento', 'backfill', 'ingestao', 'carga', 'sincronizacao', 'indicadores', 'comparacao', 'relatorio']
 
-    # Formatar o print desejado
-    print("No Brasil o PRECO_MEDIO_REVENDA dos produtos na data ({}) foram:\n".format(data_atual))
-    for produto in produtos_ordem:
-        preco_medio = precos_medios_revenda_brasil.loc[precos_medios_revenda_brasil['PRODUTO'] == produto, 'PRECO_MEDIO_REVENDA'].iloc[0]
-        print(f"{produto:<20} {preco_medio}")
+# Etapas executadas quando nenhuma é informada (particionamento, backfill e sincronização são pedidos explicitamente)
+ETAPAS_PADRAO = ['ingestao', 'carga', 'indicadores', 'comparacao', 'relatorio']
 
-except Exception as e:
-    # Caso ocorra um erro, execute a segunda versão
-    print(f"Erro encontrado na primeira versão: {e}")
-    print("Executando a segunda versão...")
+# Fontes de dados das comparações ('auto' usa o histórico local quando ele tem as semanas pedidas)
+FONTES = ['auto', 'local', 'bigquery']
 
-    # Carregar a aba 'BRASIL' como um DataFrame
-    df_brasil = pandas_gbq.read_gbq(query_sql, project_id=PROJECT_ID, credentials=credentials)
+# Arquivos gerados no diretório de saída
+NOME_PLANILHA_MODIFICADA = 'resumo_semanal_modificado.xlsx'
+NOME_COMPARACAO = 'comparacao_semanal.json'
+NOME_VARIACOES = 'variacoes_semanais.parquet'
+NOME_PRECOS_ATUAIS = 'precos_semana_atual.parquet'
 
-    # Converter a coluna 'DATA_INICIAL' para o tipo datetime
-    df_brasil['DATA_INICIAL'] = pd.to_datetime(df_brasil['DATA_INICIAL'])
+# ============================================================================
+# CONFIGURAÇÃO E CLIENTES (CRIADOS SOB DEMANDA E REAPROVEITADOS)
+# ============================================================================
 
-    # Filtrar os dados pela data atual
-    df_brasil_atual = df_brasil[df_brasil['DATA_INICIAL'] == data_atual]
+# Nome interno -> variável do arquivo .env
+VARIAVEIS_AMBIENTE = {
+    'PROJECT_ID': 'GCP_PROJECT_ID',
+    'CREDENTIALS_PATH': 'GCP_CREDENTIALS_PATH',
+    'DATASET_ID': 'BIGQUERY_DATASET_ID',
+}
 
-    # Selecionar apenas as colunas desejadas
-    produtos_combustiveis = ['OLEO DIESEL', 'OLEO DIESEL S10', 'GASOLINA COMUM', 'GASOLINA ADITIVADA', 'ETANOL HIDRATADO', 'GNV']
+def obter_configuracao(*chaves):
+    """Lê apenas as variáveis de ambiente necessárias para a etapa, validando-as"""
+    valores = {chave: os.getenv(VARIAVEIS_AMBIENTE[chave]) for chave in chaves}
+    faltando = [VARIAVEIS_AMBIENTE[chave] for chave, valor in valores.items() if not valor]
+    if faltando:
+        raise ValueError(f"Variáveis de ambiente não definidas no arquivo .env: {', '.join(faltando)}")
+    return valores
+
+def diretorio_entrada():
+    """Diretório de downloads/entrada (INPUT_DIR ou ~/Downloads)"""
+    return os.getenv("INPUT_DIR") or os.path.join(os.path.expanduser('~'), 'Downloads')
+
+def diretorio_saida():
+    """Diretório de documentos/saída (OUTPUT_DIR ou ~/Documents)"""
+    return os.getenv("OUTPUT_DIR") or os.path.join(os.path.expanduser('~'), 'Documents')
+
+def diretorio_historico():
+    """Diretório do histórico local em Parquet (HISTORICO_DIR ou <saída>/historico_combustiveis)"""
+    return os.getenv("HISTORICO_DIR") or os.path.join(diretorio_saida(), 'historico_combustiveis')
+
+@lru_cache(maxsize=None)
+def obter_credenciais():
+    """Credenciais da conta de serviço, carregadas uma única vez"""
+    from google.oauth2 import service_account
+    caminho = obter_configuracao('CREDENTIALS_PATH')['CREDENTIALS_PATH']
+    return service_account.Credentials.from_service_account_file(caminho)
+
+@lru_cache(maxsize=None)
+def obter_cliente_bigquery():
+    """Cliente BigQuery compartilhado por todas as etapas"""
+    from google.cloud import bigquery
+    return bigquery.Client(credentials=obter_credenciais(), project=obter_configuracao('PROJECT_ID')['PROJECT_ID'])
+
+def tabela_bigquery(nome):
+    """ID completo da tabela (formato: project.dataset.table)"""
+    config = obter_configuracao('PROJECT_ID', 'DATASET_ID')
+    return f"{config['PROJECT_ID']}.{config['DATASET_ID']}.{nome}"
+
+def parametro_bigquery(nome, valor):
+    """Converte um valor Python em parâmetro de consulta (listas viram ARRAY)"""
+    from google.cloud import bigquery
+    exemplo = valor[0] if isinstance(valor, (list, tuple)) and valor else valor
+    if isinstance(exemplo, datetime):
+        tipo, converter = 'DATE', lambda v: v.date()
+    elif hasattr(exemplo, 'isoformat'):
+        tipo, converter = 'DATE', lambda v: v
+    elif isinstance(exemplo, int):
+        tipo, converter = 'INT64', lambda v: v
+    else:
+        tipo, converter = 'STRING', lambda v: v
+    if isinstance(valor, (list, tuple)):
+        return bigquery.ArrayQueryParameter(nome, tipo, [converter(v) for v in valor])
+    return bigquery.ScalarQueryParameter(nome, tipo, converter(valor))
+
+def executar_consulta(query, parametros=None):
+    """Executa uma consulta/DML parametrizada e aguarda a conclusão do job"""
+    from google.cloud import bigquery
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[parametro_bigquery(nome, valor) for nome, valor in (parametros or {}).items()])
+    job = obter_cliente_bigquery().query(query, job_config=job_config)
+    job.result()
+    return job
+
+def ler_gbq(query, parametros=None):
+    """Executa uma consulta (opcionalmente parametrizada) e devolve um DataFrame"""
+    job = executar_consulta(query, parametros)
+    df = job.to_dataframe()
+    print(f"   🔎 {len(df)} linhas lidas ({(job.total_bytes_processed or 0) / 1024**2:.2f} MB processados)")
+    return df
 
-    # Ordenar os produtos na ordem desejada
-    produtos_ordem = ['OLEO DIESEL', 'OLEO DIESEL S10', 'GASOLINA COMUM', 'GASOLINA ADITIVADA', 'ETANOL HIDRATADO', 'GNV']
-    precos_medios_revenda_brasil = df_brasil_atual[df_brasil_atual['PRODUTO'].isin(produtos_ordem)]
+# ============================================================================
+# INGESTÃO - PLANILHA SEMANAL DA ANP
+# ============================================================================
 
-    # Formatar o print desejado
-    print("No Brasil o PRECO_MEDIO_REVENDA dos produtos na data ({}) foram:\n".format(data_atual))
-    for produto in produtos_ordem:
-        preco_medio = precos_medios_revenda_brasil.loc[precos_medios_revenda_brasil['PRODUTO'] == produto, 'PRECO_MEDIO_REVENDA'].iloc[0]
-        print(f"{produto:<20} {preco_medio}")
+def localizar_planilha_mais_recente(diretorio=None):
+    """Seleciona a planilha mais recente (data de modificação) do diretório de entrada"""
+    arquivos = glob.glob(os.path.join(diretorio or diretorio_entrada(), '*.xlsx'))
+    if not arquivos:
+        return None
+    return max(arquivos, key=os.path.getmtime)
+
+def motor_excel():
+    """Leitor mais rápido disponível: calamine (Rust) quando instalado, senão openpyxl"""
+    return 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
+
+def normalizar_aba(df_bruto):
+    """Usa a linha 'DATA INICIAL' como cabeçalho, formata as datas e adiciona 'TIPO PRODUTO'"""
+    cabecalho_index = df_bruto.index[df_bruto.iloc[:, 0] == 'DATA INICIAL'][0]
+    df_aba = df_bruto.iloc[cabecalho_index + 1:].reset_index(drop=True)  # Excluir linhas anteriores ao cabeçalho
+    df_aba.columns = df_bruto.iloc[cabecalho_index]  # Usar a linha correta como cabeçalho
+    df_aba.columns.name = None
+    df_aba = df_aba.infer_objects()
+
+    # Modificar as datas para o formato desejado '%d/%m/%Y'
+    df_aba['DATA INICIAL'] = pd.to_datetime(df_aba['DATA INICIAL']).dt.strftime('%d/%m/%Y')
+    df_aba['DATA FINAL'] = pd.to_datetime(df_aba['DATA FINAL']).dt.strftime('%d/%m/%Y')
+
+    # Adicionar a coluna 'TIPO PRODUTO' baseada no valor da coluna 'PRODUTO'
+    df_aba['TIPO PRODUTO'] = df_aba['PRODUTO'].map(mapa_tipo_produto)
+    return df_aba
+
+def salvar_planilha_modificada(abas_normalizadas, arquivo_saida=None):
+    """Grava as abas normalizadas em resumo_semanal_modificado.xlsx (opcional, apenas para conferência)"""
+    arquivo_saida = arquivo_saida or os.path.join(diretorio_saida(), NOME_PLANILHA_MODIFICADA)
+    with pd.ExcelWriter(arquivo_saida, engine='xlsxwriter') as writer:
+        for nome_aba, df_aba in abas_normalizadas.items():
+            df_aba.to_excel(writer, sheet_name=nome_aba, index=False, na_rep='')
+    print(f'Arquivo salvo com sucesso em {arquivo_saida}')
+    return arquivo_saida
 
-# ... RESTO DO SEU CÓDIGO CONTINUA IGUAL ...
+def ingerir_planilha(arquivo=None, salvar_modificada=False):
+    """
+    Lê a planilha da ANP uma única vez e normaliza as abas em memória
 
-# Query SQL para selecionar os dados da tabela específica
-query_sql = f"SELECT * FROM `{PROJECT_ID}.{DATASET_ID}.Capitais`"
+    Args:
+        arquivo: Planilha da ANP (padrão: a mais recente do diretório de entrada)
+        salvar_modificada: Também grava todas as abas em resumo_semanal_modificado.xlsx
 
-try:
-    # Primeira versão
-    print("Executando a primeira versão...")
-    
-    # Carregar a aba 'CAPITAIS' como um DataFrame
-    df_sp = pandas_gbq.read_gbq(query_sql, project_id=PROJECT_ID, credentials=credentials)
+    Returns:
+        Tupla (abas com os nomes de colunas do BigQuery, data atual, data anterior),
+        datas no formato '%d/%m/%Y'
+    """
+    arquivo = arquivo or localizar_planilha_mais_recente()
+    if not arquivo:
+        raise FileNotFoundError("Nenhum arquivo encontrado com o padrão de nome especificado.")
 
-    # Converter as colunas 'DATA_INICIAL' e 'DATA FINAL' para datetime e formatá-las de volta para %d/%m/%Y
-    df_sp['DATA_INICIAL'] = pd.to_datetime(df_sp['DATA_INICIAL'])
-    df_sp['DATA_FINAL'] = pd.to_datetime(df_sp['DATA_FINAL'])
+    # Sem a planilha modificada, apenas as cinco abas carregadas no BigQuery são lidas
+    abas_lidas = None if salvar_modificada else list(ABAS)
+    brutas = pd.read_excel(arquivo, sheet_name=abas_lidas, header=None, engine=motor_excel())
+    normalizadas = {nome_aba: normalizar_aba(df_bruto) for nome_aba, df_bruto in brutas.items()}
 
-    # Voltar a formatar para string no formato desejado
-    df_sp['DATA_INICIAL'] = df_sp['DATA_INICIAL'].dt.strftime('%d/%m/%Y')
-    df_sp['DATA_FINAL'] = df_sp['DATA_FINAL'].dt.strftime('%d/%m/%Y')
-    
-    # Filtrar os dados pelo estado SÃO PAULO
-    df_sp = df_sp[df_sp['ESTADO'].isin(['SAO PAULO'])]
+    data_atual = next(iter(normalizadas.values()))['DATA INICIAL'].iloc[0]
+    data_anterior = (pd.to_datetime(data_atual, format='%d/%m/%Y') - pd.DateOffset(days=7)).strftime('%d/%m/%Y')
 
-    # Filtrar os dados pela data atual
-    df_sp_atual = df_sp[df_sp['DATA_INICIAL'] == data_atual]
+    # Imprimir as datas
+    print(f'Data atual: {data_atual}')
+    print(f'Data anterior: {data_anterior}')
 
-    # Selecionar apenas as colunas desejadas
-    produtos_combustiveis = ['OLEO DIESEL', 'OLEO DIESEL S10', 'GASOLINA COMUM', 'GASOLINA ADITIVADA', 'ETANOL HIDRATADO', 'GNV']
+    if salvar_modificada:
+        salvar_planilha_modificada(normalizadas)
 
-    # Ordenar os produtos na ordem desejada
-    produtos_ordem = ['OLEO DIESEL', 'OLEO DIESEL S10', 'GASOLINA COMUM', 'GASOLINA ADITIVADA', 'ETANOL HIDRATADO', 'GNV']
-    precos_medios_revenda_sp = df_sp_atual[df_sp_atual['PRODUTO'].isin(produtos_ordem)]
+    abas = {}
+    for nome_aba, (_, colunas) in ABAS.items():
+        df_aba = normalizadas[nome_aba]
+        df_aba.columns = colunas
+        abas[nome_aba] = df_aba
+    return abas, data_atual, data_anterior
 
-    # Formatar o print desejado
-    print("Em SAO PAULO o PRECO_MEDIO_REVENDA dos produtos na data ({}) foram:\n".format(data_atual))
-    for produto in produtos_ordem:
-        preco_medio = precos_medios_revenda_sp.loc[precos_medios_revenda_sp['PRODUTO'] == produto, 'PRECO_MEDIO_REVENDA'].iloc[0]
-        print(f"{produto:<20} {preco_medio}")
+# ============================================================================
+# CARGA - BIGQUERY COM SUBSTITUIÇÃO DA SEMANA
+# ============================================================================
 
-except Exception as e:
-    # Caso ocorra um erro, execute a segunda versão
-    print(f"Erro encontrado na primeira versão: {e}")
-    print("Executando a segunda versão...")
+# Função auxiliar para converter datas para formato DATE do BigQuery
+def preparar_dataframe_para_bigquery(df):
+    """Prepara o DataFrame convertendo as colunas de data para o formato correto"""
+    df_copy = df.copy()
 
-    # Carregar a aba 'CAPITAIS' como um DataFrame
-    df_sp = pandas_gbq.read_gbq(query_sql, project_id=PROJECT_ID, credentials=credentials)
+    # Converter colunas de data do formato string para datetime
+    if 'DATA_INICIAL' in df_copy.columns:
+        df_copy['DATA_INICIAL'] = pd.to_datetime(df_copy['DATA_INICIAL'], format='%d/%m/%Y').dt.date
+    if 'DATA_FINAL' in df_copy.columns:
+        df_copy['DATA_FINAL'] = pd.to_datetime(df_copy['DATA_FINAL'], format='%d/%m/%Y').dt.date
 
-    # Converter a coluna 'DATA_INICIAL' para o tipo datetime
-    df_sp['DATA_INICIAL'] = pd.to_datetime(df_sp['DATA_INICIAL'])
-    
-    # Filtrar os dados pelo estado SÃO PAULO
-    df_sp = df_sp[df_sp['ESTADO'].isin(['SAO PAULO'])]
-    
-    # Filtrar os dados pela data atual
-    df_sp_atual = df_sp[df_sp['DATA_INICIAL'] == data_atual]
+    return df_copy
 
-    # Selecionar apenas as colunas desejadas
-    produtos_combustiveis = ['OLEO DIESEL', 'OLEO DIESEL S10', 'GASOLINA COMUM', 'GASOLINA ADITIVADA', 'ETANOL HIDRATADO', 'GNV']
+def extrair_data_final(df):
+    """
+    Extrai a data final dos dados preparados para BigQuery
+    """
+    if 'DATA_FINAL' in df.columns and len(df) > 0:
+        # Pega a primeira data final (assumindo que todas são iguais no lote)
+        data_final = df['DATA_FINAL'].iloc[0]
+        return data_final
+    else:
+        raise ValueError("Coluna DATA_FINAL não encontrada ou DataFrame vazio")
 
-    # Ordenar os produtos na ordem desejada
-    produtos_ordem = ['OLEO DIESEL', 'OLEO DIESEL S10', 'GASOLINA COMUM', 'GASOLINA ADITIVADA', 'ETANOL HIDRATADO', 'GNV']
-    precos_medios_revenda_sp = df_sp_atual[df_sp_atual['PRODUTO'].isin(produtos_ordem)]
+# Sufixo das tabelas de staging (uma por nível e semana) e validade caso a limpeza falhe
+SUFIXO_STAGING = '_staging'
+VALIDADE_STAGING = timedelta(days=1)
 
-    # Formatar o print desejado
-    print("Em SAO PAULO o PRECO_MEDIO_REVENDA dos produtos na data ({}) foram:\n".format(data_atual))
-    for produto in produtos_ordem:
-        preco_medio = precos_medios_revenda_sp.loc[precos_medios_revenda_sp['PRODUTO'] == produto, 'PRECO_MEDIO_REVENDA'].iloc[0]
-        print(f"{produto:<20} {preco_medio}")
+def carregar_staging(df, table_id, staging_id, anexar=False):
+    """
+    Carrega o DataFrame em uma tabela de staging com o schema da tabela de destino
 
-semana_atual = data_atual_base
-semana_anterior = data_anterior_base
-print(semana_atual)
-print(semana_anterior)
-print(type(semana_atual))
-print(type(semana_anterior))
+    Args:
+        anexar: Acrescenta à staging existente (lotes do backfill) em vez de sobrescrevê-la
 
-# Convertendo as strings para objetos de data
-semana_atual_data = datetime.strptime(semana_atual, '%d/%m/%Y')
-semana_anterior_data = datetime.strptime(semana_anterior, '%d/%m/%Y')
+    Returns:
+        True se a tabela de destino já existe
+    """
+    from google.cloud import bigquery
+    from google.api_core.exceptions import NotFound
 
-# Agora, você pode comparar as datas
-print(semana_atual)
-print(semana_anterior)
-print(type(semana_atual))
-print(type(semana_anterior))
+    cliente = obter_cliente_bigquery()
+    try:
+        schema = cliente.get_table(table_id).schema
+        destino_existe = True
+    except NotFound:
+        schema, destino_existe = None, False
+
+    job_config = bigquery.LoadJobConfig(schema=schema,
+                                        write_disposition='WRITE_APPEND' if anexar else 'WRITE_TRUNCATE')
+    cliente.load_table_from_dataframe(df, staging_id, job_config=job_config).result()
+
+    # Expiração como garantia: a staging é apagada logo após o MERGE
+    if not anexar:
+        staging = cliente.get_table(staging_id)
+        staging.expires = datetime.now().astimezone() + VALIDADE_STAGING
+        cliente.update_table(staging, ['expires'])
+    return destino_existe
+
+def aplicar_staging(table_id, staging_id, datas_finais, total_linhas, destino_existe=True):
+    """
+    Substitui atomicamente as semanas (DATA_FINAL) da tabela pelas linhas da staging
 
-# Query SQL para selecionar os dados da tabela específica
-query_sql = f"SELECT * FROM `{PROJECT_ID}.{DATASET_ID}.Capitais`"
+    Um único MERGE insere as linhas da staging e remove as linhas antigas das mesmas
+    DATA_FINAL. Se a tabela ainda não existir, ela é criada particionada por DATA_FINAL.
+    A staging é apagada ao final.
+    """
+    nome_tabela = table_id.split('.')[-1]
+    try:
+        if destino_existe:
+            job = executar_consulta(f"""
+            MERGE `{table_id}` T
+            USING `{staging_id}` S
+            ON FALSE
+            WHEN NOT MATCHED BY TARGET THEN INSERT ROW
+            WHEN NOT MATCHED BY SOURCE AND T.DATA_FINAL IN UNNEST(@datas_finais) THEN DELETE
+            """, {'datas_finais': sorted(datas_finais)})
+            removidos = (job.num_dml_affected_rows or 0) - total_linhas
+            print(f"   ✅ {nome_tabela}: {total_linhas} inseridos, {max(removidos, 0)} substituídos "
+                  f"({(job.total_bytes_processed or 0) / 1024**2:.2f} MB processados)")
+        else:
+            executar_consulta(f"""
+            CREATE TABLE `{table_id}`
+            PARTITION BY DATA_FINAL
+            AS SELECT * FROM `{staging_id}`
+            """)
+            print(f"   ✅ {nome_tabela}: tabela criada (particionada por DATA_FINAL) com {total_linhas} registros")
+    finally:
+        obter_cliente_bigquery().delete_table(staging_id, not_found_ok=True)
+
+def substituir_semana_bigquery(df, table_id, data_final):
+    """
+    Substitui a semana (DATA_FINAL) da tabela pelos dados do DataFrame, via staging + MERGE
 
-# Selecionar a aba "CAPITAIS" no arquivo base
-df_capitais_base_comparativo = pandas_gbq.read_gbq(query_sql, project_id=PROJECT_ID, credentials=credentials)
+    Args:
+        df: DataFrame com os novos dados
+        table_id: ID da tabela no BigQuery (formato: project.dataset.table)
+        data_final: Data final da semana (formato: date object)
+    """
+    print(f"   📤 {table_id.split('.')[-1]}: carregando {len(df)} registros de {data_final} na staging...")
+    staging_id = f"{table_id}{SUFIXO_STAGING}_{data_final.strftime('%Y%m%d')}"
+    destino_existe = carregar_staging(df, table_id, staging_id)
+    aplicar_staging(table_id, staging_id, [data_final], len(df), destino_existe)
+
+def carregar_bigquery(abas):
+    """Substitui a semana das cinco tabelas no BigQuery, em paralelo"""
+    print("\n" + "="*80)
+    print("INSERINDO DADOS NO BIGQUERY (STAGING + MERGE POR DATA_FINAL)")
+    print("="*80)
+
+    def carregar_nivel(nome_aba, nome_tabela):
+        # Preparar DataFrame para BigQuery
+        df_preparado = preparar_dataframe_para_bigquery(abas[nome_aba])
+        data_final = extrair_data_final(df_preparado)
+        substituir_semana_bigquery(df_preparado, tabela_bigquery(nome_tabela), data_final)
+
+    # Credenciais e cliente são criados antes das threads para não serem instanciados em paralelo
+    obter_cliente_bigquery()
+    with ThreadPoolExecutor(max_workers=len(ABAS)) as executor:
+        futuros = {executor.submit(carregar_nivel, nome_aba, nome_tabela): nome_aba
+                   for nome_aba, (nome_tabela, _) in ABAS.items()}
+        for futuro in as_completed(futuros):
+            try:
+                futuro.result()
+            except Exception as e:
+                print(f"Erro ao processar {futuros[futuro]}: {e}")
+
+    print("\n" + "="*80)
+    print("PROCESSO DE INSERÇÃO CONCLUÍDO")
+    print("="*80)
+
+# Migração única das tabelas criadas antes do particionamento: cópia particionada e
+# tabela original mantida como cópia de segurança por VALIDADE_SEM_PARTICAO
+SUFIXO_PARTICIONADA = '_particionada'
+SUFIXO_SEM_PARTICAO = '_sem_particao'
+VALIDADE_SEM_PARTICAO = timedelta(days=7)
+
+def particionar_tabela(table_id):
+    """
+    Recria uma tabela existente sem partição como particionada por DATA_FINAL
 
-# Converter a coluna 'DATA INICIAL' para o tipo datetime
-df_capitais_base_comparativo['DATA_INICIAL'] = pd.to_datetime(df_capitais_base_comparativo['DATA_INICIAL'])
+    A cópia particionada (CREATE TABLE ... AS SELECT) é conferida pela contagem de
+    linhas antes da troca de nomes; a original passa a <tabela>_sem_particao. Uma
+    migração interrompida entre as duas renomeações é concluída na execução seguinte.
+    """
+    from google.api_core.exceptions import NotFound
 
-# Lista de capitais
-capitais = [
-    'ARACAJU', 'BELEM', 'BELO HORIZONTE', 'BOA VISTA', 'BRASILIA', 'CAMPO GRANDE',
-    'CUIABA', 'CURITIBA', 'FLORIANOPOLIS', 'FORTALEZA', 'GOIANIA', 'JOAO PESSOA',
-    'MACAPA', 'MACEIO', 'MANAUS', 'NATAL', 'PALMAS', 'PORTO ALEGRE', 'PORTO VELHO',
-    'RECIFE', 'RIO BRANCO', 'RIO DE JANEIRO', 'SALVADOR', 'SAO LUIS', 'SAO PAULO', 'TERESINA', 'VITORIA'
-]
+    cliente = obter_cliente_bigquery()
+    nome_tabela = table_id.split('.')[-1]
+    particionada_id = f"{table_id}{SUFIXO_PARTICIONADA}"
+    try:
+        tabela = cliente.get_table(table_id)
+    except NotFound:
+        try:
+            cliente.get_table(particionada_id)
+        except NotFound:
+            print(f"   ⏭️ {nome_tabela}: inexistente (será criada particionada na primeira carga)")
+            return
+        executar_consulta(f"ALTER TABLE `{particionada_id}` RENAME TO `{nome_tabela}`")
+        print(f"   ✅ {nome_tabela}: migração interrompida concluída")
+        return
+
+    if tabela.time_partitioning and tabela.time_partitioning.field == 'DATA_FINAL':
+        print(f"   ⏭️ {nome_tabela}: já particionada por DATA_FINAL")
+        return
+
+    job = executar_consulta(f"""
+    CREATE OR REPLACE TABLE `{particionada_id}`
+    PARTITION BY DATA_FINAL
+    AS SELECT * FROM `{table_id}`
+    """)
+    linhas = cliente.get_table(particionada_id).num_rows
+    if linhas != tabela.num_rows:
+        cliente.delete_table(particionada_id, not_found_ok=True)
+        raise RuntimeError(f"{nome_tabela}: cópia particionada com {linhas} linhas, original com {tabela.num_rows}")
+
+    # Troca de nomes: a original fica como cópia de segurança com expiração
+    executar_consulta(f"ALTER TABLE `{table_id}` RENAME TO `{nome_tabela}{SUFIXO_SEM_PARTICAO}`")
+    executar_consulta(f"ALTER TABLE `{particionada_id}` RENAME TO `{nome_tabela}`")
+    copia = cliente.get_table(f"{table_id}{SUFIXO_SEM_PARTICAO}")
+    copia.expires = datetime.now().astimezone() + VALIDADE_SEM_PARTICAO
+    cliente.update_table(copia, ['expires'])
+    print(f"   ✅ {nome_tabela}: {linhas} linhas particionadas por DATA_FINAL "
+          f"({(job.total_bytes_processed or 0) / 1024**2:.2f} MB processados); "
+          f"original em {nome_tabela}{SUFIXO_SEM_PARTICAO} por {VALIDADE_SEM_PARTICAO.days} dias")
+
+def particionar_tabelas():
+    """Migra as cinco tabelas para particionamento por DATA_FINAL (as já particionadas são ignoradas)"""
+    print("\n" + "="*80)
+    print("PARTICIONANDO TABELAS DO BIGQUERY POR DATA_FINAL")
+    print("="*80)
+
+    for nome_tabela, _ in ABAS.values():
+        particionar_tabela(tabela_bigquery(nome_tabela))
 
-# Filtrar os dados da aba 'CAPITAIS' para incluir apenas as capitais da lista e a data atual
-df_capitais_filtrado_base = df_capitais_base_comparativo[df_capitais_base_comparativo['DATA_INICIAL'] == semana_atual_data].copy()
-df_capitais_filtrado_base = df_capitais_filtrado_base[df_capitais_filtrado_base['MUNICIPIO'].isin(capitais)].copy()
-# Pivotar a tabela para ter os produtos como colunas
-df_pivot_base_atual = df_capitais_filtrado_base.pivot(index='MUNICIPIO', columns='PRODUTO', values='PRECO_MEDIO_REVENDA')
+# ============================================================================
+# HISTÓRICO LOCAL - PARQUET (UMA PASTA POR NÍVEL, UM ARQUIVO POR SEMANA)
+# ============================================================================
 
-# Selecionar apenas as linhas de interesse (óleo diesel comum e óleo diesel S10)
-df_resultado_base_atual = df_pivot_base_atual[['OLEO DIESEL', 'OLEO DIESEL S10']]
-    
-# Remover as linhas com valores NaN
-df_resultado_limpo_atual = df_resultado_base_atual.dropna()
+# Colunas numéricas gravadas sempre como float64, para que todas as semanas tenham o mesmo schema
+COLUNAS_NUMERICAS_HISTORICO = ['NUMERO_DE_POSTOS_PESQUISADOS', 'PRECO_MEDIO_REVENDA', 'DESVIO_PADRAO_REVENDA',
+                               'PRECO_MINIMO_REVENDA', 'PRECO_MAXIMO_REVENDA', 'COEF_DE_VARIACAO_REVENDA']
+
+def caminho_historico(nome_tabela, data_final=None):
+    """Pasta do nível ou arquivo da semana (nomeado pela DATA_FINAL, chave de substituição no BigQuery)"""
+    pasta = os.path.join(diretorio_historico(), nome_tabela)
+    if data_final is None:
+        return pasta
+    return os.path.join(pasta, f"{pd.Timestamp(data_final).strftime('%Y-%m-%d')}.parquet")
+
+def normalizar_para_historico(df):
+    """Datas como DATE, numéricos como float64 e textos como string"""
+    df = df.copy()
+    for coluna in df.columns:
+        if coluna in ('DATA_INICIAL', 'DATA_FINAL'):
+            df[coluna] = pd.to_datetime(df[coluna]).dt.date
+        elif coluna in COLUNAS_NUMERICAS_HISTORICO:
+            df[coluna] = pd.to_numeric(df[coluna], errors='coerce').astype('float64')
+        else:
+            df[coluna] = df[coluna].astype('string')
+    return df
 
-# Resetar o índice para transformar "MUNICÍPIO" em uma coluna
-df_resultado_limpo_atual.reset_index(inplace=True)
+def gravar_semana_historico(nome_tabela, df, acrescentar=()):
+    """
+    Grava (ou substitui) as semanas do DataFrame no histórico local
 
-# Renomear a coluna "MUNICÍPIO" para "CAPITAIS"
-df_resultado_limpo_atual.rename(columns={'MUNICIPIO': 'CAPITAIS'}, inplace=True)
+    Args:
+        acrescentar: DATA_FINAL cujas linhas são somadas ao arquivo existente em vez de substituí-lo
+                     (semanas divididas entre lotes do backfill)
 
-# Selecionar apenas as colunas desejadas
-df_resultado_limpo_atual = df_resultado_limpo_atual[['CAPITAIS', 'OLEO DIESEL S10', 'OLEO DIESEL']]
+    Returns:
+        DATA_FINAL das semanas gravadas
+    """
+    df = normalizar_para_historico(df)
+    gravadas = set()
+    for data_final, df_semana in df.groupby('DATA_FINAL'):
+        caminho = caminho_historico(nome_tabela, data_final)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        if data_final in acrescentar and os.path.exists(caminho):
+            df_semana = pd.concat([pd.read_parquet(caminho), df_semana], ignore_index=True)
+        gravadas.add(data_final)
+        temporario = caminho + '.tmp'
+        df_semana.to_parquet(temporario, index=False)
+        os.replace(temporario, caminho)
+    return gravadas
+
+def atualizar_historico_local(abas):
+    """Acrescenta a semana ingerida ao histórico local dos cinco níveis"""
+    for nome_aba, (nome_tabela, _) in ABAS.items():
+        gravar_semana_historico(nome_tabela, preparar_dataframe_para_bigquery(abas[nome_aba]))
+    print(f"✅ Histórico local atualizado em {diretorio_historico()}")
+
+def semanas_historico(nome_tabela):
+    """DATA_FINAL das semanas presentes no histórico local"""
+    pasta = caminho_historico(nome_tabela)
+    if not os.path.isdir(pasta):
+        return set()
+    return {pd.Timestamp(arquivo[:-len('.parquet')]).date()
+            for arquivo in os.listdir(pasta) if arquivo.endswith('.parquet')}
+
+def ler_semanas_local(nome_tabela, datas, produtos=None, colunas_local=()):
+    """Mesma leitura de ler_semanas_bigquery, feita sobre o histórico local"""
+    colunas = COLUNAS_COMPARACAO[:2] + list(colunas_local) + COLUNAS_COMPARACAO[2:]
+    filtros = [('DATA_INICIAL', 'in', [pd.Timestamp(data).date() for data in datas])]
+    if produtos:
+        filtros.append(('PRODUTO', 'in', list(produtos)))
+
+    df = pd.read_parquet(caminho_historico(nome_tabela), columns=colunas, filters=filtros)
+    df['DATA_INICIAL'] = pd.to_datetime(df['DATA_INICIAL'])
+    df['DATA_FINAL'] = pd.to_datetime(df['DATA_FINAL'])
+    return df
+
+def historico_tem_semanas(nome_tabela, datas):
+    """Verifica se todas as semanas (datas iniciais) estão no histórico local"""
+    semanas = semanas_historico(nome_tabela)
+    return all((pd.Timestamp(data) + timedelta(days=6)).date() in semanas for data in datas)
+
+def sincronizar_historico():
+    """Baixa do BigQuery (sistema de registro) as semanas que faltam no histórico local"""
+    print("\n" + "="*80)
+    print("SINCRONIZANDO HISTÓRICO LOCAL COM O BIGQUERY")
+    print("="*80)
+
+    for nome_tabela, _ in ABAS.values():
+        table_id = tabela_bigquery(nome_tabela)
+        remotas = ler_gbq(f"SELECT DISTINCT DATA_FINAL FROM `{table_id}`")
+        remotas = set(pd.to_datetime(remotas['DATA_FINAL']).dt.date)
+        locais = semanas_historico(nome_tabela)
+        faltando = sorted(remotas - locais)
+
+        print(f"   {nome_tabela}: {len(remotas)} semanas no BigQuery, {len(locais)} locais, {len(faltando)} a baixar")
+        if faltando:
+            df = ler_gbq(f"SELECT * FROM `{table_id}` WHERE DATA_FINAL IN UNNEST(@datas)", {'datas': faltando})
+            gravar_semana_historico(nome_tabela, df)
+
+        apenas_locais = sorted(locais - remotas)
+        if apenas_locais:
+            print(f"   ⚠️  {len(apenas_locais)} semana(s) de {nome_tabela} existem só localmente; execute a etapa 'carga'")
 
-# Exibir o resultado
-print(f"Resultado da semana atual da data: {semana_atual}")
-print(df_resultado_limpo_atual)
+# ============================================================================
+# BACKFILL - SÉRIES HISTÓRICAS CONSOLIDADAS DA ANP (XLSX/CSV EM STREAMING)
+# ============================================================================
 
-# Filtrar os dados da aba 'CAPITAIS' para incluir apenas as capitais da lista e a data atual
-df_capitais_filtrado_base_anterior = df_capitais_base_comparativo[
-    (df_capitais_base_comparativo['DATA_INICIAL'] == semana_anterior_data) &
-    (df_capitais_base_comparativo['MUNICIPIO'].isin(capitais))
-].copy()
+# Linhas acumuladas antes de cada gravação (limita a memória independentemente do tamanho do arquivo)
+TAMANHO_LOTE_BACKFILL = 200_000
+
+def nome_coluna_bigquery(cabecalho):
+    """'PREÇO MÉDIO REVENDA' -> 'PRECO_MEDIO_REVENDA'"""
+    sem_acentos = unicodedata.normalize('NFKD', str(cabecalho)).encode('ascii', 'ignore').decode('ascii')
+    return '_'.join(sem_acentos.upper().split())
+
+# Trechos de nomes de aba/arquivo que identificam o nível (CAPITAIS antes de MUNICIPIOS:
+# a série das capitais também tem a coluna MUNICÍPIO)
+NIVEIS_POR_NOME = [('CAPITA', 'CAPITAIS'), ('MUNICIP', 'MUNICIPIOS'), ('ESTAD', 'ESTADOS'),
+                   ('REGI', 'REGIOES'), ('BRASIL', 'BRASIL'), ('PAIS', 'BRASIL')]
+
+def nivel_pelo_nome(nome):
+    """Nível indicado pelo nome de uma aba ou arquivo (None se o nome não indicar nenhum)"""
+    nome = nome_coluna_bigquery(nome)
+    for trecho, nivel in NIVEIS_POR_NOME:
+        if trecho in nome:
+            return nivel
+    return None
+
+def inferir_nivel(colunas):
+    """Nível correspondente às colunas de localização (último recurso: não distingue capitais de municípios)"""
+    if 'MUNICIPIO' in colunas:
+        return 'MUNICIPIOS'
+    if 'ESTADO' in colunas:
+        return 'ESTADOS'
+    if 'REGIAO' in colunas:
+        return 'REGIOES'
+    return 'BRASIL'
+
+def linhas_xlsx(arquivo):
+    """Linhas (aba, valores) de todas as abas, lidas em streaming (openpyxl somente leitura)"""
+    from openpyxl import load_workbook
+    workbook = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        for planilha in workbook.worksheets:
+            for linha in planilha.iter_rows(values_only=True):
+                yield planilha.title, linha
+    finally:
+        workbook.close()
+
+def codificacao_csv(arquivo, tamanho_bloco=1024 * 1024):
+    """UTF-8 se o arquivo inteiro decodificar sem erros; senão cp1252 (padrão das séries da ANP)"""
+    decodificador = codecs.getincrementaldecoder('utf-8')()
+    try:
+        with open(arquivo, 'rb') as f:
+            for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+                decodificador.decode(bloco)
+            decodificador.decode(b'', final=True)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+def linhas_csv(arquivo):
+    """Linhas (arquivo, valores) do CSV, com o separador (';' ou ',') detectado na linha de cabeçalho"""
+    nome = os.path.splitext(os.path.basename(arquivo))[0]
+    with open(arquivo, 'r', encoding=codificacao_csv(arquivo), newline='') as f:
+        separador = ';'
+        for linha in f:
+            if linha.startswith('DATA INICIAL'):
+                separador = ';' if linha.count(';') >= linha.count(',') else ','
+                break
+        f.seek(0)
+        for linha in csv.reader(f, delimiter=separador):
+            yield nome, linha
+
+def lotes_serie_historica(arquivo, tamanho_lote=TAMANHO_LOTE_BACKFILL):
+    """
+    Lê a série histórica linha a linha e devolve lotes de até tamanho_lote linhas
 
-# Pivotar a tabela para ter os produtos como colunas
-df_pivot_base_anterior = df_capitais_filtrado_base_anterior.pivot(index='MUNICIPIO', columns='PRODUTO', values='PRECO_MEDIO_REVENDA')
+    Cada aba (ou o CSV) pode ter linhas de título antes do cabeçalho 'DATA INICIAL';
+    um novo cabeçalho inicia um novo bloco. Lotes são DataFrames com os nomes de colunas do BigQuery.
 
-# Selecionar apenas as linhas de interesse (óleo diesel comum e óleo diesel S10)
-df_resultado_base_anterior = df_pivot_base_anterior[['OLEO DIESEL', 'OLEO DIESEL S10']]
+    Yields:
+        Tupla (nível indicado pelo nome da aba ou do arquivo, ou None; lote)
+    """
+    linhas = linhas_csv(arquivo) if arquivo.lower().endswith('.csv') else linhas_xlsx(arquivo)
+    nivel_arquivo = nivel_pelo_nome(os.path.basename(arquivo))
+    cabecalho, nivel, lote = None, None, []
+    for origem, linha in linhas:
+        primeira = str(linha[0]).strip() if linha and linha[0] is not None else ''
+        if primeira == 'DATA INICIAL':
+            if lote:
+                yield nivel, pd.DataFrame(lote, columns=cabecalho)
+                lote = []
+            cabecalho = [nome_coluna_bigquery(coluna) for coluna in linha]
+            nivel = nivel_pelo_nome(origem) or nivel_arquivo
+        elif cabecalho and primeira:
+            lote.append(linha[:len(cabecalho)])
+            if len(lote) >= tamanho_lote:
+                yield nivel, pd.DataFrame(lote, columns=cabecalho)
+                lote = []
+    if lote:
+        yield nivel, pd.DataFrame(lote, columns=cabecalho)
+
+def normalizar_lote_historico(df, nivel=None):
+    """
+    Converte um lote da série histórica para o schema do nível (mesmas colunas da carga semanal)
 
-# Remover as linhas com valores NaN
-df_resultado_limpo_anterior = df_resultado_base_anterior.dropna()
+    Args:
+        nivel: Nível do lote (padrão: inferido das colunas de localização)
 
-# Resetar o índice para transformar "MUNICÍPIO" em uma coluna
-df_resultado_limpo_anterior.reset_index(inplace=True)
+    Returns:
+        Tupla (nível, DataFrame com DATA_INICIAL/DATA_FINAL como date)
+    """
+    nivel = nivel or inferir_nivel(df.columns)
+    colunas = ABAS[nivel][1]
+
+    df = df.rename(columns={'PAIS': 'BRASIL'})
+    faltando = [coluna for coluna in colunas if coluna != 'TIPO_PRODUTO' and coluna not in df.columns]
+    if faltando:
+        raise ValueError(f"Série histórica de {nivel} sem as colunas {', '.join(faltando)} "
+                         f"(cabeçalho lido: {', '.join(map(str, df.columns))})")
+
+    df = df.reindex(columns=colunas)
+    for coluna in ('DATA_INICIAL', 'DATA_FINAL'):
+        # Datas do xlsx chegam como datetime; no CSV, como texto dd/mm/aaaa
+        df[coluna] = pd.to_datetime(df[coluna], dayfirst=True, format='mixed', errors='coerce').dt.date
+    for coluna in COLUNAS_NUMERICAS_HISTORICO:
+        valores = df[coluna]
+        if not pd.api.types.is_numeric_dtype(valores):
+            valores = valores.astype('string').str.replace(',', '.', regex=False)
+        df[coluna] = pd.to_numeric(valores, errors='coerce')
+    df['TIPO_PRODUTO'] = df['PRODUTO'].map(mapa_tipo_produto)
+    return nivel, df.dropna(subset=['DATA_INICIAL', 'DATA_FINAL', 'PRODUTO'])
+
+def executar_backfill(arquivos, nivel=None, carregar_no_bigquery=True, tamanho_lote=TAMANHO_LOTE_BACKFILL):
+    """
+    Carrega séries históricas no histórico local e, opcionalmente, no BigQuery
 
-# Renomear a coluna "MUNICÍPIO" para "CAPITAIS"
-df_resultado_limpo_anterior.rename(columns={'MUNICIPIO': 'CAPITAIS'}, inplace=True)
+    Cada lote é gravado no histórico local (semana a semana) e anexado a uma staging por nível;
+    ao final, um MERGE por nível substitui no BigQuery todas as semanas recebidas.
+    """
+    print("\n" + "="*80)
+    print("BACKFILL DE SÉRIES HISTÓRICAS")
+    print("="*80)
+
+    semanas_por_nivel = {}   # nível -> DATA_FINAL já gravadas neste backfill
+    linhas_por_nivel = {}
+    destino_existe = {}
+
+    for arquivo in arquivos:
+        print(f"\n📂 {os.path.basename(arquivo)}")
+        for numero, (nivel_nome, lote) in enumerate(lotes_serie_historica(arquivo, tamanho_lote), 1):
+            nivel_lote, df = normalizar_lote_historico(lote, nivel or nivel_nome)
+            if df.empty:
+                continue
+            nome_tabela = ABAS[nivel_lote][0]
+            semanas = semanas_por_nivel.setdefault(nivel_lote, set())
+            primeira_carga = nivel_lote not in linhas_por_nivel
+
+            semanas |= gravar_semana_historico(nome_tabela, df, acrescentar=semanas)
+            linhas_por_nivel[nivel_lote] = linhas_por_nivel.get(nivel_lote, 0) + len(df)
+
+            if carregar_no_bigquery:
+                table_id = tabela_bigquery(nome_tabela)
+                destino = carregar_staging(df, table_id, f"{table_id}{SUFIXO_STAGING}_backfill",
+                                           anexar=not primeira_carga)
+                destino_existe.setdefault(nivel_lote, destino)
+
+            print(f"   lote {numero}: {len(df)} linhas de {nivel_lote} "
+                  f"({df['DATA_FINAL'].min()} a {df['DATA_FINAL'].max()})")
+            del lote, df
+            gc.collect()
+
+    for nivel_lote, semanas in semanas_por_nivel.items():
+        print(f"\n   {nivel_lote}: {linhas_por_nivel[nivel_lote]} linhas em {len(semanas)} semanas")
+        if carregar_no_bigquery:
+            table_id = tabela_bigquery(ABAS[nivel_lote][0])
+            aplicar_staging(table_id, f"{table_id}{SUFIXO_STAGING}_backfill", semanas,
+                            linhas_por_nivel[nivel_lote], destino_existe[nivel_lote])
+
+    print(f"\n✅ Backfill concluído; histórico local em {diretorio_historico()}")
 
-# Selecionar apenas as colunas desejadas
-df_resultado_limpo_anterior = df_resultado_limpo_anterior[['CAPITAIS', 'OLEO DIESEL S10', 'OLEO DIESEL']]
+# ============================================================================
+# INDICADORES MÓVEIS - ESTADO INCREMENTAL POR SÉRIE (NÍVEL × LOCAL × PRODUTO)
+# ============================================================================
 
-# Exibir o resultado
-print(f"Resultado da semana anterior da data: {semana_anterior}")
-print(df_resultado_limpo_anterior)
+# Semanas guardadas por série: a semana atual + 52 anteriores (variação anual)
+SEMANAS_BUFFER = 53
 
-# Converter as colunas de preços para numérico
-df_resultado_limpo_atual['OLEO DIESEL S10'] = pd.to_numeric(df_resultado_limpo_atual['OLEO DIESEL S10'], errors='coerce')
-df_resultado_limpo_atual['OLEO DIESEL'] = pd.to_numeric(df_resultado_limpo_atual['OLEO DIESEL'], errors='coerce')
+# Identificação de uma série de preços
+CHAVES_SERIE = ['NIVEL', 'ESTADO', 'LOCAL', 'PRODUTO']
 
-df_resultado_limpo_anterior['OLEO DIESEL S10'] = pd.to_numeric(df_resultado_limpo_anterior['OLEO DIESEL S10'], errors='coerce')
-df_resultado_limpo_anterior['OLEO DIESEL'] = pd.to_numeric(df_resultado_limpo_anterior['OLEO DIESEL'], errors='coerce')
+NOME_INDICADORES = 'indicadores_combustiveis.parquet'
 
-# Calcular a diferença entre os DataFrames
-df_diferenca = df_resultado_limpo_atual.set_index('CAPITAIS') - df_resultado_limpo_anterior.set_index('CAPITAIS')
+def precos_por_serie(df, nivel):
+    """Preço médio de revenda de uma semana por série (NIVEL, ESTADO, LOCAL, PRODUTO)"""
+    local = colunas_local(nivel)
+    precos = pd.DataFrame({
+        'NIVEL': nivel,
+        'ESTADO': df['ESTADO'].astype('string') if 'ESTADO' in df.columns else '',
+        'LOCAL': df[local[-1]].astype('string'),
+        'PRODUTO': df['PRODUTO'].astype('string'),
+        'PRECO': pd.to_numeric(df['PRECO_MEDIO_REVENDA'], errors='coerce'),
+    })
+    return precos.fillna({'ESTADO': ''}).groupby(CHAVES_SERIE, as_index=False)['PRECO'].mean()
 
-# Calcular a variação percentual
-df_variacao_percentual = ((df_diferenca) / df_resultado_limpo_anterior.set_index('CAPITAIS')) * 100
+class EstadoIndicadores:
+    """
+    Janelas móveis de um nível: ring buffer de preços semanais e somas acumuladas por série
 
-# Exibir os resultados
-print("diferença:\n \n",df_diferenca)
-print("\n")
-print("variação percentual:\n \n",df_variacao_percentual)
+    A cada semana só a coluna nova do buffer é escrita e as somas de 4 e 12 semanas são
+    ajustadas pelo valor que entra e pelo que sai da janela, de modo que o custo semanal não
+    depende do tamanho do histórico. Semanas sem preço entram como NaN e não contam nas médias.
+    As somas são dos desvios em relação ao primeiro preço da série (REFERENCIA), o que evita o
+    cancelamento numérico da soma de quadrados em séries quase constantes.
+    """
 
-# Supondo que df_resultado_limpo_atual e df_resultado_limpo_anterior já estejam definidos
+    COLUNAS_SOMAS = ['REFERENCIA', 'SOMA_4', 'N_4', 'SOMA_12', 'SOMA_QUADRADOS_12', 'N_12']
+
+    def __init__(self, nivel):
+        self.nivel = nivel
+        self.series = pd.DataFrame(columns=CHAVES_SERIE, dtype='string')
+        self.buffer = np.empty((0, SEMANAS_BUFFER))
+        self.somas = {coluna: np.empty(0) for coluna in self.COLUNAS_SOMAS}
+        self.ponteiro = 0   # próxima posição do buffer a ser escrita
+        self.ultima_data_final = None
+
+    def __len__(self):
+        return len(self.series)
+
+    @staticmethod
+    def caminho(nivel):
+        return os.path.join(diretorio_historico(), 'indicadores', f"estado_{ABAS[nivel][0]}.parquet")
+
+    @classmethod
+    def carregar(cls, nivel):
+        """Estado salvo do nível (None se ainda não existir)"""
+        caminho = cls.caminho(nivel)
+        if not os.path.exists(caminho):
+            return None
+        df = pd.read_parquet(caminho)
+        if df.empty:
+            return None
+
+        estado = cls(nivel)
+        estado.series = df[CHAVES_SERIE].astype('string').reset_index(drop=True)
+        estado.buffer = df[[f'B{i:02d}' for i in range(SEMANAS_BUFFER)]].to_numpy(dtype='float64', copy=True)
+        estado.somas = {coluna: df[coluna].to_numpy(dtype='float64', copy=True) for coluna in cls.COLUNAS_SOMAS}
+        estado.ponteiro = int(df['PONTEIRO'].iloc[0])
+        estado.ultima_data_final = pd.Timestamp(df['ULTIMA_DATA_FINAL'].iloc[0])
+        return estado
+
+    def salvar(self):
+        """Grava séries, somas e buffer em um único Parquet (ponteiro e última semana como colunas)"""
+        caminho = self.caminho(self.nivel)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        df = pd.concat([
+            self.series,
+            pd.DataFrame(self.somas),
+            pd.DataFrame(self.buffer, columns=[f'B{i:02d}' for i in range(SEMANAS_BUFFER)]),
+        ], axis=1)
+        df['PONTEIRO'] = self.ponteiro
+        df['ULTIMA_DATA_FINAL'] = self.ultima_data_final
+        df.to_parquet(caminho + '.tmp', index=False)
+        os.replace(caminho + '.tmp', caminho)
+
+    def _posicoes(self, chaves, precos):
+        """Linha de cada série no estado, criando as séries novas (com o preço atual como referência)"""
+        indice = pd.MultiIndex.from_frame(self.series)
+        posicoes = indice.get_indexer(pd.MultiIndex.from_frame(chaves))
+        novas = posicoes == -1
+        if novas.any():
+            self.series = pd.concat([self.series, chaves[novas]], ignore_index=True)
+            self.buffer = np.vstack([self.buffer, np.full((novas.sum(), SEMANAS_BUFFER), np.nan)])
+            self.somas = {coluna: np.concatenate([valores, np.zeros(novas.sum())])
+                          for coluna, valores in self.somas.items()}
+            posicoes[novas] = np.arange(len(self.series) - novas.sum(), len(self.series))
+            self.somas['REFERENCIA'][posicoes[novas]] = np.nan_to_num(precos[novas])
+        return posicoes
+
+    def _empurrar(self, precos):
+        """Escreve uma semana no ring buffer e ajusta as somas das janelas"""
+        referencia = self.somas['REFERENCIA']
+        entra = np.nan_to_num(precos - referencia)
+        presente = ~np.isnan(precos)
+        for janela in (4, 12):
+            sai = self.buffer[:, (self.ponteiro - janela) % SEMANAS_BUFFER]
+            sai_valor = np.nan_to_num(sai - referencia)
+            self.somas[f'SOMA_{janela}'] += entra - sai_valor
+            self.somas[f'N_{janela}'] += presente.astype('float64') - (~np.isnan(sai)).astype('float64')
+            if janela == 12:
+                self.somas['SOMA_QUADRADOS_12'] += entra ** 2 - sai_valor ** 2
+        self.buffer[:, self.ponteiro] = precos
+        self.ponteiro = (self.ponteiro + 1) % SEMANAS_BUFFER
+
+    def aplicar_semana(self, precos_semana, data_final):
+        """
+        Acrescenta uma semana (saída de precos_por_serie) ao estado
 
-# Converter as colunas de preços para numérico
-df_resultado_limpo_atual['OLEO DIESEL S10'] = pd.to_numeric(df_resultado_limpo_atual['OLEO DIESEL S10'], errors='coerce')
-df_resultado_limpo_atual['OLEO DIESEL'] = pd.to_numeric(df_resultado_limpo_atual['OLEO DIESEL'], errors='coerce')
+        Returns:
+            False se a semana não é posterior à última aplicada (nada é alterado)
+        """
+        data_final = pd.Timestamp(data_final)
+        if self.ultima_data_final is not None and data_final <= self.ultima_data_final:
+            return False
+
+        precos_lidos = precos_semana['PRECO'].to_numpy(dtype='float64', copy=True)
+        posicoes = self._posicoes(precos_semana[CHAVES_SERIE].astype('string').reset_index(drop=True), precos_lidos)
+        precos = np.full(len(self.series), np.nan)
+        precos[posicoes] = precos_lidos
+
+        # Semanas sem publicação entre a última aplicada e esta entram vazias
+        if self.ultima_data_final is not None:
+            lacunas = (data_final - self.ultima_data_final).days // 7 - 1
+            for _ in range(min(max(lacunas, 0), SEMANAS_BUFFER)):
+                self._empurrar(np.full(len(self.series), np.nan))
+
+        self._empurrar(precos)
+        self.ultima_data_final = data_final
+        return True
+
+    def indicadores(self):
+        """Tabela compacta da última semana: preço, médias de 4/12 semanas, volatilidade e variação anual"""
+        atual = self.buffer[:, (self.ponteiro - 1) % SEMANAS_BUFFER]
+        ano_anterior = self.buffer[:, self.ponteiro % SEMANAS_BUFFER]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            referencia = self.somas['REFERENCIA']
+            desvio_4 = np.where(self.somas['N_4'] > 0, self.somas['SOMA_4'] / self.somas['N_4'], np.nan)
+            desvio_12 = np.where(self.somas['N_12'] > 0, self.somas['SOMA_12'] / self.somas['N_12'], np.nan)
+            media_4, media_12 = referencia + desvio_4, referencia + desvio_12
+            variancia_12 = self.somas['SOMA_QUADRADOS_12'] / self.somas['N_12'] - desvio_12 ** 2
+            volatilidade_12 = np.where(self.somas['N_12'] > 1, np.sqrt(np.clip(variancia_12, 0, None)), np.nan)
+            variacao_anual = (atual / ano_anterior - 1) * 100
+
+        indicadores = self.series.assign(
+            DATA_FINAL=self.ultima_data_final.date() if self.ultima_data_final is not None else None,
+            PRECO=atual,
+            MEDIA_4_SEMANAS=media_4,
+            MEDIA_12_SEMANAS=media_12,
+            VOLATILIDADE_12_SEMANAS=volatilidade_12,
+            VARIACAO_ANUAL_PERCENTUAL=variacao_anual,
+        )
+        return indicadores[~np.isnan(atual)].reset_index(drop=True)
+
+def atualizar_indicadores(reconstruir=False):
+    """
+    Aplica ao estado de cada nível apenas as semanas do histórico local posteriores à última
+    aplicada e grava a tabela compacta de indicadores no diretório de saída
 
-df_resultado_limpo_anterior['OLEO DIESEL S10'] = pd.to_numeric(df_resultado_limpo_anterior['OLEO DIESEL S10'], errors='coerce')
-df_resultado_limpo_anterior['OLEO DIESEL'] = pd.to_numeric(df_resultado_limpo_anterior['OLEO DIESEL'], errors='coerce')
+    Args:
+        reconstruir: Descarta o estado e reprocessa todo o histórico local (necessário após um
+                     backfill de semanas antigas ou correção de uma semana já aplicada)
+    """
+    print("\n" + "="*80)
+    print("ATUALIZANDO INDICADORES MÓVEIS (4/12 SEMANAS, VOLATILIDADE, VARIAÇÃO ANUAL)")
+    print("="*80)
+
+    tabelas = []
+    for nome_aba, (nome_tabela, _) in ABAS.items():
+        estado = (None if reconstruir else EstadoIndicadores.carregar(nome_aba)) or EstadoIndicadores(nome_aba)
+        ultima = estado.ultima_data_final.date() if estado.ultima_data_final is not None else None
+        pendentes = sorted(data for data in semanas_historico(nome_tabela) if ultima is None or data > ultima)
+
+        for data_final in pendentes:
+            df_semana = pd.read_parquet(caminho_historico(nome_tabela, data_final))
+            estado.aplicar_semana(precos_por_serie(df_semana, nome_aba), data_final)
+        if pendentes:
+            estado.salvar()
+
+        print(f"   {nome_tabela}: {len(pendentes)} semana(s) aplicada(s), {len(estado)} séries")
+        tabelas.append(estado.indicadores())
+
+    indicadores = pd.concat(tabelas, ignore_index=True)
+    caminho = os.path.join(diretorio_saida(), NOME_INDICADORES)
+    indicadores.to_parquet(caminho + '.tmp', index=False)
+    os.replace(caminho + '.tmp', caminho)
+    print(f"✅ {len(indicadores)} indicadores salvos em {caminho}")
+    return indicadores
 
-# Calcular a diferença entre os DataFrames
-df_diferenca = df_resultado_limpo_atual.set_index('CAPITAIS') - df_resultado_limpo_anterior.set_index('CAPITAIS')
+# ============================================================================
+# COMPARAÇÃO - SEMANA ATUAL x SEMANA ANTERIOR
+# ============================================================================
 
-# Calcular a variação percentual
-df_variacao_percentual = ((df_diferenca) / df_resultado_limpo_anterior.set_index('CAPITAIS')) * 100
+# Colunas lidas nas comparações (as demais estatísticas de preço não são usadas)
+COLUNAS_COMPARACAO = ['DATA_INICIAL', 'DATA_FINAL', 'PRODUTO', 'PRECO_MEDIO_REVENDA']
 
-# Criar um DataFrame comparativo com MultiIndex
-df_comparativo = pd.concat(
-    [
-        df_diferenca.rename(columns=lambda x: ('Diferença', x)), 
-        df_variacao_percentual.rename(columns=lambda x: ('Variação Percentual', x))
-    ], 
-    axis=1
-)
+def ler_semanas_bigquery(nome_tabela, datas, produtos=None, colunas_local=()):
+    """
+    Lê apenas as semanas, produtos e colunas necessários de uma tabela do BigQuery
 
-# Ajustar para ter colunas em um MultiIndex sem o prefixo "PRODUTO"
-df_comparativo.columns = pd.MultiIndex.from_tuples(df_comparativo.columns)
+    Args:
+        nome_tabela: Tabela no dataset (ex.: 'Capitais')
+        datas: Datas iniciais (datetime) das semanas desejadas
+        produtos: Produtos a filtrar (padrão: todos)
+        colunas_local: Colunas de localização a incluir (ex.: ['ESTADO', 'MUNICIPIO'])
+    """
+    colunas = COLUNAS_COMPARACAO[:2] + list(colunas_local) + COLUNAS_COMPARACAO[2:]
+    query = f"""
+    SELECT {', '.join(colunas)}
+    FROM `{tabela_bigquery(nome_tabela)}`
+    WHERE DATA_INICIAL IN UNNEST(@datas)
+    """
+    parametros = {'datas': list(datas)}
+    if produtos:
+        query += "  AND PRODUTO IN UNNEST(@produtos)\n"
+        parametros['produtos'] = list(produtos)
+
+    df = ler_gbq(query, parametros)
+    df['DATA_INICIAL'] = pd.to_datetime(df['DATA_INICIAL'])
+    df['DATA_FINAL'] = pd.to_datetime(df['DATA_FINAL'])
+    return df
+
+def ler_semanas(nome_tabela, datas, produtos=None, colunas_local=(), fonte='auto'):
+    """Lê as semanas do histórico local ou do BigQuery conforme a fonte escolhida"""
+    if fonte == 'auto':
+        fonte = 'local' if historico_tem_semanas(nome_tabela, datas) else 'bigquery'
+    print(f"   📂 {nome_tabela}: lendo do {'histórico local' if fonte == 'local' else 'BigQuery'}")
+    if fonte == 'local':
+        return ler_semanas_local(nome_tabela, datas, produtos, colunas_local)
+    return ler_semanas_bigquery(nome_tabela, datas, produtos, colunas_local)
+
+def obter_ultima_semana(fonte='auto'):
+    """Data inicial mais recente (quando a ingestão não roda na mesma execução)"""
+    semanas_locais = semanas_historico('Brasil') if fonte != 'bigquery' else set()
+    if semanas_locais:
+        data_atual = pd.Timestamp(max(semanas_locais)) - timedelta(days=6)
+    elif fonte == 'local':
+        raise FileNotFoundError(f"Histórico local vazio em {diretorio_historico()}; execute 'sincronizacao' ou 'ingestao'")
+    else:
+        resultado = ler_gbq(f"SELECT MAX(DATA_INICIAL) AS DATA_INICIAL FROM `{tabela_bigquery('Brasil')}`")
+        data_atual = pd.to_datetime(resultado['DATA_INICIAL'].iloc[0])
+    return data_atual.strftime('%d/%m/%Y'), (data_atual - timedelta(days=7)).strftime('%d/%m/%Y')
 
-# Exibir o DataFrame comparativo
-print("DataFrame Comparativo:\n", df_comparativo)
+def colunas_local(nome_aba):
+    """Colunas de localização de um nível (entre DATA_FINAL e PRODUTO)"""
+    colunas = ABAS[nome_aba][1]
+    return colunas[2:colunas.index('PRODUTO')]
 
-# Filtrar as capitais que tiveram uma variação absoluta maior que 2% (positiva ou negativa)
-df_variacao_maior_que_2 = df_comparativo[
-    (df_comparativo[('Variação Percentual', 'OLEO DIESEL S10')].abs() > 2) | 
-    (df_comparativo[('Variação Percentual', 'OLEO DIESEL')].abs() > 2)
-]
+def imprimir_precos_medios(df, local, data_atual):
+    """Imprime o PRECO_MEDIO_REVENDA de cada produto na data atual"""
+    df_atual = df[df['DATA_INICIAL'] == datetime.strptime(data_atual, '%d/%m/%Y')]
+    precos = df_atual[df_atual['PRODUTO'].isin(produtos_ordem)].set_index('PRODUTO')['PRECO_MEDIO_REVENDA']
 
-# Ordenar as capitais filtradas em ordem alfabética
-df_variacao_maior_que_2_ordenado = df_variacao_maior_que_2.sort_index
+    # Formatar o print desejado
+    print("{} o PRECO_MEDIO_REVENDA dos produtos na data ({}) foram:\n".format(local, data_atual))
+    for produto in produtos_ordem:
+        print(f"{produto:<20} {precos.get(produto, '-')}")
+
+# Colunas do DataFrame de variações semanais (todos os níveis)
+COLUNAS_VARIACOES = ['NIVEL', 'ESTADO', 'LOCAL', 'ROTULO', 'PRODUTO', 'PRECO_ATUAL', 'PRECO_ANTERIOR',
+                     'DIFERENCA', 'VARIACAO_PERCENTUAL']
+
+# Colunas dos preços da semana atual (todos os níveis)
+COLUNAS_PRECOS_ATUAIS = ['NIVEL', 'ESTADO', 'LOCAL', 'ROTULO', 'PRODUTO', 'PRECO_ATUAL']
+
+def identificar_locais(df, nivel):
+    """Acrescenta NIVEL, ESTADO, LOCAL (o local mais específico do nível) e ROTULO"""
+    df = df.assign(NIVEL=nivel, LOCAL=df[colunas_local(nivel)[-1]])
+    if 'ESTADO' not in df.columns:
+        df['ESTADO'] = pd.NA
+    # Municípios homônimos são distinguidos pelo estado
+    df['ROTULO'] = df['LOCAL'] + ' (' + df['ESTADO'] + ')' if nivel == 'MUNICIPIOS' else df['LOCAL']
+    return df
+
+def precos_da_semana(df, nivel, semana):
+    """Preços de todos os produtos × locais de um nível em uma semana (antes de qualquer junção)"""
+    chaves = colunas_local(nivel) + ['PRODUTO']
+    # Máscara em vez de rótulos do índice: frames concatenados podem repetir rótulos
+    semana_df = df.loc[df['DATA_INICIAL'] == semana, chaves + ['PRECO_MEDIO_REVENDA']]
+    return semana_df.assign(PRECO=pd.to_numeric(semana_df['PRECO_MEDIO_REVENDA'], errors='coerce'))[chaves + ['PRECO']]
+
+def calcular_variacoes(df, nivel, semana_atual, semana_anterior):
+    """
+    Variação absoluta e percentual de todos os produtos × locais de um nível entre duas semanas
 
-# ... TODO SEU CÓDIGO ORIGINAL ATÉ AQUI ...
+    Returns:
+        DataFrame com NIVEL, ESTADO, LOCAL, ROTULO, PRODUTO, PRECO_ATUAL, PRECO_ANTERIOR,
+        DIFERENCA e VARIACAO_PERCENTUAL (um registro por local e produto presentes nas duas semanas)
+    """
+    chaves = colunas_local(nivel) + ['PRODUTO']
+    atual = precos_da_semana(df, nivel, semana_atual)
+    anterior = precos_da_semana(df, nivel, semana_anterior)
 
-# Filtrar as capitais que tiveram uma variação absoluta maior que 2% (positiva ou negativa)
-df_variacao_maior_que_2 = df_comparativo[
-    (df_comparativo[('Variação Percentual', 'OLEO DIESEL S10')].abs() > 2) | 
-    (df_comparativo[('Variação Percentual', 'OLEO DIESEL')].abs() > 2)
-]
+    variacoes = atual.merge(anterior, on=chaves, suffixes=('_ATUAL', '_ANTERIOR')).dropna(
+        subset=['PRECO_ATUAL', 'PRECO_ANTERIOR'])
+    variacoes['DIFERENCA'] = variacoes['PRECO_ATUAL'] - variacoes['PRECO_ANTERIOR']
+    variacoes['VARIACAO_PERCENTUAL'] = variacoes['DIFERENCA'] / variacoes['PRECO_ANTERIOR'] * 100
 
-# Ordenar as capitais filtradas em ordem alfabética
-df_variacao_maior_que_2_ordenado = df_variacao_maior_que_2.sort_index
+    return identificar_locais(variacoes, nivel)[COLUNAS_VARIACOES].reset_index(drop=True)
 
-# ============================================================================
-# ADICIONE DAQUI PARA BAIXO (SUBSTITUA A LINHA INCOMPLETA ACIMA)
-# ============================================================================
+def calcular_precos_atuais(df, nivel, semana_atual):
+    """Preços da semana atual de todos os locais, inclusive os sem registro na semana anterior (ranking)"""
+    atual = precos_da_semana(df, nivel, semana_atual).rename(columns={'PRECO': 'PRECO_ATUAL'})
+    return identificar_locais(atual, nivel)[COLUNAS_PRECOS_ATUAIS].reset_index(drop=True)
 
-# Ordenar as capitais filtradas em ordem alfabética
-df_variacao_maior_que_2_ordenado = df_variacao_maior_que_2.sort_index()
+# Limiar padrão (em %) para uma variação semanal ser considerada relevante
+LIMIAR_VARIACAO_PADRAO = 2.0
 
-# Renomear para df_top_5_capitais para compatibilidade com o código novo
-df_top_5_capitais = df_variacao_maior_que_2_ordenado
+def selecionar_relevantes(variacoes, limiar=LIMIAR_VARIACAO_PADRAO, limiares_nivel=None):
+    """Variações cujo valor absoluto supera o limiar do nível (ou o limiar geral)"""
+    limiares = variacoes['NIVEL'].map(limiares_nivel or {}).astype('float64').fillna(limiar)
+    return variacoes[variacoes['VARIACAO_PERCENTUAL'].abs() > limiares]
 
-print("\n" + "="*100)
-print("📝 GERAÇÃO DE RELATÓRIO AUTOMÁTICO")
-print("="*100)
+def comparar_semanas(data_atual, data_anterior, fonte='auto', limiar=LIMIAR_VARIACAO_PADRAO, limiares_nivel=None):
+    """Compara as duas semanas em todos os níveis e salva as variações para o relatório"""
+    print(f'Semana atual: {data_atual}')
+    print(f'Semana anterior: {data_anterior}')
+    semana_atual_data = datetime.strptime(data_atual, '%d/%m/%Y')
+    semana_anterior_data = datetime.strptime(data_anterior, '%d/%m/%Y')
+    semanas = [semana_atual_data, semana_anterior_data]
 
-# Converter as datas para o formato desejado (%d-%m-%Y)
-semana_anterior_formatada = semana_anterior_data.strftime("%d/%m/%Y")
-semana_atual_formatada = semana_atual_data.strftime("%d/%m/%Y")
+    # Uma leitura das duas semanas por nível atende aos resumos e às variações
+    dados = {nome_aba: ler_semanas(nome_tabela, semanas, colunas_local=colunas_local(nome_aba), fonte=fonte)
+             for nome_aba, (nome_tabela, _) in ABAS.items()}
 
-# Solicitar a ultima data da semana_atual
-nova_data = input("Por favor, informe a data da ultima data da semana_atual no formato (dia/mês/ano): ")
-nova_data_formatada = datetime.strptime(nova_data, "%d/%m/%Y")
+    imprimir_precos_medios(dados['BRASIL'], "No Brasil", data_atual)
 
-# Calcular a data da semana anterior à próxima semana
-semana_anterior_proxima = nova_data_formatada - timedelta(days=7)
+    # Filtrar os dados pelo estado SÃO PAULO
+    df_sp = dados['CAPITAIS']
+    imprimir_precos_medios(df_sp[df_sp['ESTADO'].isin(['SAO PAULO'])], "Em SAO PAULO", data_atual)
+
+    variacoes = pd.concat([calcular_variacoes(df, nome_aba, semana_atual_data, semana_anterior_data)
+                           for nome_aba, df in dados.items()], ignore_index=True)
+
+    precos_atuais = pd.concat([calcular_precos_atuais(df, nome_aba, semana_atual_data)
+                               for nome_aba, df in dados.items()], ignore_index=True)
+
+    relevantes = selecionar_relevantes(variacoes, limiar, limiares_nivel)
+    print("\nVariações semanais por nível (relevantes = acima do limiar):")
+    print(pd.DataFrame({'comparados': variacoes.groupby('NIVEL').size(),
+                        'relevantes': relevantes.groupby('NIVEL').size()}).fillna(0).astype(int))
+
+    # Última data da semana atual (antes informada manualmente no relatório)
+    datas_finais = dados['BRASIL'].loc[dados['BRASIL']['DATA_INICIAL'] == semana_atual_data, 'DATA_FINAL']
+    data_final = datas_finais.max().strftime('%d/%m/%Y') if len(datas_finais) else None
+
+    comparacao = {
+        'data_atual': data_atual,
+        'data_anterior': data_anterior,
+        'data_final': data_final,
+        'variacoes': variacoes,
+        'precos_atuais': precos_atuais,
+    }
+    salvar_comparacao(comparacao)
+    return comparacao
+
+def salvar_comparacao(comparacao):
+    """Guarda as datas (JSON) e as variações (Parquet) para regenerar o relatório sem consultar o BigQuery"""
+    metadados = {chave: valor for chave, valor in comparacao.items() if chave not in ('variacoes', 'precos_atuais')}
+    with open(os.path.join(diretorio_saida(), NOME_COMPARACAO), 'w', encoding='utf-8') as f:
+        json.dump(metadados, f, ensure_ascii=False, indent=2)
+    comparacao['variacoes'].to_parquet(os.path.join(diretorio_saida(), NOME_VARIACOES), index=False)
+    comparacao['precos_atuais'].to_parquet(os.path.join(diretorio_saida(), NOME_PRECOS_ATUAIS), index=False)
+
+def carregar_comparacao():
+    caminho = os.path.join(diretorio_saida(), NOME_COMPARACAO)
+    caminho_variacoes = os.path.join(diretorio_saida(), NOME_VARIACOES)
+    caminho_precos = os.path.join(diretorio_saida(), NOME_PRECOS_ATUAIS)
+    if not all(os.path.exists(c) for c in (caminho, caminho_variacoes, caminho_precos)):
+        raise FileNotFoundError(f"Comparação não encontrada em {diretorio_saida()}; execute a etapa 'comparacao' antes")
+    with open(caminho, 'r', encoding='utf-8') as f:
+        comparacao = json.load(f)
+    comparacao['variacoes'] = pd.read_parquet(caminho_variacoes)
+    comparacao['precos_atuais'] = pd.read_parquet(caminho_precos)
+    return comparacao
 
-# Construir o texto
-texto = f"""
-O Painel do Diesel foi atualizado com os dados da semana {semana_atual_formatada} a {nova_data_formatada.strftime("%d/%m/%Y")}.
+# ============================================================================
+# RELATÓRIO - TEXTO DO PAINEL DO DIESEL
+# ============================================================================
 
-- Conforme análise comparativa da semana {semana_anterior_formatada} a {semana_anterior_proxima.strftime("%d/%m/%Y")} com a semana {semana_atual_formatada} a {nova_data_formatada.strftime("%d/%m/%Y")}, foram identificados alguns indicadores relevantes, sendo eles:
+# Produtos do Painel do Diesel, na ordem e com o nome usados no texto
+PRODUTOS_RELATORIO = {'OLEO DIESEL': 'diesel comum', 'OLEO DIESEL S10': 'diesel S10'}
+
+def renderizar_variacoes(relevantes, produtos=PRODUTOS_RELATORIO):
+    """Uma linha por local: 'LOCAL – Aumentou o valor do ... E Diminuiu o valor do ...'"""
+    df = relevantes[relevantes['PRODUTO'].isin(list(produtos))]
+    df = df.assign(ORDEM=df['PRODUTO'].map({produto: i for i, produto in enumerate(produtos)}))
+    df = df.sort_values(['ROTULO', 'ORDEM'])
+
+    verbos = pd.Series('Diminuiu', index=df.index).mask(df['VARIACAO_PERCENTUAL'] > 0, 'Aumentou')
+    frases = (verbos + " o valor do " + df['PRODUTO'].map(produtos)
+              + " em " + df['VARIACAO_PERCENTUAL'].abs().round(2).map('{:.2f}'.format)
+              + "% (Valor atual: R$ " + df['PRECO_ATUAL'].round(2).map('{:.2f}'.format) + ").")
+    linhas = frases.groupby(df['ROTULO'], sort=True).agg(" E ".join)
+    return (linhas.index + " – " + linhas).tolist()
+
+def gerar_relatorio(comparacao, data_final=None, limiar=LIMIAR_VARIACAO_PADRAO, limiares_nivel=None, nivel='CAPITAIS'):
+    """Monta o texto do relatório e o ranking de preços a partir das variações salvas"""
+    variacoes = comparacao['variacoes']
+    variacoes = variacoes[variacoes['NIVEL'] == nivel]
+    precos_semana = comparacao['precos_atuais']
+    precos_semana = precos_semana[precos_semana['NIVEL'] == nivel]
+    if nivel == 'CAPITAIS':
+        variacoes = variacoes[variacoes['LOCAL'].isin(capitais)]
+        precos_semana = precos_semana[precos_semana['LOCAL'].isin(capitais)]
+
+    print("\n" + "="*100)
+    print("📝 GERAÇÃO DE RELATÓRIO AUTOMÁTICO")
+    print("="*100)
+
+    data_final = data_final or comparacao.get('data_final')
+    if not data_final:
+        raise ValueError("Última data da semana atual desconhecida; informe --data-final dd/mm/aaaa")
+
+    semana_atual_data = datetime.strptime(comparacao['data_atual'], "%d/%m/%Y")
+    semana_anterior_data = datetime.strptime(comparacao['data_anterior'], "%d/%m/%Y")
+    nova_data_formatada = datetime.strptime(data_final, "%d/%m/%Y")
+
+    # Calcular a data da semana anterior à próxima semana
+    semana_anterior_proxima = nova_data_formatada - timedelta(days=7)
+
+    # Construir o texto
+    texto = f"""
+O Painel do Diesel foi atualizado com os dados da semana {semana_atual_data.strftime("%d/%m/%Y")} a {nova_data_formatada.strftime("%d/%m/%Y")}.
+
+- Conforme análise comparativa da semana {semana_anterior_data.strftime("%d/%m/%Y")} a {semana_anterior_proxima.strftime("%d/%m/%Y")} com a semana {semana_atual_data.strftime("%d/%m/%Y")} a {nova_data_formatada.strftime("%d/%m/%Y")}, foram identificados alguns indicadores relevantes, sendo eles:
 """
+    print(texto)
+
+    # Concatenar os textos dos locais, incluindo uma linha em branco após cada um
+    texto_parte2_final = "\n\n".join(renderizar_variacoes(selecionar_relevantes(variacoes, limiar, limiares_nivel)))
+    print("\n📊 ANÁLISE DAS VARIAÇÕES SIGNIFICATIVAS:")
+    print(texto_parte2_final)
+
+    # Preço médio (S10 e comum) de cada local com os dois produtos na semana atual, para o mais caro e o mais barato
+    precos_atuais = precos_semana.pivot_table(index='ROTULO', columns='PRODUTO', values='PRECO_ATUAL')
+    precos_atuais = precos_atuais.reindex(columns=list(PRODUTOS_RELATORIO)).dropna()
+    if not precos_atuais.empty:
+        preco_medio = precos_atuais.mean(axis=1)
+        local_mais_caro, local_mais_barato = preco_medio.idxmax(), preco_medio.idxmin()
+        termo = "A capital" if nivel == 'CAPITAIS' else "O local"
+
+        print("\n" + "="*80)
+        print("🏆 RANKING DE PREÇOS")
+        print("="*80)
+        print(f"\n*{termo} com diesel MAIS CARO é", local_mais_caro, "com os seguintes valores:")
+        print("Diesel S10:", "R$", precos_atuais.loc[local_mais_caro, 'OLEO DIESEL S10'])
+        print("Diesel comum:", "R$", precos_atuais.loc[local_mais_caro, 'OLEO DIESEL'])
+        print(f"\n*{termo} com diesel MAIS BARATO é", local_mais_barato, "com os seguintes valores:")
+        print("Diesel S10:", "R$", precos_atuais.loc[local_mais_barato, 'OLEO DIESEL S10'])
+        print("Diesel comum:", "R$", precos_atuais.loc[local_mais_barato, 'OLEO DIESEL'])
+
+    return texto + "\n" + texto_parte2_final
+
+# ============================================================================
+# EXECUÇÃO - QUALQUER SUBCONJUNTO DAS ETAPAS
+# ============================================================================
 
-# Exibir o texto
-print(texto)
-
-# Obter os preços atuais de diesel comum e diesel S10 para cada capital
-precos_atuais = df_resultado_limpo_atual.set_index('CAPITAIS')[['OLEO DIESEL', 'OLEO DIESEL S10']]
-
-# Filtrar os valores de variação maiores que 2% ou menores que -2%
-filtro_variacao_maior_que_2 = df_top_5_capitais[('Variação Percentual', 'OLEO DIESEL')].abs() > 2
-filtro_variacao_menor_que_menos2 = df_top_5_capitais[('Variação Percentual', 'OLEO DIESEL')].abs() < -2
-filtro_variacao_diesel_s10_maior_que_2 = df_top_5_capitais[('Variação Percentual', 'OLEO DIESEL S10')].abs() > 2
-filtro_variacao_diesel_s10_menor_que_menos2 = df_top_5_capitais[('Variação Percentual', 'OLEO DIESEL S10')].abs() < -2
-
-# Aplicar os filtros
-df_top_5_capitais_filtrado = df_top_5_capitais[(filtro_variacao_maior_que_2 | filtro_variacao_menor_que_menos2 | filtro_variacao_diesel_s10_maior_que_2 | filtro_variacao_diesel_s10_menor_que_menos2)]
-
-# Inicializar uma lista para armazenar as informações de cada capital
-texto_capitais = []
-
-# Percorrer as capitais do DataFrame filtrado
-for capital, variacoes in df_top_5_capitais_filtrado.iterrows():
-    # Inicializar uma lista para armazenar as informações de variação para a capital atual
-    texto_variacoes = []
-    
-    # Verificar se há variação de preço do diesel comum maior que 2% ou menor que -2%
-    if abs(variacoes[('Variação Percentual', 'OLEO DIESEL')]) > 2:
-        # Extrair informações da variação do diesel comum
-        var_diesel_comum_percentual = variacoes[('Variação Percentual', 'OLEO DIESEL')]
-        preco_atual_diesel_comum = precos_atuais.loc[capital, 'OLEO DIESEL']
-        # Gerar o texto correspondente
-        if var_diesel_comum_percentual > 0:
-            texto_diesel_comum = f"Aumentou o valor do diesel comum em {abs(var_diesel_comum_percentual):.2f}% (Valor atual: R$ {preco_atual_diesel_comum:.2f})."
-        elif var_diesel_comum_percentual < 0:
-            texto_diesel_comum = f"Diminuiu o valor do diesel comum em {abs(var_diesel_comum_percentual):.2f}% (Valor atual: R$ {preco_atual_diesel_comum:.2f})."
-        texto_variacoes.append(texto_diesel_comum)
-        
-    # Verificar se há variação de preço do diesel S10 maior que 2% ou menor que -2%
-    if abs(variacoes[('Variação Percentual', 'OLEO DIESEL S10')]) > 2:
-        # Extrair informações da variação do diesel S10
-        var_diesel_s10_percentual = variacoes[('Variação Percentual', 'OLEO DIESEL S10')]
-        preco_atual_diesel_s10 = precos_atuais.loc[capital, 'OLEO DIESEL S10']
-        # Gerar o texto correspondente
-        if var_diesel_s10_percentual > 0:
-            texto_diesel_s10 = f"Aumentou o valor do diesel S10 em {abs(var_diesel_s10_percentual):.2f}% (Valor atual: R$ {preco_atual_diesel_s10:.2f})."
-        elif var_diesel_s10_percentual < 0:
-            texto_diesel_s10 = f"Diminuiu o valor do diesel S10 em {abs(var_diesel_s10_percentual):.2f}% (Valor atual: R$ {preco_atual_diesel_s10:.2f})."
-        texto_variacoes.append(texto_diesel_s10)
-        
-    # Adicionar o nome da capital ao texto
-    texto_capital = capital + " – " + " E ".join(texto_variacoes)
-    texto_capitais.append(texto_capital)
-
-# Concatenar os textos das capitais
-texto_parte2_corrigido = "\n".join(texto_capitais)
-
-# Adicionar informações de São Paulo mesmo se não houver variação maior que 2% ou menor que -2%
-var_diesel_comum_sp = df_resultado_limpo_atual.loc[df_resultado_limpo_atual['CAPITAIS'] == 'SAO PAULO', 'OLEO DIESEL'].values[0]
-var_diesel_s10_sp = df_resultado_limpo_atual.loc[df_resultado_limpo_atual['CAPITAIS'] == 'SAO PAULO', 'OLEO DIESEL S10'].values[0]
-
-texto_diesel_s10_sp = ""
-texto_diesel_comum_sp = ""
-
-# Inicializar uma lista para armazenar as informações de variação para São Paulo
-texto_variacoes_sp = []
-
-# Verificar se houve variação de preço do diesel comum em São Paulo
-if 'SAO PAULO' in df_top_5_capitais.index:
-    variacao_percentual_diesel_comum_sp = df_top_5_capitais.loc['SAO PAULO', ('Variação Percentual', 'OLEO DIESEL')]
-    variacao_percentual_diesel_s10_sp = df_top_5_capitais.loc['SAO PAULO', ('Variação Percentual', 'OLEO DIESEL S10')]
-    
-    if abs(variacao_percentual_diesel_comum_sp) > 2:
-        # Gerar o texto correspondente
-        if variacao_percentual_diesel_comum_sp > 0:
-            texto_diesel_comum_sp = f"Aumentou o valor do diesel comum em {abs(variacao_percentual_diesel_comum_sp):.2f}% (Valor atual: R$ {var_diesel_comum_sp:.2f})."
-        elif variacao_percentual_diesel_comum_sp < 0:
-            texto_diesel_comum_sp = f"Diminuiu o valor do diesel comum em {abs(variacao_percentual_diesel_comum_sp):.2f}% (Valor atual: R$ {var_diesel_comum_sp:.2f})."        
-        texto_variacoes_sp.append(texto_diesel_comum_sp)
-
-    # Verificar se houve variação de preço do diesel S10 em São Paulo
-    if abs(variacao_percentual_diesel_s10_sp) > 2:
-        # Gerar o texto correspondente
-        if variacao_percentual_diesel_s10_sp > 0:
-            texto_diesel_s10_sp = f"Aumentou o valor do diesel S10 em {abs(variacao_percentual_diesel_s10_sp):.2f}% (Valor atual: R$ {var_diesel_s10_sp:.2f})."
-        elif variacao_percentual_diesel_s10_sp < 0:
-            texto_diesel_s10_sp = f"Diminuiu o valor do diesel S10 em {abs(variacao_percentual_diesel_s10_sp):.2f}% (Valor atual: R$ {var_diesel_s10_sp:.2f})."        
-        texto_variacoes_sp.append(texto_diesel_s10_sp)
-
-    # Adicionar São Paulo ao texto das capitais se houver variações
-    if texto_variacoes_sp:
-        texto_sp = "SAO PAULO – " + " E ".join(texto_variacoes_sp)
-        texto_capitais.append(texto_sp)
-
-# Concatenar os textos das capitais, incluindo uma linha em branco após cada capital
-texto_parte2_final = "\n\n".join(texto_capitais)
-
-# Exibir o texto final
-print("\n📊 ANÁLISE DAS VARIAÇÕES SIGNIFICATIVAS:")
-print(texto_parte2_final)
-
-# Calcular o preço médio para cada capital
-df_resultado_limpo_atual['Preço Médio'] = (df_resultado_limpo_atual['OLEO DIESEL S10'] + df_resultado_limpo_atual['OLEO DIESEL']) / 2
-
-# Converter a coluna 'Preço Médio' para tipo numérico
-df_resultado_limpo_atual['Preço Médio'] = pd.to_numeric(df_resultado_limpo_atual['Preço Médio'])
-
-# Encontrar o índice do preço médio mais alto e mais baixo
-indice_diesel_mais_caro = df_resultado_limpo_atual['Preço Médio'].idxmax()
-indice_diesel_mais_barato = df_resultado_limpo_atual['Preço Médio'].idxmin()
-
-# Extrair as informações das capitais com os preços mais caro e mais barato
-capital_diesel_mais_caro = df_resultado_limpo_atual.loc[indice_diesel_mais_caro, 'CAPITAIS']
-capital_diesel_mais_barato = df_resultado_limpo_atual.loc[indice_diesel_mais_barato, 'CAPITAIS']
-
-# Retornar os resultados formatados
-print("\n" + "="*80)
-print("🏆 RANKING DE PREÇOS")
-print("="*80)
-print("\n*A capital com diesel MAIS CARO é", capital_diesel_mais_caro, "com os seguintes valores:")
-print("Diesel S10:", "R$", df_resultado_limpo_atual.loc[indice_diesel_mais_caro, 'OLEO DIESEL S10'])
-print("Diesel comum:", "R$", df_resultado_limpo_atual.loc[indice_diesel_mais_caro, 'OLEO DIESEL'])
-print("\n*A capital com diesel MAIS BARATO é", capital_diesel_mais_barato, "com os seguintes valores:")
-print("Diesel S10:", "R$", df_resultado_limpo_atual.loc[indice_diesel_mais_barato, 'OLEO DIESEL S10'])
-print("Diesel comum:", "R$", df_resultado_limpo_atual.loc[indice_diesel_mais_barato, 'OLEO DIESEL'])
-
-print("\n" + "="*100)
-print("✅ PROCESSO CONCLUÍDO COM SUCESSO!")
-print("="*100)
+def executar(etapas=None, arquivo=None, data=None, data_final=None, fonte='auto', salvar_modificada=False,
+             limiar=LIMIAR_VARIACAO_PADRAO, limiares_nivel=None, nivel_relatorio='CAPITAIS',
+             series_historicas=(), nivel_serie=None, backfill_bigquery=True, reconstruir_indicadores=False):
+    """Executa as etapas pedidas, repassando os resultados em memória entre elas"""
+    etapas = etapas or ETAPAS_PADRAO
+    abas = None
+    datas = (data, (datetime.strptime(data, '%d/%m/%Y') - timedelta(days=7)).strftime('%d/%m/%Y')) if data else None
+    comparacao = None
+
+    if 'particionamento' in etapas:
+        particionar_tabelas()
+
+    if 'backfill' in etapas:
+        if not series_historicas:
+            raise ValueError("Informe os arquivos da série histórica com --serie-historica")
+        executar_backfill(series_historicas, nivel_serie, backfill_bigquery)
+
+    if 'ingestao' in etapas:
+        abas, data_atual, data_anterior = ingerir_planilha(arquivo, salvar_modificada)
+        datas = datas or (data_atual, data_anterior)
+        atualizar_historico_local(abas)
+
+    if 'carga' in etapas:
+        carregar_bigquery(abas or ingerir_planilha(arquivo)[0])
+
+    if 'sincronizacao' in etapas:
+        sincronizar_historico()
+
+    if 'indicadores' in etapas:
+        # Um backfill pode trazer semanas anteriores às já aplicadas: o estado é refeito
+        atualizar_indicadores(reconstruir_indicadores or 'backfill' in etapas)
+
+    if 'comparacao' in etapas:
+        comparacao = comparar_semanas(*(datas or obter_ultima_semana(fonte)), fonte, limiar, limiares_nivel)
+
+    if 'relatorio' in etapas:
+        gerar_relatorio(comparacao or carregar_comparacao(), data_final, limiar, limiares_nivel, nivel_relatorio)
+
+    print("\n" + "="*100)
+    print("✅ PROCESSO CONCLUÍDO COM SUCESSO!")
+    print("="*100)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Análise semanal dos preços de combustíveis (ANP)")
+    parser.add_argument('etapas', nargs='*', metavar='ETAPA',
+                        help=f"Etapas a executar ({', '.join(ETAPAS)}); padrão: {', '.join(ETAPAS_PADRAO)}")
+    parser.add_argument('--arquivo', help="Planilha da ANP (padrão: .xlsx mais recente do diretório de entrada)")
+    parser.add_argument('--data', help="Data inicial da semana atual, dd/mm/aaaa (padrão: planilha ou BigQuery)")
+    parser.add_argument('--data-final', help="Última data da semana atual, dd/mm/aaaa (padrão: DATA_FINAL dos dados)")
+    parser.add_argument('--salvar-planilha', action='store_true',
+                        help=f"Grava também as abas normalizadas em {NOME_PLANILHA_MODIFICADA} no diretório de saída")
+    parser.add_argument('--fonte', choices=FONTES, default='auto',
+                        help="Origem dos dados da comparação (padrão: histórico local quando completo, senão BigQuery)")
+    parser.add_argument('--limiar', type=float, default=LIMIAR_VARIACAO_PADRAO,
+                        help=f"Variação percentual (absoluta) mínima para ser relevante (padrão: {LIMIAR_VARIACAO_PADRAO})")
+    parser.add_argument('--limiar-nivel', action='append', default=[], metavar='NIVEL=PCT',
+                        help="Limiar específico de um nível, ex.: MUNICIPIOS=5 (pode ser repetido)")
+    parser.add_argument('--nivel-relatorio', choices=list(ABAS), default='CAPITAIS',
+                        help="Nível cujas variações entram no texto do relatório (padrão: CAPITAIS)")
+    parser.add_argument('--serie-historica', action='append', default=[], metavar='ARQUIVO',
+                        help="Série histórica consolidada da ANP (.xlsx ou .csv) para a etapa 'backfill' (pode ser repetido)")
+    parser.add_argument('--nivel-serie', choices=list(ABAS),
+                        help="Nível da série histórica (padrão: nome da aba ou do arquivo; por último, as colunas de localização)")
+    parser.add_argument('--backfill-apenas-local', action='store_true',
+                        help="No backfill, grava apenas o histórico local, sem carregar no BigQuery")
+    parser.add_argument('--reconstruir-indicadores', action='store_true',
+                        help="Refaz o estado dos indicadores móveis a partir de todo o histórico local")
+    args = parser.parse_args(argv)
+
+    limiares_nivel = {}
+    for item in args.limiar_nivel:
+        nivel, _, valor = item.partition('=')
+        try:
+            limiares_nivel[nivel.strip().upper()] = float(valor)
+        except ValueError:
+            parser.error(f"Limiar inválido '{item}' (use NIVEL=PCT)")
+        if nivel.strip().upper() not in ABAS:
+            parser.error(f"Nível desconhecido em '{item}' (opções: {', '.join(ABAS)})")
+
+    invalidas = [etapa for etapa in args.etapas if etapa not in ETAPAS]
+    if invalidas:
+        parser.error(f"Etapa(s) desconhecida(s): {', '.join(invalidas)} (opções: {', '.join(ETAPAS)})")
+    if 'backfill' in args.etapas and not args.serie_historica:
+        parser.error("A etapa 'backfill' exige ao menos um --serie-historica ARQUIVO")
+
+    executar(args.etapas, args.arquivo, args.data, args.data_final, args.fonte, args.salvar_planilha,
+             args.limiar, limiares_nivel, args.nivel_relatorio,
+             args.serie_historica, args.nivel_serie, not args.backfill_apenas_local,
+             args.reconstruir_indicadores)
+
+if __name__ == '__main__':
+    sys.exit(main())